@@ -0,0 +1,496 @@
+# async_server.py
+# Async serving mode: an asyncio HTTP/1.1 server and an ASGI app that keeps crypto and I/O off the event loop
+
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import change_feed
+
+# Routes that run RSA or Harn multi-signature work; they get their own executor
+# so a burst of crypto requests cannot occupy the threads cheap requests need
+CRYPTO_PATHS = frozenset({
+    "/sign_record", "/verify_signature", "/verify_all_signatures", "/verify_ledger", "/seal_block",
+    "/rotate_key", "/api/query_item", "/multi_signature_query", "/api/decrypt_query", "/api/decrypt_batch",
+})
+
+KEEPALIVE_TIMEOUT = 75.0       # Seconds an idle keep-alive connection is kept open
+MAX_HEADERS = 100
+MAX_BODY_BYTES = 16 * 1024 * 1024
+_DONE = object()
+
+STATUS_REASONS = {
+    200: "OK", 201: "Created", 202: "Accepted", 204: "No Content", 304: "Not Modified",
+    400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 410: "Gone",
+    411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class InventoryAsgiApp:
+    """
+    ASGI application serving the Flask app without a thread per connection.
+
+    /events is served natively on the event loop: each stream is a coroutine
+    woken by the ChangeBroadcaster's notify callback, so thousands of open
+    streams cost no threads. Every other request runs the Flask (WSGI) app
+    in an executor thread: CRYPTO_PATHS on `crypto_workers` threads, the
+    rest (including the store's file and SQLite I/O) on `io_workers`
+    threads. The loop itself only parses HTTP and moves bytes.
+    """
+
+    def __init__(self, wsgi_app, feed, current_version, keepalive_seconds=15,
+                 io_workers=32, crypto_workers=None):
+        self.wsgi_app = wsgi_app
+        self.feed = feed
+        self.current_version = current_version
+        self.keepalive_seconds = keepalive_seconds
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="async-io")
+        self.crypto_executor = ThreadPoolExecutor(max_workers=crypto_workers or os.cpu_count() or 1,
+                                                  thread_name_prefix="async-crypto")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    self.close()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        if scope["path"] == "/events" and scope["method"] == "GET":
+            await self._stream_events(receive, send)
+        else:
+            executor = self.crypto_executor if scope["path"] in CRYPTO_PATHS else self.io_executor
+            await self._call_wsgi(scope, receive, send, executor)
+
+    # --- Server-Sent Events on the loop ---
+
+    async def _stream_events(self, receive, send):
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        subscriber = self.feed.subscribe(notify=lambda: loop.call_soon_threadsafe(wakeup.set))
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        version = self.current_version()
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ]})
+            hello = "retry: 3000\n\n" + change_feed.format_sse("hello", {"version": version}, version)
+            await send({"type": "http.response.body", "body": hello.encode('utf-8'), "more_body": True})
+            while not disconnected.done() and not self.feed.is_closed(subscriber):
+                wakeup.clear()
+                messages = []
+                message = self.feed.next_message(subscriber, timeout=0)
+                while message is not None:
+                    messages.append(message)
+                    message = self.feed.next_message(subscriber, timeout=0)
+                if messages:
+                    await send({"type": "http.response.body", "body": "".join(messages).encode('utf-8'),
+                                "more_body": True})
+                    continue
+                waiter = asyncio.ensure_future(wakeup.wait())
+                done, _ = await asyncio.wait({waiter, disconnected}, timeout=self.keepalive_seconds,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if not done:
+                    await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+            if not disconnected.done():
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            disconnected.cancel()
+            self.feed.unsubscribe(subscriber)
+
+    @staticmethod
+    async def _wait_for_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # --- Everything else through the WSGI app, off the loop ---
+
+    async def _call_wsgi(self, scope, receive, send, executor):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        loop = asyncio.get_running_loop()
+        environ = _wsgi_environ(scope, bytes(body))
+        status, headers, iterator, result = await loop.run_in_executor(executor, self._start_wsgi, environ)
+        try:
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            while True:
+                chunk = await loop.run_in_executor(executor, next, iterator, _DONE)
+                if chunk is _DONE:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(executor, result.close)
+
+    def _start_wsgi(self, environ):
+        """Calls the WSGI app until it has started the response (runs in an executor thread)."""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+            return lambda data: started.setdefault("written", []).append(data)
+
+        result = self.wsgi_app(environ, start_response)
+        iterator = iter(result)
+        first = next(iterator, _DONE)
+        chunks = started.get("written", []) + ([] if first is _DONE else [first])
+        return started["status"], started["headers"], _chain(chunks, iterator, first is _DONE), result
+
+    def close(self):
+        self.io_executor.shutdown(wait=False)
+        self.crypto_executor.shutdown(wait=False)
+
+
+def _chain(chunks, iterator, exhausted):
+    yield from chunks
+    if not exhausted:
+        yield from iterator
+
+
+def _wsgi_environ(scope, body):
+    """Builds a PEP 3333 environ for an ASGI http scope."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode('utf-8').decode('latin-1'),
+        "PATH_INFO": scope["path"].encode('utf-8').decode('latin-1'),
+        "QUERY_STRING": scope.get("query_string", b"").decode('latin-1'),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode('latin-1').upper().replace("-", "_")
+        value = raw_value.decode('latin-1')
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            environ[name] = value
+            continue
+        key = "HTTP_" + name
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    environ.setdefault("CONTENT_LENGTH", str(len(body)))
+    return environ
+
+
+# --- Minimal asyncio HTTP/1.1 server for the ASGI app (no third-party server needed) ---
+
+class _HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+async def _read_request(reader):
+    """Reads one request head; returns (method, target, version, headers) or None at EOF."""
+    line = await reader.readline()
+    if not line:
+        return None
+    if line in (b"\r\n", b"\n"):  # Tolerate a stray CRLF between requests
+        line = await reader.readline()
+    parts = line.decode('latin-1').rstrip("\r\n").split(" ")
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise _HttpError(400)
+    headers = []
+    while True:
+        header_line = await reader.readline()
+        if header_line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS or b":" not in header_line:
+            raise _HttpError(400)
+        name, _, value = header_line.partition(b":")
+        headers.append((name.strip().lower(), value.strip()))
+    return parts[0], parts[1], parts[2][5:], headers
+
+
+def _status_line(status):
+    return f"HTTP/1.1 {status} {STATUS_REASONS.get(status, 'Unknown')}\r\n".encode('latin-1')
+
+
+class AsyncHttpServer:
+    """
+    Serves an ASGI application over HTTP/1.1 with asyncio streams. This is the
+    fallback used when neither uvicorn nor hypercorn is installed (see serve()).
+
+    Each connection is one coroutine, kept alive between requests for up to
+    KEEPALIVE_TIMEOUT idle seconds; responses without a Content-Length are
+    sent chunked. Request bodies need a Content-Length.
+    """
+
+    def __init__(self, application, host="0.0.0.0", port=5001):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  backlog=4096, limit=64 * 1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        """Stops accepting connections and waits for the listening socket to close."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info("peername")
+        local = writer.get_extra_info("sockname")
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(_read_request(reader), KEEPALIVE_TIMEOUT)
+                except _HttpError as e:
+                    writer.write(_status_line(e.status) + b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                if head is None:
+                    break
+                if not await self._handle_request(head, reader, writer, peer, local):
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.connections -= 1
+            try:
+                await writer.drain()
+                writer.close()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _handle_request(self, head, reader, writer, peer, local):
+        """Runs one request through the application; returns True to keep the connection open."""
+        method, target, http_version, headers = head
+        header_map = {name: value for name, value in headers}
+        connection = header_map.get(b"connection", b"").lower()
+        keep_alive = connection != b"close" if http_version == "1.1" else connection == b"keep-alive"
+
+        if b"transfer-encoding" in header_map:
+            writer.write(_status_line(411) + b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        try:
+            length = int(header_map.get(b"content-length", b"0") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            writer.write(_status_line(400) + b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        if length > MAX_BODY_BYTES:
+            writer.write(_status_line(413) + b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        if length and header_map.get(b"expect", b"").lower() == b"100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        body = await reader.readexactly(length) if length else b""
+
+        path, _, query = target.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": http_version,
+            "method": method.upper(), "scheme": "http", "root_path": "",
+            "path": unquote(path), "raw_path": path.encode('latin-1'),
+            "query_string": query.encode('latin-1'), "headers": headers,
+            "client": peer[:2] if peer else None, "server": local[:2] if local else None,
+        }
+
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Nothing more is expected from the client until the response is done: EOF means it left
+            await reader.read(1)
+            return {"type": "http.disconnect"}
+
+        state = {"chunked": False, "started": False, "finished": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response_headers = list(message.get("headers", []))
+                names = {name.lower() for name, _ in response_headers}
+                lines = [_status_line(message["status"])]
+                if b"content-length" not in names and message["status"] not in (204, 304) and method != "HEAD":
+                    state["chunked"] = True
+                    response_headers.append((b"transfer-encoding", b"chunked"))
+                response_headers.append((b"connection", b"keep-alive" if keep_alive else b"close"))
+                lines.extend(name + b": " + value + b"\r\n" for name, value in response_headers)
+                lines.append(b"\r\n")
+                writer.write(b"".join(lines))
+                state["started"] = True
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                if chunk and method != "HEAD":
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if state["chunked"] else chunk)
+                if not message.get("more_body"):
+                    if state["chunked"]:
+                        writer.write(b"0\r\n\r\n")
+                    state["finished"] = True
+                await writer.drain()
+
+        try:
+            await self.application(scope, receive, send)
+        except (ConnectionError, OSError):
+            return False
+        except Exception as e:
+            print(f"Async server: error handling {method} {target}: {e}")
+            if not state["started"]:
+                writer.write(_status_line(500) + b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+            return False
+        return keep_alive and state["finished"]
+
+
+def create_application():
+    """
+    Imports the Flask app (src/main/app.py) and wraps it in an InventoryAsgiApp.
+    Also usable as an ASGI factory, e.g. `uvicorn --factory async_server:create_application`.
+    """
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    for path in (project_root, os.path.join(project_root, 'src', 'main')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import app as inventory_app
+    return InventoryAsgiApp(
+        inventory_app.app,
+        inventory_app.CHANGE_FEED,
+        lambda: inventory_app.STATE.current().version,
+        keepalive_seconds=inventory_app.SSE_KEEPALIVE_SECONDS,
+        io_workers=int(os.environ.get("ASYNC_IO_WORKERS", "32")),
+        crypto_workers=int(os.environ.get("ASYNC_CRYPTO_WORKERS", "0")) or None,
+    )
+
+
+def _installed_server():
+    """The first installed ASGI server among uvicorn and hypercorn, or "builtin"."""
+    for name in ("uvicorn", "hypercorn"):
+        try:
+            __import__(name)
+            return name
+        except ImportError:
+            continue
+    return "builtin"
+
+
+def serve(host="0.0.0.0", port=5001, server=None):
+    """
+    Runs the app in async mode until interrupted.
+
+    `server` (default: ASYNC_SERVER, else the first one installed) picks the
+    HTTP server: "uvicorn" or "hypercorn" are the supported ones; "builtin"
+    is AsyncHttpServer, a minimal fallback for environments without either.
+    """
+    server = (server or os.environ.get("ASYNC_SERVER") or _installed_server()).lower()
+    application = create_application()
+    print(f"Serving on http://{host}:{port} (async mode, {server})")
+    try:
+        if server == "uvicorn":
+            import uvicorn
+            uvicorn.run(application, host=host, port=port, timeout_keep_alive=int(KEEPALIVE_TIMEOUT))
+        elif server == "hypercorn":
+            from hypercorn.asyncio import serve as hypercorn_serve
+            from hypercorn.config import Config
+            config = Config()
+            config.bind = [f"{host}:{port}"]
+            config.keep_alive_timeout = KEEPALIVE_TIMEOUT
+            asyncio.run(hypercorn_serve(application, config))
+        elif server == "builtin":
+            print("Using the built-in HTTP server; install uvicorn or hypercorn for production use")
+            asyncio.run(AsyncHttpServer(application, host, port).serve_forever())
+        else:
+            raise ValueError(f"Unknown async server: {server} (expected uvicorn, hypercorn or builtin)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        application.close()
+
+
+async def _benchmark(stream_count, request_count):
+    """Opens `stream_count` idle /events streams, then times polling requests alongside them."""
+    import time
+
+    application = create_application()
+    server = await AsyncHttpServer(application, "127.0.0.1", 0).start()
+    port = server.port
+    streams = []
+    for _ in range(stream_count):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        streams.append((reader, writer))
+    for reader, _ in streams:
+        await reader.readuntil(b"event: hello")
+    print(f"{stream_count:,} SSE streams open, {threading.active_count()} threads in the process")
+
+    async def poll(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        status = (await reader.readline()).split()[1]
+        await reader.read()
+        writer.close()
+        return status
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(poll("/get_inventory_data") for _ in range(request_count)))
+    elapsed = time.perf_counter() - start
+    print(f"{request_count} concurrent /get_inventory_data polls: {elapsed * 1000:.0f} ms total, "
+          f"all {set(s.decode() for s in statuses)}")
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(poll("/verify_all_signatures"), *(poll("/get_keyring") for _ in range(50)))
+    print(f"/verify_all_signatures alongside 50 /get_keyring polls: {(time.perf_counter() - start) * 1000:.0f} ms, "
+          f"{threading.active_count()} threads")
+    for _, writer in streams:
+        writer.close()
+    while server.connections:
+        await asyncio.sleep(0.05)
+    await server.close()
+    application.close()
+
+
+if __name__ == "__main__":
+    # Usage: python async_server.py [port]
+    #        python async_server.py benchmark [streams] [requests]
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        asyncio.run(_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+                               int(sys.argv[3]) if len(sys.argv) > 3 else 200))
+    else:
+        serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else 5001)
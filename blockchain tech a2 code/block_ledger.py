@@ -0,0 +1,168 @@
+# block_ledger.py
+# Batches signed records into hash-chained blocks with one RSA signature per block
+
+import json
+import time
+import hashlib
+import threading
+
+GENESIS_HASH = "0" * 64
+
+
+def record_leaf_hash(record):
+    """SHA-256 of a record's canonical JSON form (sorted keys, no whitespace)."""
+    canonical = json.dumps(dict(record), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).digest()
+
+
+def merkle_root(leaves):
+    """
+    Computes the Merkle root (hex) of a list of leaf digests.
+    Odd levels duplicate their last node, as in Bitcoin.
+    """
+    if not leaves:
+        return hashlib.sha256(b"").hexdigest()
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def block_header(block):
+    """
+    The canonical string a block's hash and signature cover. It commits to the
+    previous block hash and to the Merkle root of the block's records.
+    """
+    return (f"block:{block['index']}|prev:{block['prev_hash']}|merkle:{block['merkle_root']}"
+            f"|records:{block['first_record']}+{block['record_count']}"
+            f"|time:{block['timestamp']}|signer:{block['signer']}")
+
+
+def build_block(index, prev_hash, records, first_record, signer, sign_fn, timestamp=None):
+    """
+    Seals `records` (ledger positions first_record .. first_record+len-1) into a block.
+    sign_fn(header_str) returns (signature_int, header_hash_hex), e.g. rsa_utils.sign_message
+    with the block signer's private key bound in.
+    """
+    block = {
+        "index": index,
+        "prev_hash": prev_hash,
+        "merkle_root": merkle_root([record_leaf_hash(record) for record in records]),
+        "first_record": first_record,
+        "record_count": len(records),
+        "timestamp": round(timestamp if timestamp is not None else time.time(), 3),
+        "signer": signer,
+    }
+    signature, header_hash = sign_fn(block_header(block))
+    block["hash"] = header_hash
+    block["signature"] = str(signature)
+    return block
+
+
+def pending_range(blocks, records):
+    """Returns (first, last) ledger positions of the records not yet sealed into a block."""
+    sealed = blocks[-1]["first_record"] + blocks[-1]["record_count"] if blocks else 0
+    return sealed, len(records)
+
+
+def verify_chain(blocks, records, verify_fn):
+    """
+    Verifies the whole ledger with one RSA operation per block.
+
+    For each block the Merkle root is recomputed from the referenced records
+    (cheap hashing), the link to the previous block hash is checked, and
+    verify_fn(header_str, signature_int) -> bool checks the single block
+    signature. Any edited, removed or reordered record breaks its block's
+    Merkle root; any edited block breaks its signature and the next link.
+    """
+    errors = []
+    block_results = []
+    prev_hash = GENESIS_HASH
+    expected_first = 0
+    rsa_operations = 0
+    for block in blocks:
+        problems = []
+        first, count = block["first_record"], block["record_count"]
+        if block["prev_hash"] != prev_hash:
+            problems.append("prev_hash does not match the previous block")
+        if first != expected_first:
+            problems.append(f"expected first record {expected_first}, block starts at {first}")
+        block_records = records[first:first + count]
+        if len(block_records) != count:
+            problems.append(f"ledger holds {len(block_records)} of the block's {count} records")
+        elif merkle_root([record_leaf_hash(record) for record in block_records]) != block["merkle_root"]:
+            problems.append("Merkle root mismatch: a record in this block was modified")
+        header = block_header(block)
+        if hashlib.sha256(header.encode('utf-8')).hexdigest() != block["hash"]:
+            problems.append("block hash does not match its header")
+        try:
+            rsa_operations += 1
+            if not verify_fn(header, int(block["signature"])):
+                problems.append("invalid block signature")
+        except (ValueError, KeyError) as e:
+            problems.append(f"unverifiable block signature: {e}")
+        block_results.append({"index": block["index"], "valid": not problems, "problems": problems})
+        errors.extend(f"block {block['index']}: {problem}" for problem in problems)
+        prev_hash = block["hash"]
+        expected_first = first + count
+
+    first_pending, end = pending_range(blocks, records)
+    return {
+        "valid": not errors,
+        "blocks": block_results,
+        "block_count": len(blocks),
+        "sealed_records": first_pending,
+        "pending_records": end - first_pending,
+        "rsa_operations": rsa_operations,
+        "errors": errors,
+    }
+
+
+class BlockSealer:
+    """
+    Decides when pending records become a block: as soon as `max_records` are
+    pending, or once the oldest pending record has waited `max_age` seconds.
+    A daemon thread calls seal_fn(force=False) periodically for the time rule.
+    """
+
+    def __init__(self, seal_fn, max_records=10, max_age=30.0):
+        self.seal_fn = seal_fn
+        self.max_records = max_records
+        self.max_age = max_age
+        self._pending_since = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def due(self, pending_count):
+        """Returns True if `pending_count` pending records should be sealed now."""
+        with self._lock:
+            if pending_count == 0:
+                self._pending_since = None
+                return False
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            return (pending_count >= self.max_records
+                    or time.monotonic() - self._pending_since >= self.max_age)
+
+    def sealed(self):
+        """Resets the age clock after a block was sealed."""
+        with self._lock:
+            self._pending_since = None
+
+    def start(self):
+        """Starts the background thread that enforces the max_age rule."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="block-sealer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        interval = max(0.5, min(self.max_age / 4, 5.0))
+        while True:
+            time.sleep(interval)
+            try:
+                self.seal_fn()
+            except Exception as e:
+                print(f"Block sealer error: {e}")
@@ -0,0 +1,125 @@
+# change_feed.py
+# Fans state changes out to Server-Sent Events subscribers
+
+import json
+import queue
+import threading
+
+
+def format_sse(event, data, event_id=None):
+    """Formats one Server-Sent Events message."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    for line in json.dumps(data, separators=(',', ':')).splitlines():
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+class _Subscriber:
+    __slots__ = ("queue", "lagging", "notify")
+
+    def __init__(self, max_backlog, notify=None):
+        self.queue = queue.Queue(maxsize=max_backlog)
+        self.lagging = False
+        self.notify = notify
+
+
+class ChangeBroadcaster:
+    """
+    A VersionedState listener that turns each new snapshot's changes into
+    events and pushes them to every subscriber.
+
+    The listener itself only hands (snapshot, changes) to a dispatcher thread,
+    so publishing never waits on event building or on slow clients, and with
+    no subscribers nothing is built at all. build_events(snapshot, changes)
+    returns a list of (event_name, data) pairs. A subscriber whose backlog
+    overflows is sent a single "resync" event instead of the lost events,
+    telling the client to reload in full.
+    """
+
+    def __init__(self, build_events, max_backlog=1000):
+        self.build_events = build_events
+        self.max_backlog = max_backlog
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._dispatch, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def apply_changes(self, snapshot, changes):
+        """VersionedState listener."""
+        if changes and self._subscribers:
+            self._pending.put((snapshot, changes))
+
+    def subscribe(self, notify=None):
+        """
+        Registers a subscriber; pass it to next_message() and unsubscribe().
+        notify(), if given, is called from the dispatcher thread whenever
+        messages were queued for it, so an event loop can wait for that
+        instead of blocking a thread in next_message().
+        """
+        subscriber = _Subscriber(self.max_backlog, notify)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def is_closed(self, subscriber):
+        """True once a lagging subscriber has been sent its "resync" event; end its stream then."""
+        return subscriber.lagging and subscriber.queue.empty()
+
+    def next_message(self, subscriber, timeout):
+        """
+        Returns the next formatted SSE message for subscriber, or None after
+        `timeout` seconds (immediately if timeout is 0).
+        """
+        try:
+            if timeout == 0:
+                return subscriber.queue.get_nowait()
+            return subscriber.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _dispatch(self):
+        while True:
+            snapshot, changes = self._pending.get()
+            try:
+                messages = [format_sse(event, data, snapshot.version)
+                            for event, data in self.build_events(snapshot, changes)]
+            except Exception as e:
+                print(f"Change feed: failed to build events for version {snapshot.version}: {e}")
+                messages = [format_sse("resync", {"version": snapshot.version}, snapshot.version)]
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                self._deliver(subscriber, messages, snapshot.version)
+                if subscriber.notify is not None:
+                    try:
+                        subscriber.notify()
+                    except Exception as e:
+                        print(f"Change feed: subscriber notification failed: {e}")
+
+    def _deliver(self, subscriber, messages, version):
+        if subscriber.lagging:
+            return
+        for message in messages:
+            try:
+                subscriber.queue.put_nowait(message)
+            except queue.Full:
+                # Drop the backlog; the client reloads everything instead
+                subscriber.lagging = True
+                while True:
+                    try:
+                        subscriber.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                subscriber.queue.put_nowait(format_sse("resync", {"version": version}, version))
+                return
@@ -0,0 +1,237 @@
+# change_log.py
+# Sequence-numbered change log (memory tail + on-disk spill) for ?since=N delta sync
+
+import atexit
+import json
+import os
+import threading
+import uuid
+from bisect import bisect_right
+from collections import deque
+from itertools import islice
+
+# Every OFFSET_STRIDE-th entry's byte offset in the log file is remembered, so
+# reading from an old sequence number seeks close to it instead of scanning
+OFFSET_STRIDE = 1024
+
+
+class ChangeLog:
+    """
+    Assigns increasing sequence numbers to every inventory and ledger change
+    and keeps them for delta sync.
+
+    The newest `memory_entries` entries stay in memory; every entry is also
+    appended to a JSONL file that holds up to `disk_entries` of them. When
+    the file grows past twice that, it is compacted to the newest
+    `disk_entries`, and clients asking for anything older are told to
+    resnapshot. Entries are idempotent to replay (upserts, removals, and
+    signed records carrying their ledger index), so a client may safely
+    re-apply a few changes it already has.
+
+    A log belongs to one process run: it has a random log_id, starts at the
+    state the process published first, and the file is removed at exit.
+    Clients holding a sequence number from another log_id must resnapshot.
+    """
+
+    def __init__(self, directory, memory_entries=10000, disk_entries=1000000):
+        self.log_id = uuid.uuid4().hex[:12]
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.path = os.path.join(directory, f"inventory-changes-{self.log_id}.jsonl")
+        self._lock = threading.Condition()  # Also signals waiters when entries are appended
+        self._memory = deque(maxlen=memory_entries)
+        self._last_seq = 0
+        self._disk_first_seq = 1  # Oldest sequence number still in the file
+        self._offsets = []        # Byte offset of seq _disk_first_seq + i * OFFSET_STRIDE
+        self._file = open(self.path, "a+b")
+        self._versions = deque(maxlen=memory_entries)  # (snapshot version, last seq at that version)
+        atexit.register(self.close)
+
+    # --- Writing ---
+
+    @staticmethod
+    def _entries_for(changes):
+        entries = []
+        for change in changes:
+            kind = change["kind"]
+            if kind == "upsert":
+                entries.append({"kind": "upsert", "inventory": change["inventory"], "item": change["item"]})
+            elif kind == "remove":
+                entries.append({"kind": "remove", "inventory": change["inventory"], "item_id": change["item_id"]})
+            elif kind == "ledger_reset":
+                entries.append({"kind": "ledger_reset"})
+            elif kind == "signed_record":
+                entries.append({"kind": "signed_record", "record": dict(change["record"])})
+            elif kind == "block":
+                entries.append({"kind": "block", "block": change["block"]})
+        return entries
+
+    def apply_changes(self, snapshot, changes):
+        """VersionedState listener: logs the snapshot's changes under new sequence numbers."""
+        entries = self._entries_for(changes)
+        if not entries:
+            return
+        # New signed records are the tail of the ledger; give each its index so replays are idempotent
+        new_records = [entry for entry in entries if entry["kind"] == "signed_record"]
+        first_index = len(snapshot.signed_records) - len(new_records)
+        for offset, entry in enumerate(new_records):
+            entry["index"] = first_index + offset
+
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            position = self._file.tell()
+            lines = []
+            for entry in entries:
+                self._last_seq += 1
+                entry["seq"] = self._last_seq
+                entry["version"] = snapshot.version
+                self._memory.append(entry)
+                if (self._last_seq - self._disk_first_seq) % OFFSET_STRIDE == 0:
+                    self._offsets.append(position)
+                line = (json.dumps(entry, separators=(',', ':')) + "\n").encode("utf-8")
+                position += len(line)
+                lines.append(line)
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            self._versions.append((snapshot.version, self._last_seq))
+            if self._last_seq - self._disk_first_seq + 1 > 2 * self.disk_entries:
+                self._compact()
+            self._lock.notify_all()
+
+    def _compact(self):
+        """Rewrites the file with only the newest disk_entries entries (lock held)."""
+        new_first = self._last_seq - self.disk_entries + 1
+        stride_index = (new_first - self._disk_first_seq) // OFFSET_STRIDE
+        self._file.seek(self._offsets[stride_index])
+        skip = new_first - (self._disk_first_seq + stride_index * OFFSET_STRIDE)
+        for _ in range(skip):
+            self._file.readline()
+        temp_path = self.path + ".compact"
+        offsets = []
+        with open(temp_path, "wb") as out:
+            seq = new_first
+            for line in self._file:
+                if (seq - new_first) % OFFSET_STRIDE == 0:
+                    offsets.append(out.tell())
+                out.write(line)
+                seq += 1
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a+b")
+        self._disk_first_seq = new_first
+        self._offsets = offsets
+        print(f"Change log compacted: entries before seq {new_first} dropped")
+
+    # --- Reading ---
+
+    def last_seq(self):
+        return self._last_seq
+
+    def wait_for_entries(self, seq, timeout):
+        """Blocks until entries after `seq` exist or `timeout` seconds pass; returns the last seq."""
+        with self._lock:
+            self._lock.wait_for(lambda: self._last_seq > seq, timeout=timeout)
+            return self._last_seq
+
+    def earliest_seq(self):
+        """Oldest sequence number still available."""
+        return self._disk_first_seq
+
+    def seq_at_version(self, version):
+        """Last sequence number included in the snapshot `version` (for full-snapshot responses)."""
+        with self._lock:
+            versions = list(self._versions)
+            if not versions or version >= versions[-1][0]:
+                return self._last_seq
+        position = bisect_right(versions, (version, float("inf")))
+        return versions[position - 1][1] if position else 0
+
+    def since(self, seq, kinds=None, limit=1000):
+        """
+        Returns the entries after `seq` (optionally only the given kinds), at
+        most `limit` of them, as {"changes", "last_seq", "has_more"}; last_seq
+        is the position to pass as the next `since`. Returns None if entries
+        after `seq` have been compacted away and the client must resnapshot.
+
+        Only the positions are taken under the lock. The memory tail is copied
+        there, but the file is read after it is released, so a long read (a
+        `kinds` filter may skip most of the file) never holds up apply_changes.
+        """
+        log_file = None
+        with self._lock:
+            last_seq = self._last_seq
+            if seq > last_seq or seq < 0 or seq + 1 < self._disk_first_seq:
+                return None
+            if seq == last_seq:
+                return {"changes": [], "last_seq": last_seq, "has_more": False}
+            if self._memory and seq + 1 >= self._memory[0]["seq"]:
+                source = list(islice(self._memory, seq + 1 - self._memory[0]["seq"], None))
+            else:
+                log_file, file_seq = self._open_disk(seq + 1)
+                source = self._read_disk(log_file, file_seq, seq + 1, last_seq)
+
+        try:
+            changes = []
+            position = seq
+            for entry in source:
+                if len(changes) >= limit:
+                    return {"changes": changes, "last_seq": position, "has_more": True}
+                position = entry["seq"]
+                if kinds is None or entry["kind"] in kinds:
+                    changes.append(entry)
+            return {"changes": changes, "last_seq": last_seq, "has_more": False}
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+    def _open_disk(self, first_seq):
+        """
+        Opens the file at the remembered offset at or before first_seq (lock
+        held). Returns (file, seq of its next line). The handle keeps reading
+        this file even if a compaction replaces it afterwards.
+        """
+        stride_index = (first_seq - self._disk_first_seq) // OFFSET_STRIDE
+        log_file = open(self.path, "rb")
+        log_file.seek(self._offsets[stride_index])
+        return log_file, self._disk_first_seq + stride_index * OFFSET_STRIDE
+
+    @staticmethod
+    def _read_disk(log_file, seq, first_seq, last_seq):
+        """Yields entries first_seq..last_seq from log_file, whose next line is entry `seq`."""
+        for line in log_file:
+            if seq > last_seq:
+                break
+            if seq >= first_seq:
+                yield json.loads(line)
+            seq += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+
+
+if __name__ == "__main__":
+    # Demo: log many single-row changes, compact, and read deltas from memory, disk and beyond
+    import tempfile
+    import time
+
+    log = ChangeLog(tempfile.gettempdir(), memory_entries=1000, disk_entries=50000)
+    snapshot = type("Snapshot", (), {"signed_records": ()})()
+    start = time.perf_counter()
+    for version in range(1, 120001):
+        snapshot.version = version
+        log.apply_changes(snapshot, [{"kind": "upsert", "inventory": "A",
+                                      "item": {"id": f"{version % 5000:04d}", "units": str(version), "price": "1", "location": "A"}}])
+    print(f"Logged {log.last_seq():,} changes in {time.perf_counter() - start:.2f} s; earliest kept: {log.earliest_seq():,}")
+    for since in (log.last_seq() - 10, log.last_seq() - 20000, 10):
+        start = time.perf_counter()
+        result = log.since(since, limit=100)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"since={since:,}: " + (f"{len(result['changes'])} changes, next since={result['last_seq']:,}"
+                                      if result else "resnapshot required") + f" ({elapsed:.2f} ms)")
+    log.close()
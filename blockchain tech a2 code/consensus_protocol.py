@@ -1,5 +1,8 @@
 # consensus_protocol.py
 
+import tracing
+
+
 def load_inventory_records(file_path):
     inventories = {}
     current_inventory = None
@@ -25,11 +28,15 @@ def simulate_vote(inventory_name, proposed_record):
     return True if proposed_record["quantity"] < 50 else False
 
 
-def consensus_protocol(inventories, proposed_record):
+def consensus_protocol(inventories, proposed_record, policy=None):
     print(f"Proposed new record: {proposed_record}")
+    if policy is not None:
+        return policy_consensus(inventories, proposed_record, policy)
     approvals = 0
     for inv in inventories:
-        vote = simulate_vote(inv, proposed_record)
+        with tracing.span("simulate_vote", voter=inv) as vote_span:
+            vote = simulate_vote(inv, proposed_record)
+            vote_span.set(vote="ACCEPT" if vote else "REJECT")
         print(f"{inv} voted {'ACCEPT' if vote else 'REJECT'}")
         if vote:
             approvals += 1
@@ -38,6 +45,21 @@ def consensus_protocol(inventories, proposed_record):
     return consensus
 
 
+def policy_consensus(inventories, proposed_record, policy):
+    """consensus_protocol() with the nodes voting by a compiled consensus_policy.ConsensusPolicy."""
+    with tracing.span("consensus_policy.evaluate", nodes=len(inventories)) as policy_span:
+        result = policy.evaluate(inventories, [proposed_record])
+        policy_span.set(approvals=int(result.approvals[0]))
+    for index, inv in enumerate(result.nodes):
+        reason = result.rejection(index, 0)
+        print(f"{inv} voted {'ACCEPT' if reason is None else f'REJECT ({reason})'}")
+    approvals = int(result.approvals[0])
+    consensus = bool(result.approved[0])
+    print(f"Consensus {'REACHED' if consensus else 'FAILED'} ({approvals}/{len(result.nodes)} approved, "
+          f"{policy.quorum} required)")
+    return consensus
+
+
 def save_updated_records(inventories, output_path):
     with open(output_path, 'w') as f:
         for inv, records in inventories.items():
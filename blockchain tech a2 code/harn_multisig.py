@@ -57,6 +57,65 @@ def verify_multisignature(identities, hash_val, aggregated_sig):
     
     return aggregated_sig == expected_sig
 
+# --- Modular Harn identity-based multisignature (RSA-based PKG) ---
+#
+# The PKG holds an RSA key (n, e, d) and issues each signer the secret key g_i = ID_i^d mod n.
+# Signing a message m by a set S of signers takes two rounds:
+#   1. each signer picks a fresh random r_i and publishes the commitment t_i = r_i^e mod n;
+#      t = prod(t_i) mod n over S
+#   2. each signer returns s_i = g_i * r_i^H(t, m) mod n;  s = prod(s_i) mod n
+# Anyone can check s^e == prod(ID_i) * t^H(t, m) mod n for S, and each partial on its own with
+# s_i^e == ID_i * t_i^H(t, m) mod n. r_i must never be reused across two messages.
+
+def query_message(item_id, qty):
+    """The message inventories multi-sign for a query answer."""
+    return f"{item_id}:{qty}"
+
+def issue_private_key(identity, d, n):
+    """The PKG's signing key for an identity: g = ID^d mod n."""
+    return pow(identity, d, n)
+
+def commitment(random_val, e, n):
+    """Round 1: t_i = r_i^e mod n."""
+    return pow(random_val, e, n)
+
+def aggregate_commitments(commitments, n):
+    """t = product of the participants' commitments mod n."""
+    total = 1
+    for t_i in commitments:
+        total = total * t_i % n
+    return total
+
+def signing_hash(aggregated_commitment, message):
+    """H(t, m) as an integer; binds every partial to the exact set of participants."""
+    return int(hashlib.sha256(f"{aggregated_commitment}:{message}".encode()).hexdigest(), 16)
+
+def modular_partial_signature(private_key, random_val, hash_val, n):
+    """Round 2: s_i = g_i * r_i^H(t, m) mod n."""
+    return private_key * pow(random_val, hash_val, n) % n
+
+def verify_partial_signature(identity, commitment_i, partial, hash_val, e, n):
+    """Checks one signer's partial: s_i^e == ID_i * t_i^H(t, m) mod n."""
+    return pow(partial, e, n) == identity * pow(commitment_i, hash_val, n) % n
+
+def aggregate_modular_signatures(partials, n):
+    """s = product of the partial signatures mod n."""
+    total = 1
+    for s_i in partials:
+        total = total * s_i % n
+    return total
+
+def verify_modular_multisignature(identities, aggregated_commitment, message, aggregated_sig, e, n):
+    """
+    Verifies a multisignature over exactly the signers whose identities are given:
+    s^e == prod(ID_i) * t^H(t, m) mod n.
+    """
+    id_product = 1
+    for identity in identities:
+        id_product = id_product * identity % n
+    hash_val = signing_hash(aggregated_commitment, message)
+    return pow(aggregated_sig, e, n) == id_product * pow(aggregated_commitment, hash_val, n) % n
+
 def power_mod(base, exp, mod):
     """
     Computes (base^exp) % mod using the right-to-left binary method
@@ -87,7 +146,12 @@ def decrypt_message(ciphertext, d, n):
     """
     # Decrypt: m = c^d mod n
     decrypted_int = power_mod(ciphertext, d, n)
-    
+    return int_to_message(decrypted_int)
+
+def int_to_message(decrypted_int):
+    """
+    Converts a decrypted integer back to the message string
+    """
     # Convert integer back to bytes and then to string
     # This is a bit tricky as we need to determine the byte length
     byte_length = (decrypted_int.bit_length() + 7) // 8
@@ -0,0 +1,208 @@
+# inventory_query.py
+# Secondary-index query engine over the inventory rows of a state snapshot
+
+import math
+from bisect import bisect_left, bisect_right
+
+# Fields with a sorted secondary index; numeric ones are compared as numbers, not strings
+INDEXED_FIELDS = ("location", "price", "units")
+NUMERIC_FIELDS = ("price", "units")
+RANGE_OPERATORS = ("min", "max", "lt", "gt")
+
+
+def to_number(value):
+    """
+    Converts a stored string field ("18", "12.5") to an int or float for range comparisons.
+    Raises ValueError if it is not a number, or is NaN (which no range could be compared with).
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        number = float(value)
+    except TypeError:
+        raise ValueError(f"{value!r} is not a number")
+    if math.isnan(number):
+        raise ValueError(f"{value!r} is not a number")
+    return number
+
+
+def _key(field, value):
+    return to_number(value) if field in NUMERIC_FIELDS else value
+
+
+class SortedIndex:
+    """
+    A sorted (key, row position) list for one field.
+    Equality and range lookups are two binary searches plus the matching slice.
+    Rows whose value cannot be converted (a non-numeric price, say) are left
+    out, so no filter on this field matches them; `skipped` counts them.
+    """
+
+    def __init__(self, field, rows):
+        self.field = field
+        try:
+            pairs = [(_key(field, row[field]), position) for position, (_, row) in enumerate(rows)]
+        except (KeyError, ValueError):
+            pairs = []
+            for position, (_, row) in enumerate(rows):
+                try:
+                    pairs.append((_key(field, row[field]), position))
+                except (KeyError, ValueError):
+                    continue
+        self.skipped = len(rows) - len(pairs)
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.positions = [position for _, position in pairs]
+
+    def bounds(self, condition):
+        """
+        Returns the (lo, hi) slice of self.keys matching `condition`, which is
+        either a plain value (equality) or a dict using RANGE_OPERATORS.
+        """
+        if not isinstance(condition, dict):
+            key = _key(self.field, condition)
+            return bisect_left(self.keys, key), bisect_right(self.keys, key)
+        lo, hi = 0, len(self.keys)
+        if "min" in condition:
+            lo = max(lo, bisect_left(self.keys, _key(self.field, condition["min"])))
+        if "gt" in condition:
+            lo = max(lo, bisect_right(self.keys, _key(self.field, condition["gt"])))
+        if "max" in condition:
+            hi = min(hi, bisect_right(self.keys, _key(self.field, condition["max"])))
+        if "lt" in condition:
+            hi = min(hi, bisect_left(self.keys, _key(self.field, condition["lt"])))
+        return lo, max(lo, hi)
+
+
+def _matches(field, condition, value):
+    """Checks one row value against a condition without using an index."""
+    if field not in INDEXED_FIELDS:
+        return value == condition
+    try:
+        key = _key(field, value)
+    except ValueError:
+        return False  # Left out of the index too (see SortedIndex)
+    if not isinstance(condition, dict):
+        return key == _key(field, condition)
+    if "min" in condition and key < _key(field, condition["min"]):
+        return False
+    if "gt" in condition and key <= _key(field, condition["gt"]):
+        return False
+    if "max" in condition and key > _key(field, condition["max"]):
+        return False
+    if "lt" in condition and key >= _key(field, condition["lt"]):
+        return False
+    return True
+
+
+class InventoryQueryEngine:
+    """
+    Indexes every (inventory id, item) row of one snapshot by location, price
+    and units. Build it once per snapshot (see StateSnapshot.derived) and run
+    any number of queries against it.
+    """
+
+    def __init__(self, inventories):
+        self.rows = [(inv_id, item) for inv_id, items in inventories.items() for item in items]
+        self.indexes = {field: SortedIndex(field, self.rows) for field in INDEXED_FIELDS}
+        self._by_id = None  # item id -> row positions, built by the first filter on "id"
+        for field, index in self.indexes.items():
+            if index.skipped:
+                print(f"WARNING: {index.skipped} rows have a non-numeric {field}; no {field} filter matches them.")
+
+    def _id_positions(self):
+        by_id = self._by_id
+        if by_id is None:
+            by_id = {}
+            for position, (_, item) in enumerate(self.rows):
+                by_id.setdefault(item["id"], []).append(position)
+            self._by_id = by_id  # Racing builders produce equal dicts; either one may stay
+        return by_id
+
+    def query(self, filters, limit=None):
+        """
+        Returns the rows matching every filter as dicts with an "inventory" key.
+
+        `filters` maps a field to a value (equality) or to a range dict such as
+        {"min": 10, "max": 15} or {"lt": 20}. Indexed fields are location, price
+        and units; "id" is looked up in a dict and "inventory" is matched on
+        the candidate rows. The filter with the fewest candidates drives the
+        scan, so a query costs O(log n + k) for k candidate rows.
+        """
+        best = None  # (field, candidate positions)
+        if "id" in filters:
+            best = ("id", self._id_positions().get(filters["id"], ()))
+        for field, condition in filters.items():
+            if field in self.indexes:
+                lo, hi = self.indexes[field].bounds(condition)
+                if best is None or hi - lo < len(best[1]):
+                    best = (field, self.indexes[field].positions[lo:hi])
+
+        if best is None:
+            candidates = range(len(self.rows))
+        else:
+            candidates = sorted(best[1])  # Keep original row order
+
+        results = []
+        for position in candidates:
+            inv_id, item = self.rows[position]
+            if all(_matches(field, condition, inv_id if field == "inventory" else item.get(field))
+                   for field, condition in filters.items() if best is None or field != best[0]):
+                results.append(dict(item, inventory=inv_id))
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+
+def parse_filters(args):
+    """
+    Builds query filters from request arguments, e.g.
+    ?location=B&units_lt=20&price_min=10&price_max=15&inventory=A
+    Raises ValueError for malformed or NaN numeric bounds.
+    """
+    filters = {}
+    for field in ("location", "inventory", "id"):
+        if args.get(field):
+            filters[field] = args.get(field)
+    for field in NUMERIC_FIELDS:
+        if args.get(field):
+            filters[field] = to_number(args.get(field))
+            continue
+        condition = {}
+        for operator in RANGE_OPERATORS:
+            value = args.get(f"{field}_{operator}")
+            if value not in (None, ""):
+                condition[operator] = to_number(value)
+        if condition:
+            filters[field] = condition
+    return filters
+
+
+if __name__ == "__main__":
+    # Compare indexed queries with a full scan over a large synthetic inventory
+    import random
+    import time
+
+    random.seed(1)
+    inventories = {
+        inv_id: [{"id": f"{i:07d}", "units": str(random.randint(0, 500)), "price": str(random.randint(1, 100)),
+                  "location": random.choice("ABCD")} for i in range(250000)]
+        for inv_id in ["A", "B", "C", "D"]
+    }
+    start = time.perf_counter()
+    engine = InventoryQueryEngine(inventories)
+    print(f"Indexed {len(engine.rows)} rows in {time.perf_counter() - start:.2f} s")
+
+    queries = [{"location": "B", "units": {"lt": 20}}, {"price": {"min": 10, "max": 11}, "units": {"lt": 5}}]
+    for filters in queries:
+        start = time.perf_counter()
+        indexed = engine.query(filters)
+        indexed_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        scanned = [dict(item, inventory=inv_id) for inv_id, item in engine.rows
+                   if all(_matches(f, c, item[f]) for f, c in filters.items())]
+        scan_ms = (time.perf_counter() - start) * 1000
+        assert indexed == scanned
+        print(f"{filters}: {len(indexed)} rows, indexed {indexed_ms:.1f} ms vs full scan {scan_ms:.1f} ms")
@@ -0,0 +1,279 @@
+# keygen.py
+# RSA prime generation (small-prime sieve + Miller-Rabin) and a background-refilled key pool
+
+import math
+import multiprocessing
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+DEFAULT_E = 65537
+MIN_MODULUS_BITS = 288  # Signatures are SHA-256 hashes taken mod n, so n must exceed 2^256
+
+
+MAX_MODULUS_BITS = 4096  # Upper bound for caller-supplied keys, so checking one stays cheap
+
+
+def check_key_params(p, q, e, max_modulus_bits=MAX_MODULUS_BITS):
+    """
+    Validates caller-supplied key parameters before they become a signing key:
+    p and q distinct probable primes (Miller-Rabin), a modulus between
+    MIN_MODULUS_BITS and `max_modulus_bits`, and 1 < e < (p-1)(q-1) coprime
+    with it. Sizes are checked first, so oversized inputs cost no exponentiation.
+    Raises ValueError.
+    """
+    for name, value in (("p", p), ("q", q), ("e", e)):
+        if isinstance(value, bool) or not isinstance(value, int) or value < 2:
+            raise ValueError(f"{name} must be an integer greater than 1")
+    modulus_bits = (p * q).bit_length() if p.bit_length() + q.bit_length() <= max_modulus_bits + 1 else None
+    if modulus_bits is None or not MIN_MODULUS_BITS <= modulus_bits <= max_modulus_bits:
+        raise ValueError(f"p * q must have between {MIN_MODULUS_BITS} and {max_modulus_bits} bits")
+    if p == q:
+        raise ValueError("p and q must be different")
+    for name, value in (("p", p), ("q", q)):
+        if not is_probable_prime(value):
+            raise ValueError(f"{name} is not prime")
+    phi = (p - 1) * (q - 1)
+    if e >= phi or math.gcd(e, phi) != 1:
+        raise ValueError("e must be below (p-1)(q-1) and coprime with it")
+
+
+def _sieve(limit):
+    """Primes below `limit` (sieve of Eratosthenes)."""
+    is_prime = bytearray([1]) * limit
+    is_prime[0:2] = b"\x00\x00"
+    for i in range(2, int(limit ** 0.5) + 1):
+        if is_prime[i]:
+            is_prime[i * i::i] = bytearray(len(range(i * i, limit, i)))
+    return [i for i in range(limit) if is_prime[i]]
+
+
+# Odd primes used to discard candidates before any modular exponentiation
+SMALL_PRIMES = _sieve(2000)[1:]
+
+# Odd candidates sieved per attempt; a 256-bit prime is found within the first few hundred on average
+SIEVE_WINDOW = 4096
+
+
+def is_probable_prime(n, rounds=40):
+    """
+    Miller-Rabin test with `rounds` random bases, after trial division by
+    SMALL_PRIMES. A composite passes with probability at most 4^-rounds.
+    """
+    if n < 2:
+        return False
+    for prime in SMALL_PRIMES[:50]:
+        if n % prime == 0:
+            return n == prime
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for _ in range(rounds):
+        a = secrets.randbelow(n - 3) + 2
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def generate_prime(bits, e=DEFAULT_E, rounds=40):
+    """
+    Random `bits`-bit prime p with gcd(e, p - 1) = 1 and the top two bits set
+    (so the product of two such primes has exactly 2 * bits bits).
+
+    Sieves a window of SIEVE_WINDOW odd numbers from a random start: each
+    small prime crosses out its multiples with one slice assignment, and only
+    the survivors (roughly one in ten) reach Miller-Rabin.
+    """
+    while True:
+        start = secrets.randbits(bits) | (3 << (bits - 2)) | 1
+        # window[i] stands for start + 2 * i
+        window = bytearray([1]) * SIEVE_WINDOW
+        for prime in SMALL_PRIMES:
+            first = ((prime - start % prime) * ((prime + 1) // 2)) % prime
+            window[first::prime] = bytes(len(range(first, SIEVE_WINDOW, prime)))
+        for i in (i for i, survivor in enumerate(window) if survivor):
+            candidate = start + 2 * i
+            if candidate.bit_length() != bits:
+                break
+            if math.gcd(e, candidate - 1) == 1 and is_probable_prime(candidate, rounds):
+                return candidate
+
+
+def generate_key_params(modulus_bits=512, e=DEFAULT_E):
+    """
+    Returns {"p", "q", "e"} for a new RSA key with a `modulus_bits`-bit n,
+    in the same form as the hard-coded INVENTORY_PARAMS entries.
+    """
+    if modulus_bits < MIN_MODULUS_BITS:
+        raise ValueError(f"modulus_bits must be at least {MIN_MODULUS_BITS}")
+    p = generate_prime(modulus_bits // 2, e)
+    q = generate_prime(modulus_bits - modulus_bits // 2, e)
+    while q == p:
+        q = generate_prime(modulus_bits - modulus_bits // 2, e)
+    return {"p": p, "q": q, "e": e}
+
+
+def generate_key_params_parallel(executor, workers, modulus_bits=512, e=DEFAULT_E):
+    """
+    generate_key_params() with the prime search raced across `workers`
+    processes of `executor`: each searches from its own random start and the
+    first two distinct primes win. Searches still running finish in the
+    background and are discarded.
+    """
+    if modulus_bits < MIN_MODULUS_BITS:
+        raise ValueError(f"modulus_bits must be at least {MIN_MODULUS_BITS}")
+    bits = modulus_bits // 2
+    pending = {executor.submit(generate_prime, bits, e) for _ in range(max(workers, 2))}
+    primes = []
+    while len(primes) < 2:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            prime = future.result()
+            if prime not in primes and len(primes) < 2:
+                primes.append(prime)
+        if len(primes) < 2 and not pending:
+            pending = {executor.submit(generate_prime, bits, e)}
+    for future in pending:
+        future.cancel()
+    return {"p": primes[0], "q": primes[1], "e": e}
+
+
+class KeyPool:
+    """
+    Ready-made RSA key parameters, so rotating a key or adding a node never
+    waits for a prime search.
+
+    A refill thread keeps up to `size` {"p", "q", "e"} entries queued by
+    running generate_key_params() on a process pool of `workers` processes
+    (several keys in parallel). take() returns a pooled key at once; if the
+    pool is empty, it generates one on the spot with the search raced across
+    the process pool. Pooled keys only ever live in this process's memory.
+
+    Nothing runs until start() or the first take(), which starts the refill
+    thread. The process pool is created on first use with the "spawn" start
+    method: forking a server process that already runs threads (and, under
+    gunicorn, forking every worker) copies their locks in whatever state
+    they are in.
+    """
+
+    def __init__(self, size=4, modulus_bits=512, e=DEFAULT_E, workers=None):
+        if modulus_bits < MIN_MODULUS_BITS:
+            raise ValueError(f"modulus_bits must be at least {MIN_MODULUS_BITS}")
+        self.size = size
+        self.modulus_bits = modulus_bits
+        self.e = e
+        self.workers = workers or os.cpu_count() or 1
+        self._ready = queue.Queue()
+        self._wakeup = threading.Event()
+        self._executor = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"generated": 0, "served_from_pool": 0, "generated_on_demand": 0, "last_generation_ms": None}
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def start(self):
+        """Starts the background refill thread (idempotent)."""
+        with self._lock:
+            if self.size > 0 and self._thread is None:
+                self._thread = threading.Thread(target=self._refill, name="key-pool", daemon=True)
+                self._thread.start()
+        return self
+
+    def _refill(self):
+        while True:
+            missing = self.size - self._ready.qsize()
+            if missing <= 0:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            started = time.perf_counter()
+            try:
+                futures = [self._pool().submit(generate_key_params, self.modulus_bits, self.e)
+                           for _ in range(missing)]
+                for future in futures:
+                    self._ready.put(future.result())
+                    self._record_generation(started)
+            except RuntimeError:
+                return  # The process pool was shut down (close() or interpreter exit)
+            except Exception as e:
+                print(f"Key pool: refill failed: {e}")
+                time.sleep(5)
+
+    def _record_generation(self, started):
+        with self._lock:
+            self._stats["generated"] += 1
+            self._stats["last_generation_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    def take(self):
+        """Returns {"p", "q", "e"} for a fresh key and triggers a refill."""
+        try:
+            params = self._ready.get_nowait()
+            counter = "served_from_pool"
+        except queue.Empty:
+            started = time.perf_counter()
+            params = generate_key_params_parallel(self._pool(), self.workers, self.modulus_bits, self.e)
+            self._record_generation(started)
+            counter = "generated_on_demand"
+        with self._lock:
+            self._stats[counter] += 1
+        self.start()
+        self._wakeup.set()
+        return params
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(ready=self._ready.qsize(), size=self.size, modulus_bits=self.modulus_bits,
+                     e=self.e, workers=self.workers)
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+if __name__ == "__main__":
+    # Usage: python keygen.py [modulus_bits]
+    # Prints new key parameters in INVENTORY_PARAMS form and times the ways of getting one
+    import sys
+
+    modulus_bits = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    start = time.perf_counter()
+    params = generate_key_params(modulus_bits)
+    print(f"Single process: {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f'    "p": {params["p"]},\n    "q": {params["q"]},\n    "e": {params["e"]},')
+
+    pool = KeyPool(size=4, modulus_bits=modulus_bits)
+    executor = pool._pool()
+    start = time.perf_counter()
+    for _ in range(5):
+        generate_key_params_parallel(executor, pool.workers, modulus_bits)
+    print(f"Raced across {pool.workers} processes: {(time.perf_counter() - start) * 200:.0f} ms per key")
+
+    pool.start()
+    while pool.stats()["ready"] < pool.size:
+        time.sleep(0.05)
+    start = time.perf_counter()
+    pool.take()
+    print(f"From the key pool: {(time.perf_counter() - start) * 1000:.3f} ms")
+    pool.close()
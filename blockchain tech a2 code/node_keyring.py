@@ -0,0 +1,135 @@
+# node_keyring.py
+# Versioned keyring of inventory RSA keys, addressed by key id
+
+import hashlib
+import threading
+
+import rsa_utils
+
+
+def key_fingerprint(n, e):
+    """Short, stable fingerprint of a public key: first 16 hex digits of SHA-256("n:e")."""
+    return hashlib.sha256(f"{n}:{e}".encode('utf-8')).hexdigest()[:16]
+
+
+def make_key_id(inventory_id, version, n, e):
+    """Key ids look like "A:v2:3f9c0d1e2a4b5c6d" (inventory, key version, fingerprint)."""
+    return f"{inventory_id}:v{version}:{key_fingerprint(n, e)}"
+
+
+class KeyContext:
+    """One RSA key pair of one inventory node, at one key version."""
+    __slots__ = ("key_id", "inventory_id", "version", "n", "e", "d", "p", "q", "phi_n")
+
+    def __init__(self, inventory_id, version, n, e, d, p, q, phi_n):
+        self.inventory_id = inventory_id
+        self.version = version
+        self.n = n
+        self.e = e
+        self.d = d
+        self.p = p
+        self.q = q
+        self.phi_n = phi_n
+        self.key_id = make_key_id(inventory_id, version, n, e)
+
+    @classmethod
+    def from_primes(cls, inventory_id, version, p, q, e):
+        """Derives the key pair from p, q and e. Raises ValueError for unusable parameters."""
+        public_key, private_key_d, p, q, phi_n = rsa_utils.generate_keys_from_pqe(p, q, e)
+        return cls(inventory_id, version, public_key[0], public_key[1], private_key_d, p, q, phi_n)
+
+    def to_record(self):
+        """JSON-friendly form used to persist rotated keys in the store."""
+        return {"inventory_id": self.inventory_id, "version": self.version,
+                "p": str(self.p), "q": str(self.q), "e": str(self.e)}
+
+    @classmethod
+    def from_record(cls, record):
+        """Inverse of to_record()."""
+        return cls.from_primes(record["inventory_id"], record["version"],
+                               int(record["p"]), int(record["q"]), int(record["e"]))
+
+    def as_key_data(self):
+        """The GENERATED_KEYS entry format used by the rest of the app."""
+        return {
+            "public_key_n": self.n,
+            "public_key_e": self.e,
+            "private_key_d": self.d,
+            "p_val": self.p,
+            "q_val": self.q,
+            "phi_n_val": self.phi_n,
+            "key_id": self.key_id,
+            "key_version": self.version,
+        }
+
+
+class Keyring:
+    """
+    Every key version ever used, by key id, plus the active key of each node.
+
+    New versions become active as soon as they are added, while older ones
+    stay available for verifying the records they signed, so a rotation
+    needs no downtime and no re-signing. Readers get plain dict lookups.
+    """
+
+    def __init__(self):
+        self._contexts = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def add(self, context):
+        """Registers a key; it becomes active if it is the node's newest version."""
+        with self._lock:
+            if context.key_id in self._contexts:
+                return False
+            contexts = dict(self._contexts)
+            contexts[context.key_id] = context
+            self._contexts = contexts
+            current = self._active.get(context.inventory_id)
+            if current is None or contexts[current].version < context.version:
+                active = dict(self._active)
+                active[context.inventory_id] = context.key_id
+                self._active = active
+            return True
+
+    def get(self, key_id):
+        """Returns the KeyContext for key_id, or None."""
+        return self._contexts.get(key_id)
+
+    def active(self, inventory_id):
+        """Returns the node's active KeyContext, or None."""
+        key_id = self._active.get(inventory_id)
+        return self._contexts.get(key_id) if key_id else None
+
+    def contexts(self):
+        """Every KeyContext, as of one moment (the mapping is replaced, never mutated)."""
+        return list(self._contexts.values())
+
+    def next_version(self, inventory_id):
+        """Version number for the node's next key."""
+        versions = [c.version for c in self._contexts.values() if c.inventory_id == inventory_id]
+        return max(versions, default=0) + 1
+
+    def resolve(self, key_id=None, inventory_id=None):
+        """
+        Picks the key for a verification: the exact key_id when the record
+        carries one, otherwise (legacy records) the signer's active key.
+        """
+        if key_id:
+            return self.get(key_id)
+        return self.active(inventory_id) if inventory_id else None
+
+    def describe(self):
+        """Public summary of all key versions per node."""
+        contexts = self._contexts
+        active_ids = set(self._active.values())
+        summary = {}
+        for context in sorted(contexts.values(), key=lambda c: (c.inventory_id, c.version)):
+            summary.setdefault(context.inventory_id, []).append({
+                "key_id": context.key_id,
+                "version": context.version,
+                "active": context.key_id in active_ids,
+                "n": str(context.n),
+                "e": str(context.e),
+            })
+        return summary
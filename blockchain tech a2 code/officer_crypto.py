@@ -0,0 +1,215 @@
+# officer_crypto.py
+# Server-side procurement officer key with CRT batch decryption
+
+import hashlib
+import hmac
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import harn_multisig
+import pkg_keys
+
+
+def block_size(n):
+    """Plaintext bytes per RSA block under modulus n (the block plus a 0x01 marker byte must stay below n)."""
+    return (n.bit_length() - 1) // 8 - 1
+
+
+def encrypt_blocks(message, e, n):
+    """
+    Encrypts the string `message` to the public key (e, n) in blocks, since a
+    response is longer than the modulus. Each block of block_size(n) UTF-8
+    bytes is prefixed with a 0x01 byte, so every block integer is below n and
+    leading zero bytes survive. Returns the list of block ciphertexts.
+    """
+    data = message.encode('utf-8')
+    size = block_size(n)
+    if size < 1:
+        raise ValueError("Modulus too small to encrypt in blocks")
+    return [pow(int.from_bytes(b"\x01" + data[i:i + size], 'big'), e, n)
+            for i in range(0, max(len(data), 1), size)]
+
+
+def decode_blocks(block_ints):
+    """Joins decrypted block integers from encrypt_blocks() back into the message string."""
+    data = bytearray()
+    for block_int in block_ints:
+        raw = block_int.to_bytes((block_int.bit_length() + 7) // 8, 'big')
+        if not raw or raw[0] != 1:
+            raise ValueError("Malformed plaintext block (wrong key?)")
+        data += raw[1:]
+    return data.decode('utf-8')
+
+
+def decrypt_blocks(ciphertexts, d, n):
+    """Decrypts encrypt_blocks() output with a full-width private key (d, n)."""
+    return decode_blocks(pow(ciphertext, d, n) for ciphertext in ciphertexts)
+
+
+def _canonical(ciphertext):
+    if isinstance(ciphertext, (list, tuple)):
+        return ",".join(str(block) for block in ciphertext)
+    return str(ciphertext)
+
+
+class CRTKeyContext:
+    """
+    An RSA private key prepared for Chinese Remainder Theorem decryption.
+
+    Instead of one exponentiation modulo n with the full-width d, decryption
+    does two half-width exponentiations (mod p with dp, mod q with dq) and
+    recombines them with q_inv (Garner's formula), which is roughly 3-4x
+    faster. The key stays on the server; clients only send ciphertexts.
+
+    So that the server does not decrypt arbitrary ciphertexts for anyone,
+    every ciphertext it issues gets a tag (an HMAC keyed from d). Any process
+    holding the same key can check the tag, so no shared state is needed.
+    """
+    __slots__ = ("n", "e", "d", "p", "q", "dp", "dq", "q_inv", "_tag_key")
+
+    def __init__(self, p, q, e):
+        self.p = p
+        self.q = q
+        self.e = e
+        self.n = p * q
+        self.d = pkg_keys.mod_inverse(e, (p - 1) * (q - 1))
+        self.dp = self.d % (p - 1)
+        self.dq = self.d % (q - 1)
+        self.q_inv = pkg_keys.mod_inverse(q, p)
+        self._tag_key = hashlib.sha256(b"ciphertext-tag:" + str(self.d).encode()).digest()
+
+    @classmethod
+    def from_params(cls, params):
+        """Builds the context from a {"p", "q", "e"} dict such as pkg_keys.PROCUREMENT_PARAMS."""
+        return cls(params["p"], params["q"], params["e"])
+
+    def __getstate__(self):
+        return (self.p, self.q, self.e)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def tag(self, ciphertext):
+        """Hex tag marking `ciphertext` (an int, or a list of encrypt_blocks() blocks) as issued by this server."""
+        return hmac.new(self._tag_key, _canonical(ciphertext).encode(), hashlib.sha256).hexdigest()
+
+    def is_issued(self, ciphertext, tag):
+        """True if `tag` is this server's tag for `ciphertext`."""
+        return isinstance(tag, str) and hmac.compare_digest(self.tag(ciphertext), tag)
+
+    def decrypt_int(self, ciphertext):
+        """Returns c^d mod n, computed with CRT."""
+        if not 0 <= ciphertext < self.n:
+            raise ValueError("Ciphertext is out of range for this key")
+        m_p = pow(ciphertext % self.p, self.dp, self.p)
+        m_q = pow(ciphertext % self.q, self.dq, self.q)
+        h = (self.q_inv * (m_p - m_q)) % self.p
+        return m_q + h * self.q
+
+    def decrypt_message(self, ciphertext):
+        """CRT counterpart of harn_multisig.decrypt_message(ciphertext, d, n)."""
+        return harn_multisig.int_to_message(self.decrypt_int(ciphertext))
+
+    def decrypt_blocks(self, ciphertexts):
+        """CRT counterpart of decrypt_blocks(ciphertexts, d, n)."""
+        return decode_blocks(self.decrypt_int(ciphertext) for ciphertext in ciphertexts)
+
+
+def _decrypt_one(context, ciphertext):
+    try:
+        if isinstance(ciphertext, (list, tuple)):
+            return {"plaintext": context.decrypt_blocks(ciphertext)}
+        return {"plaintext": context.decrypt_message(ciphertext)}
+    except (ValueError, TypeError) as e:
+        return {"error": str(e)}
+
+
+def _decrypt_chunk(args):
+    context, ciphertexts = args
+    return [_decrypt_one(context, ciphertext) for ciphertext in ciphertexts]
+
+
+class BatchDecryptor:
+    """
+    Decrypts lists of ciphertexts with one CRTKeyContext.
+
+    With workers > 1, batches of at least `parallel_threshold` ciphertexts are
+    split into chunks and spread over a process pool (big-int pow holds the
+    GIL, so threads would not help); smaller batches run inline because the
+    pool round trip would cost more than it saves. Each ciphertext is an int
+    or a list of encrypt_blocks() blocks. The pool's processes are spawned,
+    not forked from the threaded server (see keygen.KeyPool).
+    """
+
+    def __init__(self, context, workers=0, parallel_threshold=256):
+        self.context = context
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def decrypt_batch(self, ciphertexts):
+        """Returns one {"plaintext": str} or {"error": str} dict per ciphertext, in order."""
+        ciphertexts = list(ciphertexts)
+        if self.workers <= 1 or len(ciphertexts) < self.parallel_threshold:
+            return _decrypt_chunk((self.context, ciphertexts))
+        chunk_size = -(-len(ciphertexts) // (self.workers * 4))
+        chunks = [(self.context, ciphertexts[i:i + chunk_size]) for i in range(0, len(ciphertexts), chunk_size)]
+        results = []
+        for chunk_results in self._executor().map(_decrypt_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+if __name__ == "__main__":
+    # Benchmark: current full-width decrypt_message vs CRT, inline and across a process pool
+    import json
+    import os
+    import time
+
+    context = CRTKeyContext.from_params(pkg_keys.PROCUREMENT_PARAMS)
+
+    # Round trip of a query response, which is several blocks long under this modulus
+    response = json.dumps({"item_id": "004", "quantity": "12", "price": "18", "location": "A",
+                           "inventories": ["A", "B", "C"]})
+    blocks = encrypt_blocks(response, context.e, context.n)
+    assert context.decrypt_blocks(blocks) == response
+    assert decrypt_blocks(blocks, context.d, context.n) == response
+    assert BatchDecryptor(context).decrypt_batch([blocks]) == [{"plaintext": response}]
+    print(f"Query response round trip: {len(response)} bytes in {len(blocks)} blocks of "
+          f"{block_size(context.n)} bytes")
+
+    messages = [f"item {i:05d} qty {i % 500}" for i in range(20000)]
+    ciphertexts = [harn_multisig.encrypt_message(message, context.e, context.n) for message in messages]
+
+    start = time.perf_counter()
+    baseline = [harn_multisig.decrypt_message(c, context.d, context.n) for c in ciphertexts]
+    baseline_s = time.perf_counter() - start
+    assert baseline == messages
+    print(f"decrypt_message (full width): {len(ciphertexts) / baseline_s:,.0f} msg/s")
+
+    start = time.perf_counter()
+    crt = [context.decrypt_message(c) for c in ciphertexts]
+    crt_s = time.perf_counter() - start
+    assert crt == messages
+    print(f"CRT inline:                   {len(ciphertexts) / crt_s:,.0f} msg/s ({baseline_s / crt_s:.1f}x)")
+
+    decryptor = BatchDecryptor(context, workers=os.cpu_count() or 1)
+    decryptor.decrypt_batch(ciphertexts[:1000])  # Warm up the pool
+    start = time.perf_counter()
+    pooled = decryptor.decrypt_batch(ciphertexts)
+    pooled_s = time.perf_counter() - start
+    decryptor.close()
+    assert [r["plaintext"] for r in pooled] == messages
+    print(f"CRT, {decryptor.workers} worker process(es): {len(ciphertexts) / pooled_s:,.0f} msg/s "
+          f"({baseline_s / pooled_s:.1f}x)")
@@ -0,0 +1,132 @@
+# query_cache.py
+# Single-flight TTL cache for per-item query results, invalidated by item version
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ItemVersions:
+    """
+    Per-item change counters, kept current as a VersionedState listener.
+
+    Every upsert or removal of an item in any inventory bumps that item's
+    counter, so a cache key that includes the counter is invalidated exactly
+    when the item changes, and edits to other items leave it alone.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, item_id):
+        """Current change counter of item_id (0 if it never changed since startup)."""
+        return self._versions.get(item_id, 0)
+
+    def apply_changes(self, snapshot, changes):
+        """VersionedState listener: bumps the counter of every item a change touches."""
+        touched = set()
+        for change in changes:
+            if change["kind"] == "upsert":
+                touched.add(change["item"]["id"])
+            elif change["kind"] == "remove":
+                touched.add(change["item_id"])
+        if not touched:
+            return
+        with self._lock:
+            versions = dict(self._versions)
+            for item_id in touched:
+                versions[item_id] = versions.get(item_id, 0) + 1
+            self._versions = versions
+
+
+class _Flight:
+    """One computation in progress; followers wait on `done`."""
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlightCache:
+    """
+    TTL + LRU cache whose misses are coalesced: when several threads ask for
+    the same missing key at once, one of them computes the value and the
+    others wait for it instead of repeating the work.
+    """
+
+    def __init__(self, ttl=30.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._flights = {}             # key -> _Flight
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns (value, outcome) where outcome is "hit", "miss" (this call
+        computed the value) or "coalesced" (waited for another caller's
+        computation). Exceptions raised by compute() reach every waiter and
+        nothing is cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[1], "hit"
+                del self._entries[key]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, "coalesced"
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value, "miss"
+
+    def stats(self):
+        """Hit/miss/coalesced counters and current size."""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), in_flight=len(self._flights), ttl=self.ttl)
+
+
+if __name__ == "__main__":
+    # Demo: 50 concurrent identical requests trigger a single computation
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = SingleFlightCache(ttl=5)
+    calls = []
+
+    def slow_query():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"item_id": "004"}
+
+    with ThreadPoolExecutor(max_workers=50) as pool:
+        outcomes = list(pool.map(lambda _: cache.get_or_compute(("004", 0), slow_query)[1], range(50)))
+    print(f"computations: {len(calls)}, outcomes: {sorted(set(outcomes))}, stats: {cache.stats()}")
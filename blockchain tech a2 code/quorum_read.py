@@ -0,0 +1,128 @@
+# quorum_read.py
+# Quorum reads across inventory replicas with digest comparison
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import versioned_state
+
+# Shared pool for lookups that do I/O (parallel=True); one thread per replica is plenty
+READ_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="quorum-read")
+
+
+def row_digest(item):
+    """
+    SHA-256 digest of an item's canonical "id,units,price,location" line.
+    Replicas are compared by digest, so agreement costs one short hash per replica.
+    """
+    canonical = f"{item['id']},{item['units']},{item['price']},{item['location']}"
+    return hashlib.sha256(canonical.encode('utf-8')).digest()
+
+
+def build_id_index(inventories):
+    """
+    Maps each inventory id to {item_id: item} (first occurrence wins, as in a
+    linear scan). Sharded inventories (versioned_state.PartitionedRows) already
+    answer get(item_id) from the owning shard's index and are used as they are.
+    """
+    index = {}
+    for inv_id, items in inventories.items():
+        if isinstance(items, versioned_state.PartitionedRows):
+            index[inv_id] = items
+            continue
+        by_id = {}
+        for item in items:
+            by_id.setdefault(item["id"], item)
+        index[inv_id] = by_id
+    return index
+
+
+def majority(replica_count):
+    """Smallest number of replicas that forms a majority."""
+    return replica_count // 2 + 1
+
+
+def quorum_read(replica_ids, lookup, read_quorum=None, wait_for_all=False, timeout=None, parallel=False):
+    """
+    Reads one item from the replicas and returns the majority value.
+
+    lookup(replica_id) returns the replica's item dict or None. Each result is
+    reduced to a row digest; as soon as `read_quorum` replicas (default: a
+    majority) agree on a digest the read completes, unless wait_for_all is set,
+    in which case every replica is read for a complete divergence report.
+
+    By default the lookups run inline, in replica_ids order, so the replicas
+    read (and reported as agreeing) are always the same ones. For lookups that
+    do I/O, parallel=True runs them on READ_EXECUTOR instead and completes with
+    whichever replicas answer first; `timeout` only applies then.
+
+    Returns a dict with:
+      value      - the agreed item (None if no quorum was reached)
+      quorum     - True if at least read_quorum replicas agreed
+      agreeing   - replica ids that returned the agreed value
+      divergent  - {replica_id: hex digest} of replicas that returned something else
+      missing    - replica ids that do not have the item
+      unchecked  - replica ids whose answers were not awaited (or failed / timed out)
+    """
+    replica_ids = list(replica_ids)
+    if read_quorum is None:
+        read_quorum = majority(len(replica_ids))
+    read_quorum = max(1, min(read_quorum, len(replica_ids)))
+
+    answers = {}   # replica_id -> digest (None when missing)
+    values = {}    # digest -> item
+    votes = {}     # digest -> [replica ids]
+    winner = None
+
+    def record(replica_id, item):
+        nonlocal winner
+        digest = row_digest(item) if item is not None else None
+        answers[replica_id] = digest
+        if digest is not None:
+            values.setdefault(digest, item)
+            votes.setdefault(digest, []).append(replica_id)
+            if winner is None and len(votes[digest]) >= read_quorum:
+                winner = digest
+
+    if not parallel:
+        for replica_id in replica_ids:
+            try:
+                item = lookup(replica_id)
+            except Exception as e:
+                print(f"Quorum read: replica {replica_id} failed: {e}")
+                continue
+            record(replica_id, item)
+            if winner is not None and not wait_for_all:
+                break
+    else:
+        futures = {READ_EXECUTOR.submit(lookup, replica_id): replica_id for replica_id in replica_ids}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break  # Timed out
+            for future in done:
+                replica_id = futures[future]
+                try:
+                    item = future.result()
+                except Exception as e:
+                    print(f"Quorum read: replica {replica_id} failed: {e}")
+                    continue
+                record(replica_id, item)
+            if winner is not None and not wait_for_all:
+                break
+
+    if winner is None and votes:
+        # No quorum: report the most common answer, but flag it
+        winner = max(votes, key=lambda digest: len(votes[digest]))
+    agreeing = sorted(votes.get(winner, []))
+    return {
+        "value": values.get(winner),
+        "quorum": len(agreeing) >= read_quorum,
+        "read_quorum": read_quorum,
+        "agreeing": agreeing,
+        "divergent": {replica_id: digest.hex() for replica_id, digest in sorted(answers.items())
+                      if digest is not None and digest != winner},
+        "missing": sorted(replica_id for replica_id, digest in answers.items() if digest is None),
+        "unchecked": sorted(replica_id for replica_id in replica_ids if replica_id not in answers),
+    }
@@ -0,0 +1,51 @@
+# response_cache.py
+# Pre-serialized response bodies cached per state version, served with ETags
+
+import threading
+
+
+class VersionedResponseCache:
+    """
+    Keeps the serialized body of each cacheable response for the state
+    version it was rendered at.
+
+    Every entry is (version, body, etag). A lookup for the same version
+    returns the stored body without re-rendering; a newer version replaces
+    the entry. Rendering happens outside the lock, so two threads that miss
+    at the same time may both render, but readers never wait on each other.
+    """
+
+    def __init__(self, instance_id):
+        # instance_id distinguishes stores, so ETags from an older process or
+        # a deleted database can never match a fresh version counter
+        self.instance_id = instance_id
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def etag(self, name, version):
+        """Returns the (unquoted) entity tag for `name` at `version`."""
+        return f"{self.instance_id:x}-{version}-{name}"
+
+    def get(self, name, version, render):
+        """
+        Returns (body, etag) for `name` at `version`, calling render() to
+        produce the body (a str or bytes) only on a cache miss.
+        """
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+        body = render()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        etag = self.etag(name, version)
+        with self._lock:
+            current = self._entries.get(name)
+            # Never let a slow render for an old version overwrite a newer entry
+            if current is None or current[0] is None or version is None or current[0] <= version:
+                self._entries[name] = (version, body, etag)
+        return body, etag
+
+    def clear(self):
+        """Drops every cached body."""
+        with self._lock:
+            self._entries = {}
@@ -112,3 +112,12 @@ def verify_signature(message_str, signature, public_key_e, n):
     decrypted_hash_int = power(signature, public_key_e, n)
     
     return hashed_message_int == decrypted_hash_int, hashed_message_hex, decrypted_hash_int
+
+def verify_digest(hashed_message_int, signature, public_key_e, n):
+    """
+    Verifies an RSA signature against an already computed message hash
+    (as an integer), for callers that keep the digest instead of the message.
+    Returns True if valid, False otherwise, along with the decrypted hash (int).
+    """
+    decrypted_hash_int = power(signature, public_key_e, n)
+    return hashed_message_int == decrypted_hash_int, decrypted_hash_int
@@ -10,11 +10,12 @@ import sys
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
-# Import the app from src/main
 sys.path.insert(0, os.path.join(current_dir, 'src', 'main'))
-from app import app
 
 if __name__ == "__main__":
+    # Imported here, not at module level: the key pool's spawned processes re-import this script
+    from app import app
+
     print("Starting Blockchain-Based Inventory Management System...")
     print(f"Python path: {sys.path}")
     print(f"Working directory: {os.getcwd()}")
@@ -25,5 +26,9 @@ if __name__ == "__main__":
         os.makedirs(database_dir)
         print(f"Created database directory: {database_dir}")
     
-    # Run the Flask application
-    app.run(host="0.0.0.0", port=5001, debug=True) 
\ No newline at end of file
+    # Run the Flask application (or the async server with --async / SERVER_MODE=async)
+    if "--async" in sys.argv or os.environ.get("SERVER_MODE", "").lower() == "async":
+        import async_server
+        async_server.serve(host="0.0.0.0", port=5001)
+    else:
+        app.run(host="0.0.0.0", port=5001, debug=True) 
\ No newline at end of file
@@ -13,5 +13,9 @@ setup(
         "pycryptodome>=3.19.0",
         "python-dotenv>=1.0.0",
     ],
+    extras_require={
+        "analytics": ["numpy>=1.21"],
+        "async": ["uvicorn>=0.23"],
+    },
     python_requires=">=3.7",
 ) 
\ No newline at end of file
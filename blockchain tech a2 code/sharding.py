@@ -0,0 +1,349 @@
+# sharding.py
+# Hash-partitioned inventory store: one backend store per shard, scatter-gather reads
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+import node_keyring
+import inventory_query
+import versioned_state
+
+LAYOUT_FILE = "layout.json"
+
+
+def shard_for(item_id, shard_count):
+    """
+    Owning shard of an item: the first 8 bytes of SHA-1(item id) modulo the
+    shard count. Stable across processes, unlike Python's salted hash().
+    """
+    digest = hashlib.sha1(str(item_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+def _open_shard(backend, shard_dir, inventory_ids):
+    os.makedirs(shard_dir, exist_ok=True)
+    if backend == "file":
+        return storage.TextFileStore(shard_dir, inventory_ids)
+    if backend == "sqlite":
+        return storage.SQLiteStore(os.path.join(shard_dir, "inventory.sqlite3"), inventory_ids,
+                                   run_id=os.environ.get("INVENTORY_RUN_ID"))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def read_layout(shards_dir):
+    """Returns the saved {"shard_count", "backend"} layout of shards_dir, or None."""
+    path = os.path.join(shards_dir, LAYOUT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def _write_layout(shards_dir, shard_count, backend):
+    with open(os.path.join(shards_dir, LAYOUT_FILE), 'w') as file:
+        json.dump({"shard_count": shard_count, "backend": backend, "partitioning": "sha1-mod"}, file)
+
+
+class _ShardRows:
+    """One node's rows in one shard (the shard store's own tuple), with an id index built on the first get()."""
+    __slots__ = ("rows", "_by_id")
+
+    def __init__(self, rows=()):
+        self.rows = rows
+        self._by_id = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def get(self, item_id):
+        """Returns the row with this id (the first, if several), or None."""
+        by_id = self._by_id
+        if by_id is None:
+            by_id = {}
+            for item in self.rows:
+                by_id.setdefault(item["id"], item)
+            self._by_id = by_id  # Racing builders produce equal dicts; either one may stay
+        return by_id.get(item_id)
+
+
+class _ShardView:
+    """
+    One shard's rows as of one shard version, with a secondary index built on
+    first query. Shared between requests and never modified.
+    """
+
+    def __init__(self, version, inventories, previous=None):
+        self.version = version
+        self.inventories = {}
+        for inv_id, items in inventories.items():
+            # A node the shard's last write left alone (a ledger append on shard 0, say) keeps its rows and index
+            old = previous.inventories.get(inv_id) if previous is not None else None
+            self.inventories[inv_id] = old if old is not None and old.rows is items else _ShardRows(items)
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = inventory_query.InventoryQueryEngine(self.inventories)
+        return self._engine
+
+
+class ShardedStore(storage.InventoryStore):
+    """
+    Partitions every node's items across `shard_count` stores by hash of item id.
+
+    Each shard is a complete InventoryStore (its own directory, text files or
+    SQLite database) holding only the rows it owns. Writes and point lookups
+    touch just the owning shard; full loads and queries run on every shard in
+    parallel and merge the results. The ledger, blocks and keys are small and
+    global, so they live on shard 0.
+
+    Each shard's rows are kept as a _ShardView until that shard's version
+    changes, so a full load after a write re-reads only the shards written
+    to. A full load does not merge the shards: each node's rows come back as
+    a versioned_state.PartitionedRows over the views' tuples, so the app's
+    snapshot shares the rows with the views instead of holding its own copy,
+    and a new version diffs only the shards that changed. Item lookups
+    (get_item, and get() on the loaded rows) go to the owning shard's id
+    index, and queries to per-shard secondary indexes, instead of scanning.
+
+    The shard count is recorded in shards_dir/layout.json; opening with a
+    different count fails until the data is moved with rebalance().
+    """
+    backend_name = "sharded"
+
+    def __init__(self, shards_dir, shard_count, backend="file", inventory_ids=None):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        backend = (backend or "file").lower()
+        os.makedirs(shards_dir, exist_ok=True)
+        layout = read_layout(shards_dir)
+        if layout is not None and (layout["shard_count"] != shard_count or layout["backend"] != backend):
+            raise ValueError(
+                f"{shards_dir} holds {layout['shard_count']} {layout['backend']} shards, not {shard_count} {backend}; "
+                f"run: python sharding.py rebalance {shards_dir} {shard_count}")
+        if layout is None:
+            _write_layout(shards_dir, shard_count, backend)
+        self.shards_dir = shards_dir
+        self.shard_count = shard_count
+        self.shard_backend = backend
+        self.inventory_ids = list(inventory_ids or storage.INVENTORY_IDS)
+        self.shards = [_open_shard(backend, os.path.join(shards_dir, f"shard_{index:03d}"), self.inventory_ids)
+                       for index in range(shard_count)]
+        self._executor = ThreadPoolExecutor(max_workers=shard_count, thread_name_prefix="shard")
+        self._views = [None] * shard_count
+        self._views_lock = threading.Lock()
+
+    @property
+    def durable(self):
+        return self.home.durable
+
+    @property
+    def shared(self):
+        return self.home.shared
+
+    @property
+    def home(self):
+        """Shard 0, which also holds the ledger, blocks and keys."""
+        return self.shards[0]
+
+    def shard_of(self, item_id):
+        return self.shards[shard_for(item_id, self.shard_count)]
+
+    def _part_of(self, item_id):
+        return shard_for(item_id, self.shard_count)
+
+    def view(self, index):
+        """The _ShardView of shard `index`, re-read only if the shard changed since the last one."""
+        shard = self.shards[index]
+        version = shard.version()  # Read first: a write racing the load only causes one extra reload
+        view = self._views[index]
+        if view is not None and view.version == version:
+            return view
+        view = _ShardView(version, shard.load_inventories(), view)
+        with self._views_lock:
+            self._views[index] = view
+        return view
+
+    # --- InventoryStore ---
+
+    def claim_initialization(self):
+        return self.home.claim_initialization()
+
+    def load_inventories(self):
+        views = list(self._executor.map(self.view, range(self.shard_count)))
+        inventory_ids = list(self.inventory_ids)
+        inventory_ids += sorted({inv_id for view in views for inv_id in view.inventories} - set(inventory_ids))
+        empty = _ShardRows()
+        return {inv_id: versioned_state.PartitionedRows([view.inventories.get(inv_id, empty) for view in views],
+                                                        self._part_of)
+                for inv_id in inventory_ids}
+
+    def get_item(self, inv_id, item_id):
+        item = self.view(shard_for(item_id, self.shard_count)).inventories.get(inv_id, _ShardRows()).get(item_id)
+        return dict(item) if item is not None else None
+
+    def find_row(self, item_id, location):
+        return self.shard_of(item_id).find_row(item_id, location)
+
+    def replace_inventory(self, inv_id, items):
+        partitions = [[] for _ in self.shards]
+        for item in items:
+            partitions[shard_for(item["id"], self.shard_count)].append(item)
+        list(self._executor.map(lambda pair: pair[0].replace_inventory(inv_id, pair[1]), zip(self.shards, partitions)))
+
+    def upsert_item(self, inv_id, item):
+        self.shard_of(item["id"]).upsert_item(inv_id, item)
+
+    def load_signed_records(self):
+        return self.home.load_signed_records()
+
+    def append_signed_record(self, record):
+        self.home.append_signed_record(record)
+
+    def clear_signed_records(self):
+        self.home.clear_signed_records()
+
+    def load_blocks(self):
+        return self.home.load_blocks()
+
+    def append_block(self, block):
+        return self.home.append_block(block)
+
+    def load_keys(self):
+        return self.home.load_keys()
+
+    def add_key(self, key_id, key_record):
+        return self.home.add_key(key_id, key_record)
+
+    def restore_image(self, inventories, signed_records, blocks, keys):
+        partitions = [{inv_id: [] for inv_id in inventories} for _ in self.shards]
+        for inv_id, items in inventories.items():
+            for item in items:
+                partitions[shard_for(item["id"], self.shard_count)][inv_id].append(item)
+        self.home.restore_image(partitions[0], signed_records, blocks, keys)
+        list(self._executor.map(lambda pair: pair[0].restore_image(pair[1], [], [], {}),
+                                zip(self.shards[1:], partitions[1:])))
+
+    def exclusive_lock(self):
+        return self.home.exclusive_lock()
+
+    def save_job(self, job_id, body):
+        self.home.save_job(job_id, body)
+
+    def load_job(self, job_id):
+        return self.home.load_job(job_id)
+
+    def version(self):
+        # Every shard's version only grows, so their sum changes on any write to any shard
+        return sum(shard.version() for shard in self.shards)
+
+    def instance_id(self):
+        instance = 0
+        for shard in self.shards:
+            instance ^= shard.instance_id()
+        return instance
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self._executor.shutdown(wait=False)
+
+    # --- Scatter-gather reads ---
+
+    def query(self, filters, limit=None):
+        """
+        Runs a query for rows matching `filters` (see inventory_query.parse_filters)
+        against each shard's index in parallel and merges them, ordered by
+        inventory and item id. A filter on "id" only asks the owning shard.
+        """
+        def search(index):
+            rows = self.view(index).engine().query(filters)
+            rows.sort(key=sort_key)
+            return rows[:limit] if limit is not None else rows
+
+        sort_key = lambda row: (row["inventory"], row["id"])
+        if "id" in filters:
+            indexes = [shard_for(filters["id"], self.shard_count)]
+        else:
+            indexes = range(self.shard_count)
+        rows = [row for shard_rows in self._executor.map(search, indexes) for row in shard_rows]
+        rows.sort(key=sort_key)
+        return rows[:limit] if limit is not None else rows
+
+    def stats(self):
+        """Rows per node in each shard, plus each shard's version."""
+        def shard_stats(index):
+            view = self.view(index)
+            return {"version": view.version,
+                    "rows": {inv_id: len(items) for inv_id, items in view.inventories.items()}}
+
+        return {"shard_count": self.shard_count, "backend": self.shard_backend,
+                "shards": list(self._executor.map(shard_stats, range(self.shard_count)))}
+
+
+def rebalance(shards_dir, new_count, backend=None):
+    """
+    Moves an existing sharded store to `new_count` shards: builds the new
+    layout next to the old one, copies every row to its new owner and the
+    ledger, blocks and keys to the new shard 0, then swaps the directories.
+    Run it while the server is stopped. Returns the row count per node.
+    """
+    layout = read_layout(shards_dir)
+    if layout is None:
+        raise ValueError(f"No sharded store found in {shards_dir}")
+    backend = backend or layout["backend"]
+    old = ShardedStore(shards_dir, layout["shard_count"], layout["backend"])
+    staging_dir = shards_dir.rstrip(os.sep) + ".rebalance"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    new = ShardedStore(staging_dir, new_count, backend, old.inventory_ids)
+    try:
+        inventories = old.load_inventories()
+        for inv_id, items in inventories.items():
+            new.replace_inventory(inv_id, items)
+        new.home.claim_initialization()
+        for record in old.load_signed_records():
+            new.append_signed_record(record)
+        for block in old.load_blocks():
+            new.append_block(block)
+        for key_record in old.load_keys():
+            new.add_key(node_keyring.KeyContext.from_record(key_record).key_id, key_record)
+    finally:
+        old.close()
+        new.close()
+
+    retired_dir = shards_dir.rstrip(os.sep) + ".old"
+    shutil.rmtree(retired_dir, ignore_errors=True)
+    os.replace(shards_dir, retired_dir)
+    os.replace(staging_dir, shards_dir)
+    shutil.rmtree(retired_dir, ignore_errors=True)
+    return {inv_id: len(items) for inv_id, items in inventories.items()}
+
+
+if __name__ == "__main__":
+    # Usage: python sharding.py rebalance <shards_dir> <new_shard_count> [file|sqlite]
+    #        python sharding.py stats <shards_dir>
+    import sys
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "rebalance":
+        moved = rebalance(sys.argv[2], int(sys.argv[3]), sys.argv[4] if len(sys.argv) > 4 else None)
+        print(f"Rebalanced {sys.argv[2]} to {sys.argv[3]} shards: {moved}")
+    elif len(sys.argv) == 3 and sys.argv[1] == "stats":
+        layout = read_layout(sys.argv[2])
+        store = ShardedStore(sys.argv[2], layout["shard_count"], layout["backend"])
+        print(json.dumps(store.stats(), indent=2))
+        store.close()
+    else:
+        print("Usage: python sharding.py rebalance <shards_dir> <new_shard_count> [file|sqlite]")
+        print("       python sharding.py stats <shards_dir>")
+        sys.exit(1)
@@ -0,0 +1,160 @@
+# sign_jobs.py
+# Bounded job queue and worker pipeline for asynchronous /sign_record submissions
+
+import json
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import wire_format
+
+
+class QueueFull(Exception):
+    """Raised by SignJobQueue.submit when admission control rejects a job."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Sign queue is full; retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+def _tag_big_ints(obj):
+    if isinstance(obj, wire_format.BigInt):
+        return {"$bigint": str(obj)}
+    if isinstance(obj, dict):
+        return {key: _tag_big_ints(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_tag_big_ints(value) for value in obj]
+    return obj
+
+
+def _untag_big_int(obj):
+    return wire_format.BigInt(obj["$bigint"]) if set(obj) == {"$bigint"} else obj
+
+
+def encode_job(job):
+    """Serializes a job for a shared job store, keeping BigInt results BigInt (json would flatten them to int)."""
+    return json.dumps(_tag_big_ints(job))
+
+
+def decode_job(body):
+    """Parses a job serialized by encode_job()."""
+    return json.loads(body, object_hook=_untag_big_int)
+
+
+class SignJobQueue:
+    """
+    Accepts sign jobs into a bounded queue and processes them on worker threads.
+
+    process_fn(payload) returns (result_dict, http_status) and runs on a worker.
+    submit() never blocks: when `max_pending` jobs are already waiting it raises
+    QueueFull with a Retry-After estimate (queue depth x average job time), so
+    a burst is shed at the door instead of piling up behind the server threads.
+    Finished jobs are kept for polling, up to `max_finished` of them.
+
+    With a `job_store` (a store whose save_job/load_job are shared between
+    processes), every state change is also published there, so a poll that
+    lands on another worker process still finds the job.
+    """
+
+    def __init__(self, process_fn, max_pending=32, workers=1, max_finished=1000, job_store=None):
+        self.process_fn = process_fn
+        self.max_finished = max_finished
+        self.job_store = job_store
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = OrderedDict()  # job_id -> job dict, in submission order
+        self._lock = threading.Lock()
+        self._avg_seconds = None    # Moving average of job processing time
+        self._stats = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0}
+        self._workers = [threading.Thread(target=self._run, name=f"sign-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def retry_after(self):
+        """Seconds a rejected client should wait: time to drain the current queue, at least 1."""
+        average = self._avg_seconds if self._avg_seconds is not None else 1.0
+        return max(1, math.ceil(self._queue.qsize() * average / len(self._workers)))
+
+    def submit(self, payload):
+        """Enqueues a job and returns its public view. Raises QueueFull when the queue is full."""
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "result_status": None,
+        }
+        with self._lock:
+            try:
+                self._queue.put_nowait((job, payload))
+            except queue.Full:
+                self._stats["rejected"] += 1
+                raise QueueFull(self.retry_after())
+            self._jobs[job["job_id"]] = job
+            self._stats["submitted"] += 1
+            self._publish(job)
+            return dict(job, queue_position=self._queue.qsize())
+
+    def get(self, job_id):
+        """Returns a copy of the job (from the job store if another process ran it), or None if unknown or evicted."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        if self.job_store is None:
+            return None
+        body = self.job_store.load_job(job_id)
+        return decode_job(body) if body is not None else None
+
+    def stats(self):
+        """Queue depth, capacity, counters and the average job time."""
+        with self._lock:
+            return dict(self._stats,
+                        queued=self._queue.qsize(),
+                        capacity=self._queue.maxsize,
+                        workers=len(self._workers),
+                        avg_job_ms=round(self._avg_seconds * 1000, 2) if self._avg_seconds is not None else None)
+
+    def _run(self):
+        while True:
+            job, payload = self._queue.get()
+            with self._lock:
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                self._publish(job)
+            start = time.perf_counter()
+            try:
+                result, status = self.process_fn(payload)
+            except Exception as e:
+                print(f"Sign job {job['job_id']} failed: {e}")
+                result, status = {"error": f"Signing failed: {str(e)}"}, 500
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._avg_seconds = elapsed if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * elapsed
+                job["status"] = "succeeded" if status < 400 else "failed"
+                job["finished_at"] = time.time()
+                job["result"] = result
+                job["result_status"] = status
+                self._stats[job["status"]] += 1
+                self._publish(job)
+                self._evict_finished()
+            self._queue.task_done()
+
+    def _publish(self, job):
+        """Saves the job's current state to the job store (lock held, so states are saved in order)."""
+        if self.job_store is None:
+            return
+        try:
+            self.job_store.save_job(job["job_id"], encode_job(job))
+        except Exception as e:
+            print(f"Could not publish sign job {job['job_id']}: {e}")
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,284 @@
+# signed_record.py
+# Compact in-memory form of a signed ledger record
+
+import hashlib
+import sys
+
+# The sentence every inventory signs; re-derived from the record's fields instead of being stored
+MESSAGE_TEMPLATE = ("Inventory {inventory_id} has purchased {units} units of item with ID {item_id}, "
+                    "priced at {price}, located at {location}.")
+
+ITEM_FIELDS = ("id", "units", "price", "location")
+RECORD_FIELDS = ("inventory_id", "key_id", "message", "signature", "hash", "item")
+# Key in `extra` listing record fields the stored dict did not have, where the compact form would derive one
+ABSENT = "$absent"
+
+
+def format_message(inventory_id, item_id, units, price, location):
+    """The message an inventory signs for a record."""
+    return MESSAGE_TEMPLATE.format(inventory_id=inventory_id, units=units, item_id=item_id,
+                                   price=price, location=location)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class SignedRecord:
+    """
+    One ledger entry: inventory id, key id, the RSA signature as an int, the
+    32-byte SHA-256 digest of the signed message, and the item as a tuple of
+    interned strings (id, units, price, location).
+
+    The message is not stored; `message` rebuilds it from MESSAGE_TEMPLATE.
+    The digest is computed once, when the record is created or loaded, so a
+    verification sweep is a single pow() per record with no int parsing or
+    re-hashing. Fields that cannot be re-derived (a message that does not
+    follow the template, a hash that does not match it, an unparsable
+    signature, unknown keys) are kept verbatim in `extra`, and derivable
+    fields the stored dict lacked are listed under extra[ABSENT], so
+    to_dict() always returns exactly the stored record.
+
+    Records are immutable. They support read-only mapping access
+    (record["item"], record.get("key_id"), dict(record)) in the legacy dict
+    form, for code that serializes or hashes whole records.
+    """
+    __slots__ = ("inventory_id", "key_id", "signature", "digest", "item", "extra")
+
+    def __init__(self, inventory_id, key_id, signature, digest, item, extra=None):
+        object.__setattr__(self, "inventory_id", _intern(inventory_id))
+        object.__setattr__(self, "key_id", _intern(key_id))
+        object.__setattr__(self, "signature", signature)
+        object.__setattr__(self, "digest", digest)
+        object.__setattr__(self, "item", tuple(_intern(value) for value in item) if item is not None else None)
+        object.__setattr__(self, "extra", extra or None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SignedRecord is immutable")
+
+    @classmethod
+    def create(cls, inventory_id, key_id, signature, item):
+        """A freshly signed record for `item` (a {"id", "units", "price", "location"} dict)."""
+        message = format_message(inventory_id, item["id"], item["units"], item["price"], item["location"])
+        return cls(inventory_id, key_id, signature, hashlib.sha256(message.encode('utf-8')).digest(),
+                   tuple(item[field] for field in ITEM_FIELDS))
+
+    @classmethod
+    def from_dict(cls, record):
+        """Builds the compact form of a stored record dict; returns SignedRecord instances unchanged."""
+        if isinstance(record, SignedRecord):
+            return record
+        extra = {key: value for key, value in record.items() if key not in RECORD_FIELDS}
+        absent = []
+
+        item_dict = record.get("item")
+        item = None
+        if isinstance(item_dict, dict) and set(item_dict) == set(ITEM_FIELDS) \
+                and all(isinstance(item_dict[field], str) for field in ITEM_FIELDS):
+            item = tuple(item_dict[field] for field in ITEM_FIELDS)
+        elif "item" in record:
+            extra["item"] = item_dict
+
+        inventory_id = record.get("inventory_id")
+        message = record.get("message")
+        if item is None or message != format_message(inventory_id, *item):
+            if "message" in record:
+                extra["message"] = message
+            elif item is not None:
+                absent.append("message")  # Otherwise `message` would invent the template sentence
+        digest = hashlib.sha256(message.encode('utf-8')).digest() if isinstance(message, str) else None
+        if "hash" in record and (digest is None or record["hash"] != digest.hex()):
+            extra["hash"] = record["hash"]
+        elif "hash" not in record and digest is not None:
+            absent.append("hash")
+        if absent:
+            extra[ABSENT] = absent
+
+        signature = None
+        try:
+            signature = int(record["signature"])
+            if str(signature) != record["signature"]:
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            if "signature" in record:
+                extra["signature"] = record["signature"]
+            signature = None
+
+        return cls(inventory_id, record.get("key_id"), signature, digest, item, extra)
+
+    # --- Derived fields ---
+
+    @property
+    def message(self):
+        if self.extra and "message" in self.extra:
+            return self.extra["message"]
+        if self.item is None or self._absent("message"):
+            return None
+        return format_message(self.inventory_id, *self.item)
+
+    @property
+    def item_dict(self):
+        if self.extra and "item" in self.extra:
+            return self.extra["item"]
+        return dict(zip(ITEM_FIELDS, self.item)) if self.item is not None else None
+
+    @property
+    def hash_hex(self):
+        if self.extra and "hash" in self.extra:
+            return self.extra["hash"]
+        if self.digest is None or self._absent("hash"):
+            return None
+        return self.digest.hex()
+
+    def _absent(self, key):
+        return bool(self.extra) and key in self.extra.get(ABSENT, ())
+
+    def digest_int(self):
+        """The signed digest as an integer (what signature^e mod n must equal)."""
+        return int.from_bytes(self.digest, 'big') if self.digest is not None else None
+
+    def to_dict(self):
+        """The legacy record dict, as stored and served."""
+        record = {}
+        for key in RECORD_FIELDS:
+            value = self._field(key)
+            if value is not None or (self.extra and key in self.extra):
+                record[key] = value
+        if self.extra:
+            for key, value in self.extra.items():
+                if key != ABSENT:
+                    record.setdefault(key, value)
+        return record
+
+    def _has(self, key):
+        """Whether the legacy dict has `key`, without building it (mirrors to_dict)."""
+        if key == ABSENT:
+            return False
+        if self.extra and key in self.extra:
+            return True
+        return key in RECORD_FIELDS and self._field(key) is not None
+
+    def _field(self, key):
+        if key == "inventory_id":
+            return self.inventory_id
+        if key == "key_id":
+            return self.key_id
+        if key == "message":
+            return self.message
+        if key == "signature":
+            if self.extra and "signature" in self.extra:
+                return self.extra["signature"]
+            return str(self.signature) if self.signature is not None else None
+        if key == "hash":
+            return self.hash_hex
+        if key == "item":
+            return self.item_dict
+        return self.extra.get(key) if self.extra else None
+
+    # --- Read-only mapping access in the legacy dict form ---
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def __getitem__(self, key):
+        if not self._has(key):
+            raise KeyError(key)
+        return self._field(key)
+
+    def get(self, key, default=None):
+        return self._field(key) if self._has(key) else default
+
+    def __contains__(self, key):
+        return self._has(key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def _identity(self):
+        return (self.inventory_id, self.key_id, self.signature, self.digest, self.item,
+                tuple(sorted(self.extra.items(), key=lambda pair: pair[0])) if self.extra else None)
+
+    def __eq__(self, other):
+        if isinstance(other, SignedRecord):
+            return self._identity() == other._identity()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"SignedRecord({self.to_dict()!r})"
+
+
+def compact_records(records, previous=()):
+    """
+    Converts a store's ledger (a list of record dicts or SignedRecords) to
+    SignedRecords, re-using the instances of `previous` (the last snapshot's
+    tuple) for entries that are the same object or an equal record.
+    """
+    compact = []
+    for index, record in enumerate(records):
+        if index < len(previous) and (previous[index] is record or previous[index] == record):
+            compact.append(previous[index])
+        else:
+            compact.append(SignedRecord.from_dict(record))
+    return compact
+
+
+if __name__ == "__main__":
+    # Benchmark: per-record memory and a full verification sweep, dict records vs SignedRecord
+    import gc
+    import time
+    import tracemalloc
+
+    import rsa_utils
+
+    p, q, e = (1210613765735147311106936311866593978079938707, 1247842850282035753615951347964437248190231863,
+               815459040813953176289801)
+    _, d, _, _, _ = rsa_utils.generate_keys_from_pqe(p, q, e)
+    n = p * q
+    count = 20000
+
+    def make_dicts():
+        records = []
+        for i in range(count):
+            item = {"id": f"{i:06d}", "units": str(i % 90), "price": str(i % 40), "location": "ABCD"[i % 4]}
+            message = format_message("A", item["id"], item["units"], item["price"], item["location"])
+            signature, hash_hex = rsa_utils.sign_message(message, d, n)
+            records.append({"inventory_id": "A", "key_id": "A:v1:3f9c0d1e2a4b5c6d", "message": message,
+                            "signature": str(signature), "hash": hash_hex, "item": item})
+        return records
+
+    dicts = make_dicts()
+    gc.collect()
+    tracemalloc.start()
+    dicts = make_dicts()
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    gc.collect()
+    tracemalloc.start()
+    compact = [SignedRecord.from_dict(record) for record in dicts]
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert [record.to_dict() for record in compact] == dicts
+    print(f"Per record: dict {dict_bytes / count:.0f} B, SignedRecord {compact_bytes / count:.0f} B "
+          f"({dict_bytes / compact_bytes:.1f}x smaller)")
+
+    # Both sweeps use rsa_utils' modular exponentiation; the difference is the parsing and hashing
+    start = time.perf_counter()
+    assert all(rsa_utils.verify_signature(record["message"], int(record["signature"]), e, n)[0] for record in dicts)
+    dict_s = time.perf_counter() - start
+    start = time.perf_counter()
+    assert all(rsa_utils.verify_digest(record.digest_int(), record.signature, e, n)[0] for record in compact)
+    compact_s = time.perf_counter() - start
+    print(f"Verification sweep of {count:,} records: dict {dict_s * 1000:.0f} ms, "
+          f"SignedRecord {compact_s * 1000:.0f} ms")
+    start = time.perf_counter()
+    for record in dicts:
+        int(record["signature"]), hashlib.sha256(record["message"].encode('utf-8')).digest()
+    parse_s = time.perf_counter() - start
+    print(f"  of which per-sweep parsing and hashing skipped: {parse_s * 1000:.0f} ms")
@@ -0,0 +1,399 @@
+# snapshot_image.py
+# Checksummed binary point-in-time images of the whole state, written in the background, for fast restore
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import node_keyring
+import signed_record
+
+MAGIC = b"INVSNAP1"
+FORMAT_VERSION = 1
+HEADER = struct.Struct(">8sHdQH")   # magic, format version, created (unix time), state version, section count
+SECTION = struct.Struct(">4sQI")    # tag, payload length, CRC-32 of the payload
+COUNT = struct.Struct(">I")
+LENGTH = struct.Struct(">Q")
+DIGEST_SIZE = 32                     # SHA-256 of everything before it, at the end of the file
+
+# Column values are joined with the ASCII unit separator, which never occurs in inventory text
+SEPARATOR = "\x1f"
+
+# Presence flags of a ledger record's optional fields (one byte per record)
+HAS_INVENTORY_ID, HAS_KEY_ID, HAS_SIGNATURE, HAS_DIGEST, HAS_ITEM = 1, 2, 4, 8, 16
+
+ITEM_FIELDS = ("id", "units", "price", "location")
+
+
+class ImageError(ValueError):
+    """Raised for a truncated, corrupt or incompatible image."""
+
+
+class StateImage:
+    """
+    The decoded contents of an image: inventories ({node: [item dicts]}),
+    signed_records (SignedRecords), blocks (dicts), key_contexts
+    (node_keyring.KeyContexts) and the state version they were taken at.
+    """
+
+    def __init__(self, state_version, created, inventories, signed_records, blocks, key_contexts):
+        self.state_version = state_version
+        self.created = created
+        self.inventories = inventories
+        self.signed_records = signed_records
+        self.blocks = blocks
+        self.key_contexts = key_contexts
+
+    def stored_keys(self):
+        """{key_id: key_record} for the store: the rotated versions (version 1 comes from INVENTORY_PARAMS)."""
+        return {context.key_id: context.to_record() for context in self.key_contexts if context.version > 1}
+
+
+# --- Column encoding ---
+
+def _pack_strings(values):
+    """Length-prefixed blob of strings joined by SEPARATOR."""
+    joined = SEPARATOR.join(values)
+    if values and joined.count(SEPARATOR) != len(values) - 1:
+        raise ValueError("a value contains the column separator")
+    blob = joined.encode("utf-8")
+    return LENGTH.pack(len(blob)) + blob
+
+
+def _unpack_strings(payload, offset, count):
+    (length,) = LENGTH.unpack_from(payload, offset)
+    offset += LENGTH.size
+    blob = payload[offset:offset + length]
+    if len(blob) != length:
+        raise ImageError("column runs past the end of its section")
+    values = blob.decode("utf-8").split(SEPARATOR) if count else []
+    if len(values) != count:
+        raise ImageError("column has the wrong number of values")
+    return values, offset + length
+
+
+def _encode_inventories(inventories):
+    parts = [COUNT.pack(len(inventories))]
+    for inv_id, items in inventories.items():
+        parts.append(_pack_strings([inv_id]))
+        parts.append(COUNT.pack(len(items)))
+        for field in ITEM_FIELDS:
+            parts.append(_pack_strings([item[field] for item in items]))
+    return b"".join(parts)
+
+
+def _decode_inventories(payload):
+    (node_count,) = COUNT.unpack_from(payload, 0)
+    offset = COUNT.size
+    inventories = {}
+    for _ in range(node_count):
+        (inv_id,), offset = _unpack_strings(payload, offset, 1)
+        (count,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        columns = []
+        for _ in ITEM_FIELDS:
+            values, offset = _unpack_strings(payload, offset, count)
+            columns.append(values)
+        inventories[inv_id] = [{"id": item_id, "units": units, "price": price, "location": location}
+                               for item_id, units, price, location in zip(*columns)]
+    return inventories
+
+
+def _encode_ledger(records):
+    records = [signed_record.SignedRecord.from_dict(record) for record in records]
+    flags = bytearray(len(records))
+    columns = {name: [] for name in ("inventory_id", "key_id", "signature", "digest", "extra") + ITEM_FIELDS}
+    for index, record in enumerate(records):
+        flag = 0
+        if record.inventory_id is not None:
+            flag |= HAS_INVENTORY_ID
+        if record.key_id is not None:
+            flag |= HAS_KEY_ID
+        if record.signature is not None:
+            flag |= HAS_SIGNATURE
+        if record.digest is not None:
+            flag |= HAS_DIGEST
+        if record.item is not None:
+            flag |= HAS_ITEM
+        flags[index] = flag
+        columns["inventory_id"].append(record.inventory_id or "")
+        columns["key_id"].append(record.key_id or "")
+        columns["signature"].append(format(record.signature, "x") if record.signature is not None else "")
+        columns["digest"].append(record.digest.hex() if record.digest is not None else "")
+        for field, value in zip(ITEM_FIELDS, record.item or ("", "", "", "")):
+            columns[field].append(value)
+        columns["extra"].append(json.dumps(record.extra, separators=(",", ":")) if record.extra else "")
+    parts = [COUNT.pack(len(records)), LENGTH.pack(len(flags)), bytes(flags)]
+    parts.extend(_pack_strings(values) for values in columns.values())
+    return b"".join(parts)
+
+
+def _decode_ledger(payload):
+    (count,) = COUNT.unpack_from(payload, 0)
+    offset = COUNT.size
+    (flag_length,) = LENGTH.unpack_from(payload, offset)
+    offset += LENGTH.size
+    flags = payload[offset:offset + flag_length]
+    offset += flag_length
+    if len(flags) != count:
+        raise ImageError("ledger flags do not match the record count")
+    columns = []
+    for _ in range(5 + len(ITEM_FIELDS)):
+        values, offset = _unpack_strings(payload, offset, count)
+        columns.append(values)
+    inventory_ids, key_ids, signatures, digests, extras, *item_columns = columns
+    records = []
+    SignedRecord = signed_record.SignedRecord
+    for index, (flag, item) in enumerate(zip(flags, zip(*item_columns))):
+        records.append(SignedRecord(
+            inventory_ids[index] if flag & HAS_INVENTORY_ID else None,
+            key_ids[index] if flag & HAS_KEY_ID else None,
+            int(signatures[index], 16) if flag & HAS_SIGNATURE else None,
+            bytes.fromhex(digests[index]) if flag & HAS_DIGEST else None,
+            item if flag & HAS_ITEM else None,
+            json.loads(extras[index]) if extras[index] else None,
+        ))
+    return records
+
+
+def _encode_keys(contexts):
+    return json.dumps([{"inventory_id": c.inventory_id, "version": c.version, "n": format(c.n, "x"),
+                        "e": format(c.e, "x"), "d": format(c.d, "x"), "p": format(c.p, "x"),
+                        "q": format(c.q, "x"), "phi_n": format(c.phi_n, "x")} for c in contexts]).encode("utf-8")
+
+
+def _decode_keys(payload):
+    return [node_keyring.KeyContext(entry["inventory_id"], entry["version"],
+                                    *(int(entry[name], 16) for name in ("n", "e", "d", "p", "q", "phi_n")))
+            for entry in json.loads(payload)]
+
+
+# --- Image files ---
+
+def write_image(path, state_version, inventories, signed_records, blocks, key_contexts):
+    """
+    Writes an image atomically: to a temporary file (mode 0600, as it holds
+    the private keys), fsynced, then renamed over `path` and the directory
+    fsynced, so a crash mid-write leaves the previous image intact.
+    Returns the image size in bytes.
+    """
+    sections = [
+        (b"INVS", _encode_inventories(inventories)),
+        (b"LEDG", _encode_ledger(signed_records)),
+        (b"BLKS", json.dumps(list(blocks), separators=(",", ":")).encode("utf-8")),
+        (b"KEYS", _encode_keys(key_contexts)),
+    ]
+    digest = hashlib.sha256()
+    temp_path = f"{path}.tmp"
+    # The image holds private keys: owner-only from the start, never world-readable
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o600),
+                   "wb") as f:
+        def emit(data):
+            digest.update(data)
+            f.write(data)
+        emit(HEADER.pack(MAGIC, FORMAT_VERSION, time.time(), state_version or 0, len(sections)))
+        for tag, payload in sections:
+            emit(SECTION.pack(tag, len(payload), zlib.crc32(payload)))
+            emit(payload)
+        f.write(digest.digest())
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(temp_path, path)
+    if hasattr(os, "O_DIRECTORY"):
+        # Make the rename itself durable
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return size
+
+
+def read_image(path):
+    """
+    Reads and verifies an image (whole-file SHA-256, then each section's
+    CRC-32) and decodes it. Raises ImageError if anything does not match.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size + DIGEST_SIZE:
+        raise ImageError("image is truncated")
+    body_size = len(data) - DIGEST_SIZE
+    if hashlib.sha256(memoryview(data)[:body_size]).digest() != data[body_size:]:
+        raise ImageError("image checksum mismatch")
+    magic, format_version, created, state_version, section_count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise ImageError(f"not a version {FORMAT_VERSION} state image")
+    offset = HEADER.size
+    sections = {}
+    for _ in range(section_count):
+        tag, length, crc = SECTION.unpack_from(data, offset)
+        offset += SECTION.size
+        payload = data[offset:offset + length]
+        if offset + length > body_size or zlib.crc32(payload) != crc:
+            raise ImageError(f"section {tag.decode('ascii', 'replace')} is corrupt")
+        sections[tag] = payload
+        offset += length
+    missing = {b"INVS", b"LEDG", b"BLKS", b"KEYS"} - set(sections)
+    if missing:
+        raise ImageError(f"image lacks sections {sorted(tag.decode() for tag in missing)}")
+    return StateImage(
+        state_version, created,
+        _decode_inventories(sections[b"INVS"]),
+        _decode_ledger(sections[b"LEDG"]),
+        json.loads(sections[b"BLKS"]),
+        _decode_keys(sections[b"KEYS"]),
+    )
+
+
+def restore(path, store, keyring):
+    """
+    Loads the image at `path` into `store` (InventoryStore.restore_image) and
+    `keyring`, replacing the store's contents. Returns the StateImage; raises
+    ImageError or OSError, leaving both untouched, if it cannot be read.
+    """
+    image = read_image(path)
+    for context in image.key_contexts:
+        keyring.add(context)
+    store.restore_image(image.inventories, image.signed_records, image.blocks, image.stored_keys())
+    return image
+
+
+class SnapshotWriter:
+    """
+    Writes images of the live state without pausing writers.
+
+    capture() must return (StateSnapshot, key contexts). A StateSnapshot is
+    immutable, and the keyring only ever grows, so taking the keys right after
+    the snapshot gives a consistent image: everything the ledger needs, at one
+    state version. All encoding and I/O happens on the writer thread (or the
+    caller of write_now()) while requests keep publishing new versions.
+    With `interval` > 0 an image is written every `interval` seconds when the
+    state has changed since the last one.
+    """
+
+    def __init__(self, path, capture, interval=0.0):
+        self.path = path
+        self.capture = capture
+        self.interval = interval
+        self._lock = threading.Lock()  # One image at a time
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_version = None
+        self._stats = {"images": 0, "last_version": None, "last_bytes": None, "last_ms": None,
+                       "last_written": None, "last_error": None}
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write_now(only_if_changed=True)
+            except Exception as e:
+                print(f"Snapshot: writing {self.path} failed: {e}")
+
+    def write_now(self, only_if_changed=False):
+        """Writes an image of the current state. Returns stats(); skips unchanged state if asked."""
+        with self._lock:
+            snapshot, key_contexts = self.capture()
+            if only_if_changed and snapshot.version == self._last_version:
+                return self.stats()
+            started = time.perf_counter()
+            try:
+                size = write_image(self.path, snapshot.version, snapshot.inventories, snapshot.signed_records,
+                                   snapshot.blocks, key_contexts)
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                raise
+            self._last_version = snapshot.version
+            self._stats.update(images=self._stats["images"] + 1, last_version=snapshot.version, last_bytes=size,
+                               last_ms=round((time.perf_counter() - started) * 1000, 1),
+                               last_written=time.time(), last_error=None)
+        return self.stats()
+
+    def stats(self):
+        return dict(self._stats, path=self.path, interval=self.interval)
+
+    def close(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    # Benchmark: recovery time for 1,000,000 inventory rows and a 100,000-record ledger,
+    # re-parsing text files and a JSON ledger vs loading one image, including the store writes
+    import random
+    import shutil
+    import tempfile
+
+    import storage
+
+    rows, ledger_size = 1000000, 100000
+    directory = tempfile.mkdtemp()
+    rng = random.Random(1)
+    inventories = {inv_id: [{"id": f"{i:07d}", "units": str(rng.randrange(100)), "price": str(rng.randrange(500)),
+                             "location": rng.choice("ABCD")} for i in range(rows // 4)]
+                   for inv_id in storage.INVENTORY_IDS}
+    p, q, e = (1210613765735147311106936311866593978079938707, 1247842850282035753615951347964437248190231863,
+               815459040813953176289801)
+    key = node_keyring.KeyContext.from_primes("A", 1, p, q, e)
+    records = []
+    for i in range(ledger_size):
+        item = inventories["A"][i % len(inventories["A"])]
+        message = signed_record.format_message("A", item["id"], item["units"], item["price"], item["location"])
+        # A stand-in signature: the benchmark measures parsing, not RSA
+        records.append(signed_record.SignedRecord.create("A", key.key_id, int.from_bytes(
+            hashlib.sha256(message.encode()).digest(), "big") % key.n, item))
+
+    for inv_id, items in inventories.items():
+        storage.write_inventory_file(os.path.join(directory, f"inventory_{inv_id}.txt"), items)
+    ledger_path = os.path.join(directory, "ledger.jsonl")
+    with open(ledger_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record.to_dict()) + "\n")
+
+    image_path = os.path.join(directory, "state.snap")
+    start = time.perf_counter()
+    size = write_image(image_path, 1, inventories, records, [], [key])
+    print(f"{rows:,} rows + {ledger_size:,} ledger records: image {size / 1e6:.1f} MB written in "
+          f"{time.perf_counter() - start:.2f} s")
+
+    # End to end through each store backend, into a fresh data directory each time:
+    # the text path parses the files and the JSON ledger, derives the key and loads the store;
+    # the image path is restore(), which app.restore_snapshot() runs at startup
+    for backend in ("file", "sqlite"):
+        text_dir, image_dir = os.path.join(directory, f"{backend}-text"), os.path.join(directory, f"{backend}-image")
+        os.makedirs(text_dir)
+        os.makedirs(image_dir)
+        text_store = storage.create_store(backend, text_dir)
+        start = time.perf_counter()
+        parsed = {inv_id: storage.read_inventory_file(os.path.join(directory, f"inventory_{inv_id}.txt"))
+                  for inv_id in storage.INVENTORY_IDS}
+        with open(ledger_path) as f:
+            replayed = signed_record.compact_records([json.loads(line) for line in f])
+        node_keyring.Keyring().add(node_keyring.KeyContext.from_primes("A", 1, p, q, e))
+        text_store.restore_image(parsed, replayed, [], {})
+        text_s = time.perf_counter() - start
+
+        image_store = storage.create_store(backend, image_dir)
+        start = time.perf_counter()
+        image = restore(image_path, image_store, node_keyring.Keyring())
+        image_s = time.perf_counter() - start
+        assert image_store.load_inventories() == text_store.load_inventories() == \
+            {inv_id: tuple(items) for inv_id, items in parsed.items()}
+        assert signed_record.compact_records(image_store.load_signed_records()) == replayed
+        print(f"Recovery into the '{backend}' store: text files + JSON ledger {text_s:.2f} s, "
+              f"image {image_s:.2f} s ({text_s / image_s:.1f}x faster)")
+        text_store.close()
+        image_store.close()
+    shutil.rmtree(directory)
@@ -5,7 +5,11 @@ import os
 import sys
 import csv
 import json
-from flask import Flask, request, jsonify, render_template
+import hmac
+import tempfile
+import threading
+import time
+from flask import Flask, Response, request, jsonify, render_template, make_response, abort
 # If you need CORS later (e.g., for a separate frontend project):
 # from flask_cors import CORS # Then run: pip install Flask-CORS
 
@@ -74,6 +78,27 @@ try:
         import consensus_protocol
         import harn_multisig
         import pkg_keys
+        import storage
+        import versioned_state
+        import response_cache
+        import wire_format
+        import inventory_query
+        import quorum_read
+        import block_ledger
+        import node_keyring
+        import sign_jobs
+        import query_cache
+        import officer_crypto
+        import change_feed
+        import change_log
+        import sharding
+        import replication
+        import keygen
+        import signed_record
+        import tracing
+        import threshold_harn
+        import consensus_policy
+        import snapshot_image
         print("Successfully imported modules from project root.")
     except ImportError:
         # Try relative import from current directory
@@ -82,6 +107,27 @@ try:
         from . import consensus_protocol
         from . import harn_multisig
         from . import pkg_keys
+        from . import storage
+        from . import versioned_state
+        from . import response_cache
+        from . import wire_format
+        from . import inventory_query
+        from . import quorum_read
+        from . import block_ledger
+        from . import node_keyring
+        from . import sign_jobs
+        from . import query_cache
+        from . import officer_crypto
+        from . import change_feed
+        from . import change_log
+        from . import sharding
+        from . import replication
+        from . import keygen
+        from . import signed_record
+        from . import tracing
+        from . import threshold_harn
+        from . import consensus_policy
+        from . import snapshot_image
         print("Successfully imported modules with relative imports.")
 except ImportError as e:
     # Last resort: look for modules in the same directory as this file
@@ -92,6 +138,27 @@ except ImportError as e:
         import consensus_protocol
         import harn_multisig
         import pkg_keys
+        import storage
+        import versioned_state
+        import response_cache
+        import wire_format
+        import inventory_query
+        import quorum_read
+        import block_ledger
+        import node_keyring
+        import sign_jobs
+        import query_cache
+        import officer_crypto
+        import change_feed
+        import change_log
+        import sharding
+        import replication
+        import keygen
+        import signed_record
+        import tracing
+        import threshold_harn
+        import consensus_policy
+        import snapshot_image
         print(f"Successfully imported modules from script directory.")
     except ModuleNotFoundError as e:
         print(f"ERROR: Could not find a module: {e}")
@@ -101,6 +168,13 @@ except Exception as e:
     print(f"ERROR: An error occurred importing modules: {e}")
     sys.exit(1)
 
+# Optional modules: the app still runs without them, minus the features they provide
+try:
+    import inventory_analytics
+except ImportError as e:
+    print(f"WARNING: Inventory analytics disabled ({e}). Install numpy to enable /api/analytics.")
+    inventory_analytics = None
+
 # Create Flask app with the template directory
 app = Flask(__name__, template_folder=template_dir)
 # If you need CORS:
@@ -130,13 +204,70 @@ INVENTORY_PARAMS = {
     }
 }
 
-GENERATED_KEYS = {} # Stores generated keys for each inventory
-SIGNED_RECORDS_DB = [] # Simple in-memory "database" for signed records
-INVENTORY_DATA = {} # Will store inventory data loaded from files
+KEYRING = node_keyring.Keyring() # Every key version of every inventory, by key id
+GENERATED_KEYS = {} # Active key of each inventory (view of KEYRING)
+KEY_DISPLAY_STRINGS = {} # Decimal-string renderings of GENERATED_KEYS, rebuilt only when a key changes
+
+# Storage backend: "file" (default, single process) or "sqlite" (shared by several workers)
+# INVENTORY_SHARDS > 1 partitions items by hash of item id across that many stores of the chosen backend
+INVENTORY_SHARDS = int(os.environ.get("INVENTORY_SHARDS", "1"))
+if INVENTORY_SHARDS > 1:
+    STORE = sharding.ShardedStore(os.environ.get("INVENTORY_SHARDS_DIR", os.path.join(database_dir, "shards")),
+                                  INVENTORY_SHARDS, os.environ.get("INVENTORY_STORE", "file"))
+else:
+    STORE = storage.create_store(os.environ.get("INVENTORY_STORE", "file"), database_dir)
+
+# Copy-on-write snapshots of the inventories and signed-record ledger held by STORE.
+# Handlers grab STATE.current() once and read only from that snapshot.
+STATE = versioned_state.VersionedState()
+
+# NumPy column mirror of the inventories, kept current by STATE's change notifications
+ANALYTICS = inventory_analytics.InventoryColumns() if inventory_analytics else None
+if ANALYTICS is not None:
+    STATE.add_listener(ANALYTICS.apply_changes)
+# Finished /api/query_item results, keyed by item id and that item's change counter
+ITEM_VERSIONS = query_cache.ItemVersions()
+STATE.add_listener(ITEM_VERSIONS.apply_changes)
+QUERY_CACHE = query_cache.SingleFlightCache(ttl=float(os.environ.get("QUERY_CACHE_TTL", "30")))
+
+# Serialized bodies of the polling endpoints, re-rendered only when STATE's version changes
+RESPONSE_CACHE = response_cache.VersionedResponseCache(STORE.instance_id())
+
+# Request traces: spans around consensus, signing, propagation and the Harn query steps. Slow or failed
+# traces (and a TRACE_SAMPLE_RATE share of the rest) are appended to TRACE_FILE, rotated at TRACE_FILE_MAX_BYTES
+if os.environ.get("TRACING", "1").lower() in ("0", "false", "no", "off"):
+    TRACER = tracing.DisabledTracer()
+else:
+    TRACER = tracing.Tracer(
+        tracing.TraceFileWriter(os.environ.get("TRACE_FILE", os.path.join(database_dir, "traces.jsonl")),
+                                max_bytes=int(os.environ.get("TRACE_FILE_MAX_BYTES", str(10 * 1024 * 1024))),
+                                backups=int(os.environ.get("TRACE_FILE_BACKUPS", "3"))),
+        slow_ms=float(os.environ.get("TRACE_SLOW_MS", "500")),
+        sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+    )
+
+# Node voting rules for consensus: a JSON policy file named by CONSENSUS_POLICY, compiled once at startup.
+# Without one, every node accepts quantities under 50 and 3 of 4 must accept (the original rule).
+try:
+    if os.environ.get("CONSENSUS_POLICY"):
+        CONSENSUS_POLICY = consensus_policy.ConsensusPolicy.from_file(os.environ["CONSENSUS_POLICY"])
+        print(f"Loaded consensus policy from {os.environ['CONSENSUS_POLICY']}")
+    else:
+        CONSENSUS_POLICY = consensus_policy.ConsensusPolicy(consensus_policy.DEFAULT_POLICY)
+except (OSError, ValueError) as e:
+    print(f"ERROR: Could not load consensus policy: {e}")
+    sys.exit(1)
+MAX_CONSENSUS_BATCH = int(os.environ.get("MAX_CONSENSUS_BATCH", "100000"))
+
+def consensus_inventories(snapshot):
+    """The snapshot's inventories in consensus_protocol format, converted once per version."""
+    return snapshot.derived("consensus_inventories",
+                            lambda snap: consensus_protocol.get_inventories_from_data(snap.inventories))
 
 def load_inventory_data():
     """Loads inventory data from text files in the database directory."""
     inventory_ids = ["A", "B", "C", "D"]
+    inventories = {}
     
     for inv_id in inventory_ids:
         file_path = os.path.join(database_dir, f"inventory_{inv_id}.txt")
@@ -144,58 +275,81 @@ def load_inventory_data():
             print(f"Warning: Inventory file not found: {file_path}")
             continue
             
-        inventory_items = []
         try:
-            with open(file_path, 'r') as file:
-                for line in file:
-                    line = line.strip()
-                    if line:  # Skip empty lines
-                        parts = line.split(',')
-                        if len(parts) >= 4:
-                            item_id, units, price, location = parts[0], parts[1], parts[2], parts[3]
-                            inventory_items.append({
-                                "id": item_id,
-                                "units": units,
-                                "price": price,
-                                "location": location
-                            })
-            
-            INVENTORY_DATA[inv_id] = inventory_items
+            inventory_items = storage.read_inventory_file(file_path)
+            inventories[inv_id] = inventory_items
             print(f"Successfully loaded {len(inventory_items)} items for Inventory {inv_id}")
         except Exception as e:
             print(f"Error loading inventory data for {inv_id}: {e}")
-            INVENTORY_DATA[inv_id] = []
+            inventories[inv_id] = []
+    return inventories
+
+def sync_from_store(force=False):
+    """
+    Publishes a new STATE snapshot if STORE has changed since the current one.
+    With a shared backend another worker may have written since our last look,
+    so the store version is compared first and the reload skipped if unchanged.
+    Returns the current snapshot.
+    """
+    store_version = STORE.version()
+    snapshot = STATE.current()
+    if not force and store_version == snapshot.version:
+        return snapshot
+    load_rotated_keys()
+    # Ledger entries are held as compact SignedRecords; unchanged ones are carried over from the last snapshot
+    records = signed_record.compact_records(STORE.load_signed_records(), snapshot.signed_records)
+    return STATE.publish(store_version, STORE.load_inventories(), records, STORE.load_blocks())
+
+def known_key(inventory_id, version, p, q, e):
+    """True if KEYRING already holds this key (e.g. restored from a snapshot), so it need not be derived."""
+    return KEYRING.get(node_keyring.make_key_id(inventory_id, version, p * q, e)) is not None
+
+def load_rotated_keys():
+    """Adds key versions persisted in STORE (e.g. rotated by another worker) to KEYRING."""
+    added = False
+    for key_record in STORE.load_keys():
+        try:
+            if known_key(key_record["inventory_id"], key_record["version"],
+                         int(key_record["p"]), int(key_record["q"]), int(key_record["e"])):
+                continue
+            added = KEYRING.add(node_keyring.KeyContext.from_record(key_record)) or added
+        except (ValueError, KeyError) as e:
+            print(f"Error loading stored key {key_record.get('inventory_id')} v{key_record.get('version')}: {e}")
+    if added:
+        refresh_key_views()
+
+def refresh_key_views():
+    """Rebuilds GENERATED_KEYS and KEY_DISPLAY_STRINGS from the active keys in KEYRING."""
+    for inv_id in INVENTORY_PARAMS.keys():
+        context = KEYRING.active(inv_id)
+        if context is None:
+            continue
+        GENERATED_KEYS[inv_id] = context.as_key_data()
+        # Converting these large integers to decimal is costly, so do it once per key
+        KEY_DISPLAY_STRINGS[inv_id] = {
+            "p": str(context.p),
+            "q": str(context.q),
+            "e": str(context.e),
+            "n": str(context.n),
+            "phi_n": str(context.phi_n),
+            "d": str(context.d),
+            "key_id": context.key_id,
+            "error": None
+        }
 
 def propagate_transaction(new_item, source_inventory_id):
     """Propagates a new transaction to all inventories."""
-    # Add the new item to all inventory files
+    # Add (or update) the new item in every inventory through the store
     for inv_id in ["A", "B", "C", "D"]:
-        # Only add if it doesn't already exist
-        item_exists = False
-        inventory_items = INVENTORY_DATA.get(inv_id, [])
-        
-        for item in inventory_items:
-            if item["id"] == new_item["id"]:
-                # Update the existing item
-                item["units"] = new_item["units"]
-                item["price"] = new_item["price"]
-                item["location"] = new_item["location"]
-                item_exists = True
-                break
-        
-        if not item_exists:
-            inventory_items.append(new_item)
-            INVENTORY_DATA[inv_id] = inventory_items
-        
-        # Save the updated inventory back to file
-        file_path = os.path.join(database_dir, f"inventory_{inv_id}.txt")
-        try:
-            with open(file_path, 'w') as file:
-                for item in inventory_items:
-                    file.write(f"{item['id']},{item['units']},{item['price']},{item['location']}\n")
-            print(f"Updated inventory file for {inv_id}")
-        except Exception as e:
-            print(f"Error updating inventory file for {inv_id}: {e}")
+        with tracing.span("store.upsert_item", inventory=inv_id) as write_span:
+            try:
+                STORE.upsert_item(inv_id, new_item)
+                print(f"Updated inventory file for {inv_id}")
+            except Exception as e:
+                write_span.mark_error(str(e))
+                print(f"Error updating inventory file for {inv_id}: {e}")
+    with tracing.span("sync_from_store"):
+        sync_from_store()
 
 def initialize_keys():
     """Generates and stores RSA keys for all inventories."""
@@ -208,17 +362,11 @@ def initialize_keys():
 
     for inv_id, params in INVENTORY_PARAMS.items():
         try:
-            public_key, private_key_d, p, q, phi_n = rsa_utils.generate_keys_from_pqe(
-                params["p"], params["q"], params["e"]
-            )
-            GENERATED_KEYS[inv_id] = {
-                "public_key_n": public_key[0], # n
-                "public_key_e": public_key[1], # e
-                "private_key_d": private_key_d, # d
-                "p_val": p,
-                "q_val": q,
-                "phi_n_val": phi_n,
-            }
+            # The hard-coded parameters are key version 1 of every inventory
+            if known_key(inv_id, 1, params["p"], params["q"], params["e"]):
+                print(f"Keys for Inventory {inv_id} restored from snapshot.")
+                continue
+            KEYRING.add(node_keyring.KeyContext.from_primes(inv_id, 1, params["p"], params["q"], params["e"]))
             print(f"Successfully generated keys for Inventory {inv_id}.")
         except ValueError as e:
             print(f"Error generating keys for Inventory {inv_id}: {e}")
@@ -226,13 +374,47 @@ def initialize_keys():
         except Exception as e:
             print(f"An unexpected error occurred generating keys for Inventory {inv_id}: {e}")
             GENERATED_KEYS[inv_id] = {"error": f"Unexpected error: {str(e)}"}
+        if inv_id in GENERATED_KEYS:
+            KEY_DISPLAY_STRINGS[inv_id] = {
+                "p": "N/A", "q": "N/A", "e": "N/A", "n": "N/A", "phi_n": "N/A", "d": "N/A",
+                "error": GENERATED_KEYS[inv_id]["error"]
+            }
+    # Rotated versions persisted in the store take over from version 1
+    load_rotated_keys()
+    refresh_key_views()
     print("Key initialization complete.")
 
+# Pre-generated key parameters, refilled in the background, so rotations need no prime search.
+# The pool starts with the first rotation; setting KEY_POOL_SIZE starts it (and its processes) at startup.
+KEY_POOL = keygen.KeyPool(
+    size=int(os.environ.get("KEY_POOL_SIZE", "2")),
+    modulus_bits=int(os.environ.get("KEYGEN_BITS", "512")),
+    workers=int(os.environ.get("KEYGEN_WORKERS", "0")) or None
+)
+if os.environ.get("KEY_POOL_SIZE"):
+    KEY_POOL.start()
+
+def rotate_key(inventory_id, p, q, e):
+    """
+    Adds a new key version for an inventory and makes it active. Records signed
+    with older versions keep verifying through their key id.
+    The version is allocated under the store's exclusive lock, after picking up
+    versions other workers added, so concurrent rotations never share one.
+    """
+    with STORE.exclusive_lock():
+        load_rotated_keys()
+        context = node_keyring.KeyContext.from_primes(inventory_id, KEYRING.next_version(inventory_id), p, q, e)
+        STORE.add_key(context.key_id, context.to_record())
+        KEYRING.add(context)
+    refresh_key_views()
+    sync_from_store()
+    return context
+
 # Clean up inventory data - remove the 004,12,18,A record on startup so it can be added once
-def cleanup_inventory_data():
+def cleanup_inventory_data(inventories):
     """Removes any records except the core ones from all inventories."""
     for inv_id in ["A", "B", "C", "D"]:
-        inventory_items = INVENTORY_DATA.get(inv_id, [])
+        inventory_items = inventories.get(inv_id, [])
         # Filter to keep only records that don't have location A with id 004 
         filtered_items = []
         for item in inventory_items:
@@ -247,29 +429,68 @@ def cleanup_inventory_data():
         if len(inventory_items) != len(filtered_items):
             print(f"Removed {len(inventory_items) - len(filtered_items)} items from Inventory {inv_id}")
         
-        INVENTORY_DATA[inv_id] = filtered_items
+        inventories[inv_id] = filtered_items
         
-        # Save the cleaned inventory back to file
-        file_path = os.path.join(database_dir, f"inventory_{inv_id}.txt")
+        # Save the cleaned inventory back to the store
         try:
-            with open(file_path, 'w') as file:
-                for item in filtered_items:
-                    file.write(f"{item['id']},{item['units']},{item['price']},{item['location']}\n")
+            STORE.replace_inventory(inv_id, filtered_items)
             print(f"Cleaned up inventory file for {inv_id}")
         except Exception as e:
             print(f"Error updating inventory file for {inv_id}: {e}")
 
+# Point-in-time images of the inventories, ledger, blocks and key material, for crash recovery.
+# SNAPSHOT_INTERVAL > 0 writes one to SNAPSHOT_PATH every that many seconds when the state has changed;
+# with SNAPSHOT_RESTORE=1 startup loads the image instead of re-seeding from the text files. That happens
+# only when this process seeds the store: always for files; for SQLite, on a fresh database or the first
+# worker of a new INVENTORY_RUN_ID (otherwise the database already holds the state and is used as it is).
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", os.path.join(database_dir, "state.snap"))
+SNAPSHOT_RESTORE = os.environ.get("SNAPSHOT_RESTORE", "0").lower() in ("1", "true", "yes", "on")
+
+def restore_snapshot(path):
+    """
+    Loads a snapshot image into STORE and KEYRING. Returns the image, or None
+    (after a warning) if there is none or it fails verification.
+    """
+    if not os.path.exists(path):
+        print(f"No snapshot at {path}; seeding from the text files.")
+        return None
+    started = time.perf_counter()
+    try:
+        image = snapshot_image.restore(path, STORE, KEYRING)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Could not restore snapshot {path} ({e}); seeding from the text files.")
+        return None
+    print(f"Restored state version {image.state_version} ({sum(map(len, image.inventories.values()))} items, "
+          f"{len(image.signed_records)} signed records) from {path} "
+          f"in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    return image
+
 # Load inventory data and initialize keys
-print("Loading inventory data...")
-load_inventory_data()
+print(f"Using '{STORE.backend_name}' storage backend.")
+restored_image = None
+if STORE.claim_initialization():
+    if SNAPSHOT_RESTORE:
+        restored_image = restore_snapshot(SNAPSHOT_PATH)
+    if restored_image is None:
+        print("Loading inventory data...")
+        seed_inventories = load_inventory_data()
+
+        # Clean up inventory data
+        print("Cleaning up inventory data...")
+        cleanup_inventory_data(seed_inventories)
 
-# Clean up inventory data
-print("Cleaning up inventory data...")
-cleanup_inventory_data()
+        # Clear any existing signed records
+        STORE.clear_signed_records()
+else:
+    if SNAPSHOT_RESTORE:
+        print(f"SNAPSHOT_RESTORE ignored: the '{STORE.backend_name}' store keeps its state from an earlier seed.")
+    print("Store already initialized by another worker of this run (or, without INVENTORY_RUN_ID, "
+          "by an earlier run); attaching to its data and ledger.")
+startup_snapshot = sync_from_store(force=True)
 
-# Double check that our target record is indeed removed
-for inv_id in ["A", "B", "C", "D"]:
-    inventory_items = INVENTORY_DATA.get(inv_id, [])
+# Double check that our target record is indeed removed (a restored snapshot keeps it if it was signed)
+for inv_id in ["A", "B", "C", "D"] if restored_image is None else ():
+    inventory_items = startup_snapshot.inventories.get(inv_id, ())
     for item in inventory_items:
         if item["location"] == "A" and item["id"] == "004":
             print(f"WARNING: Record 004,12,18,A still exists in Inventory {inv_id} after cleanup!")
@@ -277,38 +498,140 @@ for inv_id in ["A", "B", "C", "D"]:
 # Initialize keys
 initialize_keys()
 
-# Clear any existing signed records
-SIGNED_RECORDS_DB = []
+# Snapshots capture the immutable STATE snapshot and then the keys; writers are never paused
+SNAPSHOTS = snapshot_image.SnapshotWriter(
+    SNAPSHOT_PATH,
+    lambda: (STATE.current(), KEYRING.contexts()),
+    interval=float(os.environ.get("SNAPSHOT_INTERVAL", "0"))
+).start()
 
 # Calculate and store PKG and procurement officer parameters
 try:
     CRYPTO_PARAMS = pkg_keys.calculate_params()
+    # The procurement officer's private key stays server-side, prepared for CRT decryption
+    OFFICER_KEY = officer_crypto.CRTKeyContext.from_params(pkg_keys.PROCUREMENT_PARAMS)
     print("Successfully calculated cryptographic parameters.")
 except Exception as e:
     print(f"ERROR: Failed to calculate cryptographic parameters: {e}")
     sys.exit(1)
 
+# Threshold Harn multisignature for /api/query_item: every inventory has a signer holding a PKG-issued key,
+# and a query is signed by the first HARN_THRESHOLD signers to answer (both rounds requested concurrently).
+# HARN_SIGNER_DELAYS (e.g. "D:2.5") simulates slow nodes.
+HARN_SIGNERS = threshold_harn.ThresholdHarn(
+    threshold_harn.create_signers(pkg_keys.IDENTITIES, CRYPTO_PARAMS["pkg"]["d"], CRYPTO_PARAMS["pkg"]["e"],
+                                  CRYPTO_PARAMS["pkg"]["n"],
+                                  threshold_harn.parse_delays(os.environ.get("HARN_SIGNER_DELAYS"))),
+    threshold=int(os.environ.get("HARN_THRESHOLD", "3")),
+    e=CRYPTO_PARAMS["pkg"]["e"],
+    n=CRYPTO_PARAMS["pkg"]["n"],
+    timeout=float(os.environ.get("HARN_SIGNER_TIMEOUT", "2"))
+)
+
+# --- Block ledger: signed records are sealed into hash-chained blocks signed by the PKG ---
+BLOCK_SIGNER = "PKG"
+
+def sign_block_header(header):
+    """Signs a block header with the PKG's private key. Returns (signature, header hash hex)."""
+    return rsa_utils.sign_message(header, CRYPTO_PARAMS["pkg"]["d"], CRYPTO_PARAMS["pkg"]["n"])
+
+def verify_block_header(header, signature):
+    """Checks a block signature with the PKG's public key."""
+    is_valid, _, _ = rsa_utils.verify_signature(header, signature, CRYPTO_PARAMS["pkg"]["e"], CRYPTO_PARAMS["pkg"]["n"])
+    return is_valid
+
+def seal_pending_records(force=False):
+    """
+    Seals pending signed records into blocks of at most BLOCK_SEALER.max_records,
+    when the size/age rule says so or when `force` is set. Returns the new blocks.
+    """
+    sealed_blocks = []
+    while True:
+        snapshot = sync_from_store()
+        first, end = block_ledger.pending_range(snapshot.blocks, snapshot.signed_records)
+        if end == first or not (force or BLOCK_SEALER.due(end - first)):
+            return sealed_blocks
+        records = snapshot.signed_records[first:min(end, first + BLOCK_SEALER.max_records)]
+        prev_hash = snapshot.blocks[-1]["hash"] if snapshot.blocks else block_ledger.GENESIS_HASH
+        block = block_ledger.build_block(len(snapshot.blocks), prev_hash, records, first, BLOCK_SIGNER, sign_block_header)
+        if STORE.append_block(block):
+            print(f"Sealed block {block['index']} with {len(records)} records (merkle root {block['merkle_root'][:16]}...)")
+            sealed_blocks.append(block)
+        BLOCK_SEALER.sealed()
+
+BLOCK_SEALER = block_ledger.BlockSealer(
+    lambda: seal_pending_records(),
+    max_records=int(os.environ.get("LEDGER_BLOCK_SIZE", "10")),
+    max_age=float(os.environ.get("LEDGER_BLOCK_AGE", "30"))
+)
+BLOCK_SEALER.start()
+
+@app.before_request
+def refresh_state():
+    """Picks up writes made by other workers before handling each request."""
+    sync_from_store()
+
+def cached_json_response(name, render, snapshot=None):
+    """
+    Serves the JSON rendering of the current snapshot (or of `snapshot`) for
+    `name` with an ETag. A client that already holds this version gets an
+    empty 304; otherwise the body comes from RESPONSE_CACHE and is only
+    re-serialized after a mutation.
+    `render` takes the snapshot and returns a JSON-serializable object.
+    """
+    if snapshot is None:
+        snapshot = STATE.current()
+    etag = RESPONSE_CACHE.etag(name, snapshot.version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    body, etag = RESPONSE_CACHE.get(name, snapshot.version, lambda: app.json.dumps(render(snapshot)))
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    if snapshot.version is not None:
+        # The /events ids are state versions too, so the page can tell whether this body is older than
+        # live changes it already applied
+        response.headers["X-State-Version"] = str(snapshot.version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def read_crypto_request():
+    """
+    Decodes the body of a crypto endpoint request.
+    Returns (data, media_type); big integer fields are read with wire_format.parse_int.
+    A body that cannot be decoded is answered with 400 straight away.
+    """
+    media_type = wire_format.request_media_type(request.content_type)
+    try:
+        data = wire_format.decode(request.get_data(), media_type)
+    except ValueError as e:
+        abort(make_response(jsonify({"error": f"Could not decode the {media_type} request body: {e}"}), 400))
+    return (data if isinstance(data, dict) else {}), media_type
+
+def crypto_response(payload, status=200):
+    """
+    Serializes a crypto endpoint payload in the encoding the client asked for
+    (JSON with decimal strings by default, base64url JSON or CBOR on request).
+    """
+    media_type = wire_format.negotiate(request.accept_mimetypes)
+    response = Response(wire_format.encode(payload, media_type), status=status, mimetype=media_type)
+    response.vary.add("Accept")
+    return response
+
 @app.route('/')
 def index():
     """Serves the main HTML page."""
+    snapshot = STATE.current()
     inventory_info_for_template = {}
     for inv_id, params in INVENTORY_PARAMS.items():
         # Prepare data for the template, even if key generation failed for some
-        key_data = GENERATED_KEYS.get(inv_id, {})
+        key_strings = KEY_DISPLAY_STRINGS.get(inv_id, {})
         
         # Get item details from loaded inventory data
-        inventory_items = INVENTORY_DATA.get(inv_id, [])
+        inventory_items = snapshot.inventories.get(inv_id, ())
         
-        inventory_info_for_template[inv_id] = {
-            "p": str(key_data.get("p_val", "N/A")),
-            "q": str(key_data.get("q_val", "N/A")),
-            "e": str(key_data.get("public_key_e", "N/A")),
-            "n": str(key_data.get("public_key_n", "N/A")),
-            "phi_n": str(key_data.get("phi_n_val", "N/A")),
-            "d": str(key_data.get("private_key_d", "N/A")),
-            "items": inventory_items,
-            "error": key_data.get("error")
-        }
+        inventory_info_for_template[inv_id] = dict(key_strings, items=inventory_items)
 
     # Check if index.html exists at the expected path
     index_html_path = os.path.join(template_dir, 'index.html')
@@ -320,10 +643,11 @@ def index():
                            inventories_data=inventory_info_for_template, 
                            inventory_ids_list=list(INVENTORY_PARAMS.keys()))
 
-@app.route('/sign_record', methods=['POST'])
-def sign_record_route():
-    """API endpoint to sign an inventory record."""
-    data = request.json
+def validate_sign_request(data):
+    """
+    Cheap admission checks for a sign request, done before any queueing.
+    Returns (fields, None) or (None, (error_dict, status)).
+    """
     inventory_id = data.get('inventory_id')
     units = data.get('units')
     item_id_val = data.get('item_id')
@@ -332,10 +656,42 @@ def sign_record_route():
 
     # Only allow the specific record 004,12,18,A
     if item_id_val != "004" or units != "12" or price != "18" or location != "A":
-        return jsonify({"error": "Only the record 004,12,18,A is allowed to be added"}), 400
+        return None, ({"error": "Only the record 004,12,18,A is allowed to be added"}, 400)
 
     if not all([inventory_id, units is not None, item_id_val is not None, price is not None]):
-        return jsonify({"error": "Missing data: inventory_id, units, item_id, or price"}), 400
+        return None, ({"error": "Missing data: inventory_id, units, item_id, or price"}, 400)
+
+    return {"inventory_id": inventory_id, "units": units, "item_id": item_id_val,
+            "price": price, "location": location}, None
+
+# Serializes the check-consensus-sign-write sequence so two submissions cannot both pass the duplicate check.
+# The store supplies the lock: with SQLite it is also held across worker processes sharing the database.
+SIGN_LOCK = STORE.exclusive_lock()
+
+def sign_record(fields):
+    """
+    Runs the duplicate check, consensus, signing and propagation for a validated
+    sign request. Returns (payload, status); payload is an {"error": ...} dict on failure.
+    """
+    with TRACER.trace("sign_record", inventory_id=fields["inventory_id"], item_id=fields["item_id"],
+                      location=fields["location"]) as trace_span:
+        with tracing.span("sign_lock.wait"):
+            SIGN_LOCK.acquire()
+        try:
+            payload, status = _sign_record_locked(fields)
+        finally:
+            SIGN_LOCK.release()
+        trace_span.set(status=status)
+        if status >= 500:
+            trace_span.mark_error(payload.get("error"))
+        return payload, status
+
+def _sign_record_locked(fields):
+    inventory_id = fields["inventory_id"]
+    units = fields["units"]
+    item_id_val = fields["item_id"]
+    price = fields["price"]
+    location = fields["location"]
 
     # Create proposed record for consensus protocol
     proposed_record = {
@@ -349,39 +705,40 @@ def sign_record_route():
     print(f"Attempting to add record: {proposed_record}")
     
     # Check if the record exists in inventories directly, not using consensus check
-    record_exists = False
-    for inv_id, items in INVENTORY_DATA.items():
-        for item in items:
-            if item["id"] == item_id_val and item["location"] == location:
-                record_exists = True
-                print(f"Record exists in inventory {inv_id}: {item}")
-                break
-        if record_exists:
-            break
-    
-    if record_exists:
-        return jsonify({"error": "This record already exists in the inventories."}), 400
+    # (a lookup in STORE rather than a scan of the snapshot)
+    with tracing.span("duplicate_check") as check_span:
+        snapshot = sync_from_store()
+        existing = STORE.find_row(item_id_val, location)
+        check_span.set(found=existing is not None)
+    if existing is not None:
+        print(f"Record exists in inventory {existing[0]}: {existing[1]}")
+        return {"error": "This record already exists in the inventories."}, 400
     
     # Get inventories in the format required by consensus protocol
-    inventories = consensus_protocol.get_inventories_from_data(INVENTORY_DATA)
+    inventories = consensus_inventories(snapshot)
     
     # Run consensus protocol to determine if record should be added
-    if not consensus_protocol.consensus_protocol(inventories, proposed_record):
-        return jsonify({"error": "Consensus not reached. Record not approved for addition."}), 400
+    with tracing.span("consensus_protocol") as consensus_span:
+        consensus = consensus_protocol.consensus_protocol(inventories, proposed_record, CONSENSUS_POLICY)
+        consensus_span.set(consensus="REACHED" if consensus else "FAILED")
+    if not consensus:
+        return {"error": "Consensus not reached. Record not approved for addition."}, 400
 
     if inventory_id not in GENERATED_KEYS or "error" in GENERATED_KEYS[inventory_id] or "private_key_d" not in GENERATED_KEYS[inventory_id]:
         app.logger.error(f"Attempt to sign with uninitialized/error keys for {inventory_id}. Keys: {GENERATED_KEYS.get(inventory_id)}")
-        return jsonify({"error": f"Keys not properly initialized or error in keys for inventory {inventory_id}. Cannot sign."}), 400
+        return {"error": f"Keys not properly initialized or error in keys for inventory {inventory_id}. Cannot sign."}, 400
 
     keys = GENERATED_KEYS[inventory_id]
     private_key_d = keys["private_key_d"]
     n = keys["public_key_n"]
-    message_str = f"Inventory {inventory_id} has purchased {units} units of item with ID {item_id_val}, priced at {price}, located at {location}."
+    key_id = keys["key_id"]
+    message_str = signed_record.format_message(inventory_id, item_id_val, units, price, location)
     
     try:
-        signature, hashed_message_hex = rsa_utils.sign_message(message_str, private_key_d, n)
+        with tracing.span("sign_message", key_id=key_id):
+            signature, hashed_message_hex = rsa_utils.sign_message(message_str, private_key_d, n)
         
-        # Add the new item to INVENTORY_DATA and propagate to all inventories
+        # Add the new item to the store and propagate to all inventories
         new_item = {
             "id": item_id_val,
             "units": units,
@@ -390,50 +747,122 @@ def sign_record_route():
         }
         
         # Propagate the transaction to all inventories
-        propagate_transaction(new_item, inventory_id)
+        with tracing.span("propagate_transaction"):
+            propagate_transaction(new_item, inventory_id)
         
         # Record the signed transaction
-        SIGNED_RECORDS_DB.append({
-            "inventory_id": inventory_id, 
-            "message": message_str,
-            "signature": str(signature), 
-            "hash": hashed_message_hex,
-            "item": new_item
-        })
+        with tracing.span("append_signed_record"):
+            STORE.append_signed_record(signed_record.SignedRecord.create(inventory_id, key_id, signature, new_item))
+            sync_from_store()
+        with tracing.span("seal_pending_records"):
+            seal_pending_records()
         
-        return jsonify({
+        return {
             "message": message_str, 
             "hash_hex": hashed_message_hex,
-            "signature": str(signature), 
+            "signature": wire_format.BigInt(signature), 
             "signer_inventory_id": inventory_id,
-            "public_n": str(n), 
-            "public_e": str(keys["public_key_e"]),
+            "key_id": key_id,
+            "public_n": wire_format.BigInt(n), 
+            "public_e": wire_format.BigInt(keys["public_key_e"]),
             "consensus": "REACHED"
-        })
+        }, 200
     except Exception as e:
         app.logger.error(f"Signing failed for {inventory_id}: {str(e)}")
-        return jsonify({"error": f"Signing failed: {str(e)}"}), 500
+        return {"error": f"Signing failed: {str(e)}"}, 500
+
+SIGN_JOBS = sign_jobs.SignJobQueue(
+    sign_record,
+    max_pending=int(os.environ.get("SIGN_QUEUE_SIZE", "32")),
+    workers=int(os.environ.get("SIGN_QUEUE_WORKERS", "1")),
+    # Worker processes sharing a store also share jobs, so a poll can land on any of them
+    job_store=STORE if STORE.shared else None
+)
+
+def wants_async():
+    """A client opts into asynchronous signing with ?async=1 or a 'Prefer: respond-async' header."""
+    return (request.args.get('async', '').lower() in ('1', 'true', 'yes')
+            or 'respond-async' in request.headers.get('Prefer', ''))
+
+def sign_result_response(payload, status):
+    """Renders a sign_record() result: negotiated crypto encoding on success, plain JSON errors."""
+    if status >= 400:
+        return jsonify(payload), status
+    return crypto_response(payload, status)
+
+@app.route('/sign_record', methods=['POST'])
+def sign_record_route():
+    """
+    API endpoint to sign an inventory record. Synchronous by default; in async
+    mode the request is queued and answered with 202 and a job id to poll.
+    """
+    data, _ = read_crypto_request()
+    fields, error = validate_sign_request(data)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    if not wants_async():
+        with TRACER.trace("POST /sign_record") as trace_span:
+            response = make_response(sign_result_response(*sign_record(fields)))
+        if trace_span.trace_id:
+            response.headers["X-Trace-Id"] = trace_span.trace_id
+        return response
+
+    try:
+        job = SIGN_JOBS.submit(fields)
+    except sign_jobs.QueueFull as e:
+        response = jsonify({"error": "Sign queue is full. Try again later.", "retry_after": e.retry_after})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    response = jsonify(job)
+    response.status_code = 202
+    response.headers["Location"] = f"/sign_jobs/{job['job_id']}"
+    return response
+
+@app.route('/sign_jobs/<job_id>', methods=['GET'])
+def sign_job_status_route(job_id):
+    """
+    API endpoint to poll an asynchronous sign job. While queued or running it
+    returns the job status; once finished the sign result is embedded under "result".
+    """
+    job = SIGN_JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown or expired job {job_id}"}), 404
+    if job["status"] in ("queued", "running"):
+        response = jsonify(job)
+        response.headers["Retry-After"] = str(SIGN_JOBS.retry_after())
+        return response
+    if job["result_status"] >= 400:
+        return jsonify(job)
+    return crypto_response(job)
+
+@app.route('/sign_jobs', methods=['GET'])
+def sign_jobs_stats_route():
+    """API endpoint with sign queue depth, capacity and throughput counters."""
+    return jsonify(SIGN_JOBS.stats())
 
 @app.route('/verify_signature', methods=['POST'])
 def verify_signature_route():
     """API endpoint to verify a signature."""
-    data = request.json
+    data, request_media_type = read_crypto_request()
     message_str = data.get('message')
     signature_str = data.get('signature')
     signer_inventory_id = data.get('signer_inventory_id')
+    key_id = data.get('key_id') # Optional: pins the exact key version that signed
 
     if not all([message_str, signature_str, signer_inventory_id]):
         return jsonify({"error": "Missing data: message, signature, or signer_inventory_id"}), 400
     
-    if signer_inventory_id not in GENERATED_KEYS or "error" in GENERATED_KEYS[signer_inventory_id] or "public_key_e" not in GENERATED_KEYS[signer_inventory_id]:
+    key_context = KEYRING.resolve(key_id, signer_inventory_id)
+    if key_context is None or key_context.inventory_id != signer_inventory_id:
         return jsonify({"error": f"Keys not properly initialized or error in keys for signer inventory {signer_inventory_id}. Cannot verify."}), 400
 
-    keys = GENERATED_KEYS[signer_inventory_id]
-    public_key_e = keys["public_key_e"]
-    n = keys["public_key_n"]
+    public_key_e = key_context.e
+    n = key_context.n
     
     try:
-        signature = int(signature_str) # Convert string signature back to integer
+        signature = wire_format.parse_int(signature_str, request_media_type) # Convert signature back to integer
     except ValueError:
         return jsonify({"error": "Invalid signature format. Signature must be a string representing an integer."}), 400
         
@@ -441,132 +870,440 @@ def verify_signature_route():
         is_valid, original_msg_hash_hex, decrypted_hash_from_sig_int = rsa_utils.verify_signature(
             message_str, signature, public_key_e, n
         )
-        return jsonify({
+        return crypto_response({
             "is_valid": is_valid, 
             "message_received": message_str,
             "original_message_hash_hex": original_msg_hash_hex,
             "decrypted_hash_from_signature_hex": hex(decrypted_hash_from_sig_int)[2:].zfill(len(original_msg_hash_hex)),
-            "signer_inventory_id": signer_inventory_id
+            "signer_inventory_id": signer_inventory_id,
+            "key_id": key_context.key_id
         })
     except Exception as e:
         app.logger.error(f"Verification failed for signer {signer_inventory_id}: {str(e)}")
         return jsonify({"error": f"Verification failed: {str(e)}"}), 500
 
+def render_key_details(snapshot):
+    """Builds the /get_all_key_details payload for one snapshot."""
+    key_details_for_frontend = {}
+    for inv_id in INVENTORY_PARAMS.keys():
+        key_strings = KEY_DISPLAY_STRINGS.get(inv_id, {}) # Use .get for safety
+        inventory_items = list(snapshot.inventories.get(inv_id, ()))
+        key_details_for_frontend[inv_id] = dict(key_strings, items=inventory_items)
+    return key_details_for_frontend
+
 @app.route('/get_all_key_details', methods=['GET'])
 def get_all_key_details_route():
     """Helper endpoint to fetch all generated key details for display."""
-    key_details_for_frontend = {}
-    for inv_id in INVENTORY_PARAMS.keys():
-        key_data = GENERATED_KEYS.get(inv_id, {}) # Use .get for safety
-        inventory_items = INVENTORY_DATA.get(inv_id, [])
-        
-        key_details_for_frontend[inv_id] = {
-            "p": str(key_data.get("p_val", "N/A")),
-            "q": str(key_data.get("q_val", "N/A")),
-            "e": str(key_data.get("public_key_e", "N/A")),
-            "n": str(key_data.get("public_key_n", "N/A")),
-            "phi_n": str(key_data.get("phi_n_val", "N/A")),
-            "d": str(key_data.get("private_key_d", "N/A")),
-            "items": inventory_items,
-            "error": key_data.get("error") # Get error from GENERATED_KEYS
-        }
-    return jsonify(key_details_for_frontend)
+    return cached_json_response("key_details", render_key_details)
+
+# Every change after startup, numbered, for ?since=N delta sync
+CHANGE_LOG = change_log.ChangeLog(
+    os.environ.get("CHANGE_LOG_DIR") or tempfile.gettempdir(),
+    memory_entries=int(os.environ.get("CHANGE_LOG_MEMORY", "10000")),
+    disk_entries=int(os.environ.get("CHANGE_LOG_DISK", "1000000"))
+)
+STATE.add_listener(CHANGE_LOG.apply_changes)
+# The last ledger converted by record_dicts(): (records tuple, their dicts)
+_RECORD_DICTS = ((), [])
+_RECORD_DICTS_LOCK = threading.Lock()
+
+def record_dicts(snapshot):
+    """
+    The snapshot's signed records in their legacy dict form, built once per
+    snapshot. Records are immutable and carried over between snapshots, so
+    the dict of a record converted for an earlier snapshot is reused; only new
+    records pay for to_dict(). The dicts are shared and must not be modified.
+    """
+    return snapshot.derived("record_dicts", _convert_record_dicts)
+
+def _convert_record_dicts(snapshot):
+    global _RECORD_DICTS
+    with _RECORD_DICTS_LOCK:
+        previous, previous_dicts = _RECORD_DICTS
+        dicts = [previous_dicts[index] if index < len(previous) and previous[index] is record else record.to_dict()
+                 for index, record in enumerate(snapshot.signed_records)]
+        _RECORD_DICTS = (snapshot.signed_records, dicts)
+    return dicts
+
+def replication_snapshot():
+    """Full state for a follower that cannot resume from its offset, with the log position it reflects."""
+    snapshot = STATE.current()
+    return CHANGE_LOG.seq_at_version(snapshot.version), {
+        "inventories": snapshot.inventories_as_lists(),
+        "signed_records": record_dicts(snapshot),
+        "blocks": list(snapshot.blocks)
+    }
+
+# Followers (python replication.py follow <dir> <port>) receive the change log over a local socket
+REPLICATION_LEADER = None
+if os.environ.get("REPLICATION_PORT"):
+    REPLICATION_LEADER = replication.ReplicationLeader(
+        CHANGE_LOG, replication_snapshot,
+        host=os.environ.get("REPLICATION_HOST", "127.0.0.1"),
+        port=int(os.environ["REPLICATION_PORT"])
+    )
+    REPLICATION_LEADER.start()
+
+@app.route('/api/replication', methods=['GET'])
+def replication_route():
+    """API endpoint with each follower's acknowledged offset, lag and bytes per record."""
+    if REPLICATION_LEADER is None:
+        return jsonify({"enabled": False, "last_seq": CHANGE_LOG.last_seq()})
+    return jsonify(dict(REPLICATION_LEADER.metrics(), enabled=True))
+
+INVENTORY_CHANGE_KINDS = ("upsert", "remove")
+LEDGER_CHANGE_KINDS = ("signed_record", "ledger_reset")
+
+def snapshot_or_delta_response(name, render, kinds):
+    """
+    Serves either the full (cached) snapshot, tagged with the change-log position
+    it corresponds to, or with ?since=N only the logged changes of `kinds` after N.
+    Answers 410 with "resnapshot": true if N is no longer (or was never) in the log.
+
+    The change log belongs to this process and this run. Behind several
+    workers a mirror must keep polling the same worker, and after a restart
+    it reloads the full data once.
+    """
+    since = request.args.get('since')
+    if since is None:
+        # The body and its sequence number must come from the same snapshot
+        snapshot = STATE.current()
+        response = cached_json_response(name, render, snapshot)
+        response.headers["X-Change-Log"] = CHANGE_LOG.log_id
+        response.headers["X-Change-Seq"] = str(CHANGE_LOG.seq_at_version(snapshot.version))
+        return response
+    
+    try:
+        since = int(since)
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+    except ValueError:
+        return jsonify({"error": "since and limit must be integers."}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1."}), 400
+    log_id = request.args.get('log_id')
+    delta = CHANGE_LOG.since(since, kinds=kinds, limit=limit) if log_id in (None, CHANGE_LOG.log_id) else None
+    if delta is None:
+        return jsonify({
+            "error": f"Changes after {since} are not available in change log {CHANGE_LOG.log_id}. Reload the full data.",
+            "resnapshot": True,
+            "log_id": CHANGE_LOG.log_id,
+            "earliest_seq": CHANGE_LOG.earliest_seq(),
+            "last_seq": CHANGE_LOG.last_seq()
+        }), 410
+    delta["log_id"] = CHANGE_LOG.log_id
+    delta["since"] = since
+    return jsonify(delta)
 
 @app.route('/get_inventory_data', methods=['GET'])
 def get_inventory_data_route():
-    """API endpoint to get all inventory data."""
-    return jsonify(INVENTORY_DATA)
+    """
+    API endpoint to get all inventory data. With ?since=N (from the X-Change-Seq
+    header or a previous delta's last_seq) returns only the row upserts and removals since.
+    """
+    return snapshot_or_delta_response("inventory_data", lambda snapshot: snapshot.inventories_as_lists(),
+                                      INVENTORY_CHANGE_KINDS)
 
 @app.route('/get_signed_records', methods=['GET'])
 def get_signed_records_route():
-    """API endpoint to get all signed records."""
-    return jsonify(SIGNED_RECORDS_DB)
+    """API endpoint to get all signed records. With ?since=N returns only the ledger changes since."""
+    return snapshot_or_delta_response("signed_records", record_dicts, LEDGER_CHANGE_KINDS)
 
 @app.route('/verify_all_signatures', methods=['GET'])
 def verify_all_signatures_route():
     """API endpoint to verify all recorded signatures against all inventories."""
-    verification_results = []
+    # The result depends only on the ledger and the (fixed) keys, so it is cached per version too
+    return cached_json_response("signature_verifications", verify_all_signatures)
+
+def verify_all_signatures(snapshot):
+    """
+    Verifies every signed record in `snapshot`: one RSA check with the key named
+    by the record's key_id, then a row-digest comparison for every other inventory.
+    """
+    id_index = snapshot.derived("id_index", lambda snap: quorum_read.build_id_index(snap.inventories))
+    return [verify_signed_record(record, id_index, record_dict)
+            for record, record_dict in zip(snapshot.signed_records, record_dicts(snapshot))]
+
+def verify_signed_record(record, id_index, record_dict=None):
+    """
+    Verifies one signed record (a signed_record.SignedRecord) against the
+    inventories in `id_index` (see verify_all_signatures). The record's digest
+    and integer signature are used as they are, without re-hashing or parsing.
+    `record_dict` is the record's dict form if the caller has it (see record_dicts).
+    """
+    original_signer_id = record.inventory_id
+    signature = record.signature
+    if record_dict is None:
+        record_dict = record.to_dict()
     
-    for record in SIGNED_RECORDS_DB:
-        original_signer_id = record.get("inventory_id")
-        message = record.get("message")
-        signature_str = record.get("signature")
-        
-        if not all([original_signer_id, message, signature_str]):
-            verification_results.append({
-                "record": record,
-                "verifications": [{"inventory_id": "ALL", "is_valid": False, "status": "ERROR", "error": "Missing data in record"}],
-                "original_signer": original_signer_id,
-                "propagation_status": "ERROR"
-            })
-            continue
-        
+    if not all([original_signer_id, record.digest, record.get("signature")]):
+        return {
+            "record": record_dict,
+            "verifications": [{"inventory_id": "ALL", "is_valid": False, "status": "ERROR", "error": "Missing data in record"}],
+            "original_signer": original_signer_id,
+            "propagation_status": "ERROR"
+        }
+    
+    if signature is None:
+        return {
+            "record": record_dict,
+            "verifications": [{"inventory_id": "ALL", "is_valid": False, "status": "ERROR", "error": "Invalid signature format"}],
+            "original_signer": original_signer_id,
+            "propagation_status": "ERROR"
+        }
+    
+    # Verify the signature once, with exactly the key that produced it
+    record_verifications = []
+    valid_with_original_signer = False
+    key_context = KEYRING.resolve(record.key_id, original_signer_id)
+    
+    if key_context is None:
+        record_verifications.append({
+            "inventory_id": original_signer_id,
+            "is_valid": False,
+            "status": "ERROR",
+            "error": f"Unknown signing key {record.key_id or original_signer_id}"
+        })
+    else:
         try:
-            signature = int(signature_str)
-        except ValueError:
-            verification_results.append({
-                "record": record,
-                "verifications": [{"inventory_id": "ALL", "is_valid": False, "status": "ERROR", "error": "Invalid signature format"}],
-                "original_signer": original_signer_id,
-                "propagation_status": "ERROR"
+            original_hash = record.digest.hex()
+            is_valid, decrypted_hash = rsa_utils.verify_digest(
+                record.digest_int(), signature, key_context.e, key_context.n
+            )
+            valid_with_original_signer = is_valid
+            record_verifications.append({
+                "inventory_id": original_signer_id,
+                "is_valid": is_valid,
+                "status": "ORIGINAL_SIGNER",
+                "key_id": key_context.key_id,
+                "original_hash_hex": original_hash,
+                "decrypted_hash_hex": hex(decrypted_hash)[2:].zfill(len(original_hash))
+            })
+        except Exception as e:
+            record_verifications.append({
+                "inventory_id": original_signer_id,
+                "is_valid": False,
+                "status": "ERROR",
+                "error": str(e)
             })
+    
+    # Propagation checks are hash comparisons: each other inventory must hold the signed row
+    record_item = record.item_dict or {}
+    record_digest = quorum_read.row_digest(record_item) if "id" in record_item else None
+    propagated_everywhere = True
+    for verifier_id in INVENTORY_PARAMS.keys():
+        if verifier_id == original_signer_id:
             continue
-        
-        # Verify against each inventory's public key
-        record_verifications = []
-        valid_with_original_signer = False
-        
-        for verifier_id in INVENTORY_PARAMS.keys():
-            if verifier_id not in GENERATED_KEYS or "error" in GENERATED_KEYS[verifier_id]:
-                record_verifications.append({
-                    "inventory_id": verifier_id,
-                    "is_valid": False,
-                    "status": "ERROR",
-                    "error": f"No valid keys for inventory {verifier_id}"
-                })
-                continue
-                
-            keys = GENERATED_KEYS[verifier_id]
-            public_key_e = keys["public_key_e"]
-            n = keys["public_key_n"]
-            
-            try:
-                is_valid, original_hash, decrypted_hash = rsa_utils.verify_signature(
-                    message, signature, public_key_e, n
-                )
-                
-                # Determine verification status based on whether this inventory is the original signer
-                status = "PROPAGATED"
-                if verifier_id == original_signer_id:
-                    status = "ORIGINAL_SIGNER"
-                    valid_with_original_signer = is_valid
-                
-                record_verifications.append({
-                    "inventory_id": verifier_id,
-                    "is_valid": is_valid,
-                    "status": status,
-                    "original_hash_hex": original_hash,
-                    "decrypted_hash_hex": hex(decrypted_hash)[2:].zfill(len(original_hash))
-                })
-            except Exception as e:
-                record_verifications.append({
-                    "inventory_id": verifier_id,
-                    "is_valid": False,
-                    "status": "ERROR",
-                    "error": str(e)
-                })
-        
-        # Determine overall propagation status
-        propagation_status = "VALID" if valid_with_original_signer else "INVALID"
-        
-        verification_results.append({
-            "record": record,
-            "verifications": record_verifications,
-            "original_signer": original_signer_id,
-            "propagation_status": propagation_status
-        })
+        stored_item = id_index.get(verifier_id, {}).get(record_item.get("id"))
+        if record_digest is None or stored_item is None:
+            propagated_everywhere = False
+            record_verifications.append({
+                "inventory_id": verifier_id,
+                "is_valid": False,
+                "status": "ERROR",
+                "error": "Signed item not found in this inventory"
+            })
+        elif quorum_read.row_digest(stored_item) != record_digest:
+            propagated_everywhere = False
+            record_verifications.append({
+                "inventory_id": verifier_id,
+                "is_valid": False,
+                "status": "ERROR",
+                "error": "Stored row differs from the signed record"
+            })
+        else:
+            record_verifications.append({
+                "inventory_id": verifier_id,
+                "is_valid": True,
+                "status": "PROPAGATED",
+                "row_digest_hex": record_digest.hex()
+            })
     
-    return jsonify(verification_results)
+    # Determine overall propagation status
+    propagation_status = "VALID" if valid_with_original_signer and propagated_everywhere else "INVALID"
+    
+    return {
+        "record": record_dict,
+        "verifications": record_verifications,
+        "original_signer": original_signer_id,
+        "propagation_status": propagation_status
+    }
+
+def build_feed_events(snapshot, changes):
+    """
+    Turns a new snapshot's changes into live UI events (see /events): row
+    upserts and removals as they are, the verification of each new signed
+    record, and a fresh verification of earlier records whose item changed.
+    Runs once per version, however many clients are connected.
+    """
+    id_index = snapshot.derived("id_index", lambda snap: quorum_read.build_id_index(snap.inventories))
+    events = []
+    touched_items = set()
+    new_records = 0
+    for change in changes:
+        kind = change["kind"]
+        if kind == "upsert":
+            events.append(("upsert", {"inventory": change["inventory"], "item": change["item"]}))
+            touched_items.add(change["item"]["id"])
+        elif kind == "remove":
+            events.append(("remove", {"inventory": change["inventory"], "item_id": change["item_id"]}))
+            touched_items.add(change["item_id"])
+        elif kind == "ledger_reset":
+            events.append(("ledger_reset", {}))
+        elif kind == "signed_record":
+            new_records += 1
+        elif kind == "block":
+            block = change["block"]
+            events.append(("block", {"index": block["index"], "hash": block["hash"],
+                                     "first_record": block["first_record"], "record_count": block["record_count"]}))
+
+    records = snapshot.signed_records
+    dicts = record_dicts(snapshot)
+    first_new = len(records) - new_records
+    for index, record in enumerate(records):
+        if index >= first_new or (record.item_dict or {}).get("id") in touched_items:
+            events.append(("verification", {"index": index,
+                                            "result": verify_signed_record(record, id_index, dicts[index])}))
+    return events
+
+CHANGE_FEED = change_feed.ChangeBroadcaster(build_feed_events)
+STATE.add_listener(CHANGE_FEED.apply_changes)
+SSE_KEEPALIVE_SECONDS = 15
+
+@app.route('/events', methods=['GET'])
+def change_events_route():
+    """
+    Server-Sent Events stream of inventory and ledger changes (event types:
+    hello, upsert, remove, verification, block, ledger_reset, resync).
+    Clients load the full state once and then apply these deltas. Event ids
+    are state versions, matching the X-State-Version of full responses.
+    Last-Event-ID is not replayed: every connection starts with "hello",
+    and a client that sees one after a drop reloads in full.
+    """
+    subscriber = CHANGE_FEED.subscribe()
+    version = STATE.current().version
+    
+    def stream():
+        try:
+            yield "retry: 3000\n\n" + change_feed.format_sse("hello", {"version": version}, version)
+            while not CHANGE_FEED.is_closed(subscriber):
+                message = CHANGE_FEED.next_message(subscriber, timeout=SSE_KEEPALIVE_SECONDS)
+                yield message if message is not None else ": keepalive\n\n"
+        finally:
+            CHANGE_FEED.unsubscribe(subscriber)
+    
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/get_keyring', methods=['GET'])
+def get_keyring_route():
+    """API endpoint listing every key version (public parts only) per inventory."""
+    return jsonify(KEYRING.describe())
+
+# Bearer token required by /rotate_key; without it key rotation is disabled
+KEY_ADMIN_TOKEN = os.environ.get("KEY_ADMIN_TOKEN")
+
+def key_admin_authorized():
+    """True if the request carries the key administrator's bearer token."""
+    if not KEY_ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {KEY_ADMIN_TOKEN}")
+
+@app.route('/rotate_key', methods=['POST'])
+def rotate_key_route():
+    """
+    API endpoint to rotate an inventory's key to new parameters p, q, e. Without
+    p, q and e, a freshly generated key is taken from KEY_POOL. Requires
+    KEY_ADMIN_TOKEN; supplied parameters must pass keygen.check_key_params().
+    """
+    if not key_admin_authorized():
+        return jsonify({"error": "Key rotation requires the key administrator token."}), 403
+    data, request_media_type = read_crypto_request()
+    inventory_id = data.get('inventory_id')
+    if inventory_id not in INVENTORY_PARAMS:
+        return jsonify({"error": f"Unknown inventory {inventory_id}"}), 400
+    try:
+        if all(data.get(name) is None for name in ("p", "q", "e")):
+            params = KEY_POOL.take()
+            p, q, e = params["p"], params["q"], params["e"]
+        else:
+            p, q, e = (wire_format.parse_int(data.get(name), request_media_type) for name in ("p", "q", "e"))
+            keygen.check_key_params(p, q, e, int(os.environ.get("KEY_MAX_BITS", str(keygen.MAX_MODULUS_BITS))))
+        context = rotate_key(inventory_id, p, q, e)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Key rotation failed: {str(e)}"}), 400
+    return jsonify({"inventory_id": inventory_id, "key_id": context.key_id, "version": context.version})
+
+@app.route('/api/key_pool', methods=['GET'])
+def key_pool_route():
+    """API endpoint with the key pool's fill level and generation counters."""
+    return jsonify(KEY_POOL.stats())
+
+@app.route('/api/traces', methods=['GET'])
+def traces_route():
+    """API endpoint with tracing counters and the most recently kept traces (ids, names, durations)."""
+    return jsonify(TRACER.stats())
+
+@app.route('/api/harn_signers', methods=['GET'])
+def harn_signers_route():
+    """API endpoint with the threshold, signer set and per-signer failure counters of the Harn signers."""
+    return jsonify(HARN_SIGNERS.stats())
+
+@app.route('/api/consensus/policy', methods=['GET'])
+def consensus_policy_route():
+    """API endpoint with the active consensus voting policy."""
+    return jsonify(CONSENSUS_POLICY.spec)
+
+@app.route('/api/consensus/evaluate', methods=['POST'])
+def consensus_evaluate_route():
+    """
+    API endpoint that evaluates a batch of proposed records against the current inventories
+    without adding them. Body: {"records": [{"item_id", "quantity", "price", "location"}, ...]}.
+    Returns every node's vote on every record, the rule behind each rejection, and which records reach the quorum.
+    """
+    data = request.get_json(silent=True) or {}
+    records = data.get('records')
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        return jsonify({"error": "records must be a list of record objects."}), 400
+    if len(records) > MAX_CONSENSUS_BATCH:
+        return jsonify({"error": f"At most {MAX_CONSENSUS_BATCH} records per batch."}), 400
+    try:
+        result = CONSENSUS_POLICY.evaluate(consensus_inventories(STATE.current()), records)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid record: {e}"}), 400
+    return jsonify(result.to_dict())
+
+@app.route('/api/snapshot', methods=['GET', 'POST'])
+def snapshot_route():
+    """
+    API endpoint for state snapshots: GET returns when the last image was written, its
+    state version, size and write time; POST writes an image of the current state now.
+    """
+    if request.method == 'POST':
+        try:
+            return jsonify(SNAPSHOTS.write_now())
+        except (OSError, ValueError) as e:
+            return jsonify({"error": f"Could not write snapshot: {e}"}), 500
+    return jsonify(SNAPSHOTS.stats())
+
+@app.route('/get_blocks', methods=['GET'])
+def get_blocks_route():
+    """API endpoint to get the sealed ledger blocks."""
+    return cached_json_response("blocks", lambda snapshot: list(snapshot.blocks))
+
+@app.route('/seal_block', methods=['POST'])
+def seal_block_route():
+    """API endpoint to seal all pending signed records into blocks right away."""
+    sealed_blocks = seal_pending_records(force=True)
+    return jsonify({"sealed": sealed_blocks, "block_count": len(STATE.current().blocks)})
+
+@app.route('/verify_ledger', methods=['GET'])
+def verify_ledger_route():
+    """
+    API endpoint to verify the whole block chain: one RSA verification per
+    block plus hashing per record, instead of one RSA operation per record per key.
+    """
+    return cached_json_response("ledger_verification", lambda snapshot: block_ledger.verify_chain(
+        snapshot.blocks, snapshot.signed_records, verify_block_header))
 
 @app.route('/multi_signature_query', methods=['GET'])
 def multi_signature_query_page():
@@ -575,112 +1312,258 @@ def multi_signature_query_page():
 
 @app.route('/api/query_item', methods=['POST'])
 def query_item():
-    """API endpoint to query an item across all inventories with Harn multi-signature verification."""
-    data = request.json
+    """
+    API endpoint to query an item across all inventories with Harn multi-signature verification.
+    Optional request fields: read_quorum (replicas that must agree, default a majority)
+    and wait_for_all (await every replica for a complete divergence report).
+    """
+    data, _ = read_crypto_request()
     item_id = data.get('item_id')
     
-    if not item_id:
+    if not item_id or not isinstance(item_id, str):
         return jsonify({"error": "No item ID provided."}), 400
     
-    # 1. Search each inventory for the item
-    results = []
-    for inv_id in ["A", "B", "C", "D"]:
-        inventory_items = INVENTORY_DATA.get(inv_id, [])
-        for item in inventory_items:
-            if item["id"] == item_id:
-                results.append({
-                    "inventory": inv_id,
-                    "item_id": item["id"],
-                    "qty": item["units"],
-                    "price": item["price"],
-                    "location": item["location"]
-                })
-                break
-    
-    if not results:
-        return jsonify({"error": f"Item ID {item_id} not found in any inventory."}), 404
-    
-    # Combine results to get a single quantity value (assuming same qty across inventories)
-    quantity = results[0]["qty"]
-    
-    # 2. Generate hash of the message (item_id and quantity)
-    hash_val = harn_multisig.hash_message(item_id, quantity)
-    
-    # 3. Generate partial signatures from each inventory
-    partial_signatures = {}
-    for inv_id in ["A", "B", "C", "D"]:
-        identity = pkg_keys.IDENTITIES[inv_id]
-        random_val = pkg_keys.RANDOM_VALUES[inv_id]
-        partial_sig = harn_multisig.partial_signature(identity, random_val, hash_val)
-        partial_signatures[inv_id] = partial_sig
+    read_quorum = data.get('read_quorum')
+    if read_quorum is not None and (not isinstance(read_quorum, int) or isinstance(read_quorum, bool) or read_quorum < 1):
+        return jsonify({"error": "read_quorum must be a positive integer."}), 400
+    wait_for_all = bool(data.get('wait_for_all'))
+    
+    # Identical concurrent queries share one computation; results stay valid until the item changes.
+    # The item's counter is read before the snapshot, so a result can never outlive a newer version.
+    cache_key = (item_id, ITEM_VERSIONS.version(item_id), read_quorum, wait_for_all)
+    try:
+        with TRACER.trace("POST /api/query_item", item_id=item_id) as trace_span:
+            (payload, status), outcome = QUERY_CACHE.get_or_compute(
+                cache_key, lambda: compute_item_query(item_id, read_quorum, wait_for_all))
+            trace_span.set(status=status, cache=outcome)
+            if status >= 500:
+                trace_span.mark_error(payload.get("error"))
+    except threshold_harn.ThresholdNotReached as e:
+        response = jsonify({"error": f"Multi-signature not reached: {e}", "failed_signers": e.failed})
+        response.status_code = 503
+        if trace_span.trace_id:
+            response.headers["X-Trace-Id"] = trace_span.trace_id
+        return response
+    response = crypto_response(payload, status) if status < 400 else jsonify(payload)
+    response.status_code = status
+    response.headers["X-Cache"] = outcome.upper()
+    if trace_span.trace_id:
+        response.headers["X-Trace-Id"] = trace_span.trace_id
+    return response
+
+def compute_item_query(item_id, read_quorum, wait_for_all):
+    """
+    Quorum-reads item_id, multi-signs and encrypts the agreed value.
+    Returns (payload, status); errors are {"error": ...} payloads.
+    """
+    # 1. Quorum-read the item from every inventory, comparing row digests
+    # (the lookups are dict reads on the snapshot, so they run inline, in inventory order;
+    # with a sharded store they go to the owning shard's id index, see quorum_read.build_id_index)
+    snapshot = STATE.current()
+    id_index = snapshot.derived("id_index", lambda snap: quorum_read.build_id_index(snap.inventories))
+    with tracing.span("quorum_read") as read_span:
+        read = quorum_read.quorum_read(
+            ["A", "B", "C", "D"],
+            lambda inv_id: id_index.get(inv_id, {}).get(item_id),
+            read_quorum=read_quorum,
+            wait_for_all=wait_for_all
+        )
+        read_span.set(quorum=read["quorum"], agreeing=read.get("agreeing"))
+    consistency_report = {k: v for k, v in read.items() if k != "value"}
     
-    # 4. Aggregate signatures (PKG's role in consensus)
-    aggregated_signature = harn_multisig.aggregate_signatures(list(partial_signatures.values()))
+    if read["value"] is None:
+        return {"error": f"Item ID {item_id} not found in any inventory."}, 404
+    if not read["quorum"]:
+        return {
+            "error": f"Replicas disagree on item {item_id}: no {read['read_quorum']} inventories returned the same value.",
+            "consistency": consistency_report
+        }, 409
+    if read["divergent"] or read["missing"]:
+        print(f"WARNING: Replica divergence for item {item_id}: {consistency_report}")
     
-    # 5. Verify the aggregated signature
-    identities = list(pkg_keys.IDENTITIES.values())
-    is_valid = harn_multisig.verify_multisignature(identities, hash_val, aggregated_signature)
+    # Use the value the quorum agreed on
+    agreed_item = read["value"]
+    quantity = agreed_item["units"]
+    
+    # 2-4. Collect a t-of-n Harn multisignature over (item_id, quantity) from the node signers
+    # (ThresholdNotReached propagates, so a transient signer outage is never cached)
+    message = harn_multisig.query_message(item_id, quantity)
+    multisig = HARN_SIGNERS.sign(message)
+    
+    # 5. Verify the aggregated signature over the participating signers
+    with tracing.span("harn.verify_multisignature"):
+        is_valid = HARN_SIGNERS.verify(multisig["signers"], multisig["commitment"], message,
+                                       multisig["aggregated_signature"])
     
     if not is_valid:
-        return jsonify({"error": "Multi-signature verification failed."}), 400
+        return {"error": "Multi-signature verification failed."}, 400
     
     # 6. Prepare response message
     response_message = {
         "item_id": item_id,
         "quantity": quantity,
-        "price": results[0]["price"],
-        "location": results[0]["location"],
-        "inventories": [r["inventory"] for r in results]
+        "price": agreed_item["price"],
+        "location": agreed_item["location"],
+        "inventories": sorted(read["agreeing"])
     }
     
-    # 7. Encrypt the response using PKG's key
-    pkg_e = CRYPTO_PARAMS["pkg"]["e"]
-    pkg_n = CRYPTO_PARAMS["pkg"]["n"]
+    # 7. Encrypt the response to the procurement officer's public key, in blocks smaller than n
     response_json = json.dumps(response_message)
     
     try:
-        encrypted_response = harn_multisig.encrypt_message(response_json, pkg_e, pkg_n)
+        with tracing.span("officer.encrypt_blocks"):
+            encrypted_response = officer_crypto.encrypt_blocks(response_json, OFFICER_KEY.e, OFFICER_KEY.n)
     except Exception as e:
-        return jsonify({"error": f"Encryption failed: {str(e)}"}), 500
+        return {"error": f"Encryption failed: {str(e)}"}, 500
     
     # 8. Return the encrypted response and signature information
-    return jsonify({
+    return {
         "success": True,
-        "encrypted_response": str(encrypted_response),
-        "aggregated_signature": str(aggregated_signature),
-        "partial_signatures": {k: str(v) for k, v in partial_signatures.items()},
-        "hash_value": str(hash_val),
-        "pkg_n": str(pkg_n),
-        "pkg_e": str(pkg_e),
-        # For demonstration, we include the procurement officer's key
-        # In a real system, this would be pre-shared securely
-        "procurement_d": str(CRYPTO_PARAMS["procurement"]["d"]),
-        "procurement_n": str(CRYPTO_PARAMS["procurement"]["n"])
+        "encrypted_response": [wire_format.BigInt(block) for block in encrypted_response],
+        "aggregated_signature": wire_format.BigInt(multisig["aggregated_signature"]),
+        "partial_signatures": {k: wire_format.BigInt(v) for k, v in multisig["partial_signatures"].items()},
+        "hash_value": wire_format.BigInt(multisig["hash_value"]),
+        "commitment": wire_format.BigInt(multisig["commitment"]),
+        "signers": multisig["signers"],
+        "threshold": HARN_SIGNERS.threshold,
+        "officer_n": wire_format.BigInt(OFFICER_KEY.n),
+        "officer_e": wire_format.BigInt(OFFICER_KEY.e),
+        # The officer key stays on the server; the tag lets /api/decrypt_query accept this ciphertext
+        "ciphertext_tag": OFFICER_KEY.tag(encrypted_response),
+        "consistency": consistency_report
+    }, 200
+
+@app.route('/api/search_items', methods=['GET'])
+def search_items():
+    """
+    API endpoint for range/attribute queries over all inventories, e.g.
+    /api/search_items?location=B&units_lt=20 or ?price_min=10&price_max=15.
+    Uses the sorted secondary indexes built once per state snapshot, or with a
+    sharded store each shard's own indexes (see ShardedStore.query).
+    """
+    try:
+        filters = inventory_query.parse_filters(request.args)
+        limit = request.args.get('limit', type=int)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter value: {str(e)}"}), 400
+    
+    snapshot = STATE.current()
+    if isinstance(STORE, sharding.ShardedStore):
+        items = STORE.query(filters, limit=limit)
+    else:
+        engine = snapshot.derived("query_engine", lambda snap: inventory_query.InventoryQueryEngine(snap.inventories))
+        items = engine.query(filters, limit=limit)
+    return jsonify({
+        "filters": filters,
+        "count": len(items),
+        "items": items,
+        "version": snapshot.version
     })
 
+@app.route('/api/shards', methods=['GET'])
+def shards_route():
+    """API endpoint describing the shard layout: rows per node in each shard."""
+    if not isinstance(STORE, sharding.ShardedStore):
+        return jsonify({"sharded": False, "shard_count": 1, "backend": STORE.backend_name})
+    return jsonify(dict(STORE.stats(), sharded=True))
+
+@app.route('/api/shards/item', methods=['GET'])
+def shard_item_route():
+    """API endpoint reading one item straight from its owning shard: ?inventory=A&id=001."""
+    inv_id = request.args.get('inventory')
+    item_id = request.args.get('id')
+    if not inv_id or not item_id:
+        return jsonify({"error": "inventory and id are required."}), 400
+    item = STORE.get_item(inv_id, item_id)
+    if item is None:
+        return jsonify({"error": f"Item {item_id} not found in inventory {inv_id}."}), 404
+    shard = sharding.shard_for(item_id, STORE.shard_count) if isinstance(STORE, sharding.ShardedStore) else 0
+    return jsonify({"inventory": inv_id, "shard": shard, "item": item})
+
+@app.route('/api/shards/search', methods=['GET'])
+def shard_search_route():
+    """
+    API endpoint running a /api/search_items-style query directly against the
+    store, scattered across all shards in parallel and merged.
+    """
+    if not isinstance(STORE, sharding.ShardedStore):
+        return jsonify({"error": "The store is not sharded; use /api/search_items."}), 400
+    try:
+        filters = inventory_query.parse_filters(request.args)
+        limit = request.args.get('limit', type=int)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid filter value: {str(e)}"}), 400
+    items = STORE.query(filters, limit=limit)
+    return jsonify({"filters": filters, "count": len(items), "shard_count": STORE.shard_count, "items": items})
+
+@app.route('/api/analytics', methods=['GET'])
+def analytics():
+    """
+    API endpoint for inventory aggregates: stock value per node and per location,
+    cross-node discrepancies and the top-N items by stock value (?top=N).
+    """
+    if ANALYTICS is None:
+        return jsonify({"error": "Analytics unavailable: numpy is not installed."}), 503
+    top_n = request.args.get('top', default=5, type=int)
+    if top_n < 1:
+        return jsonify({"error": "top must be a positive integer."}), 400
+    return jsonify(ANALYTICS.summary(top_n=top_n))
+
+# Bearer token of the procurement officer: lets /api/decrypt_query and /api/decrypt_batch decrypt
+# ciphertexts that carry no server-issued tag. Without it only tagged ciphertexts are decrypted.
+OFFICER_TOKEN = os.environ.get("OFFICER_TOKEN")
+
+def officer_authorized():
+    """True if the request carries the procurement officer's bearer token."""
+    if not OFFICER_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {OFFICER_TOKEN}")
+
+def parse_ciphertext(value, media_type):
+    """Reads an encrypted response: the list of block ciphertexts from /api/query_item (or one block)."""
+    if isinstance(value, list):
+        if not value:
+            raise ValueError("Expected at least one ciphertext block")
+        return [wire_format.parse_int(block, media_type) for block in value]
+    return [wire_format.parse_int(value, media_type)]
+
 @app.route('/api/decrypt_query', methods=['POST'])
 def decrypt_query():
-    """API endpoint for the procurement officer to decrypt a query response."""
-    data = request.json
+    """
+    API endpoint for the procurement officer to decrypt a query response. The
+    server-held officer key only decrypts ciphertexts this server issued (with
+    their `ciphertext_tag`), unless the caller presents OFFICER_TOKEN.
+    """
+    data, request_media_type = read_crypto_request()
     encrypted_response = data.get('encrypted_response')
     aggregated_signature = data.get('aggregated_signature')
     procurement_d = data.get('procurement_d')
     procurement_n = data.get('procurement_n')
     
-    if not all([encrypted_response, aggregated_signature, procurement_d, procurement_n]):
+    if not all([encrypted_response, aggregated_signature]):
         return jsonify({"error": "Missing required parameters."}), 400
     
     try:
-        # Convert string parameters to integers
-        encrypted_int = int(encrypted_response)
-        proc_d = int(procurement_d)
-        proc_n = int(procurement_n)
-        
-        # Decrypt the response
-        decrypted_json = harn_multisig.decrypt_message(encrypted_int, proc_d, proc_n)
+        # Convert string (or binary) parameters to integers
+        blocks = parse_ciphertext(encrypted_response, request_media_type)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid encrypted_response: {str(e)}"}), 400
+    
+    try:
+        # Decrypt the response; without a client-supplied key, use the server-held officer key
+        if procurement_d and procurement_n:
+            proc_d = wire_format.parse_int(procurement_d, request_media_type)
+            proc_n = wire_format.parse_int(procurement_n, request_media_type)
+            decrypted_json = officer_crypto.decrypt_blocks(blocks, proc_d, proc_n)
+        elif officer_authorized() or OFFICER_KEY.is_issued(blocks, data.get('ciphertext_tag')):
+            decrypted_json = OFFICER_KEY.decrypt_blocks(blocks)
+        else:
+            return jsonify({"error": "Not a ciphertext issued by this server (missing or invalid ciphertext_tag)."}), 403
         decrypted_data = json.loads(decrypted_json)
         
-        return jsonify({
+        if not isinstance(aggregated_signature, str):
+            aggregated_signature = wire_format.BigInt(wire_format.parse_int(aggregated_signature, request_media_type))
+        return crypto_response({
             "success": True,
             "decrypted_data": decrypted_data,
             "aggregated_signature": aggregated_signature
@@ -688,6 +1571,46 @@ def decrypt_query():
     except Exception as e:
         return jsonify({"error": f"Decryption failed: {str(e)}"}), 500
 
+MAX_DECRYPT_BATCH = int(os.environ.get("MAX_DECRYPT_BATCH", "10000"))
+OFFICER_DECRYPTOR = officer_crypto.BatchDecryptor(OFFICER_KEY, workers=int(os.environ.get("DECRYPT_WORKERS", "0")))
+
+@app.route('/api/decrypt_batch', methods=['POST'])
+def decrypt_batch():
+    """
+    API endpoint for the procurement officer to decrypt many ciphertexts at once
+    with the server-held officer key (CRT). Body: {"ciphertexts": [...]}, each
+    entry {"ciphertext", "tag"} as issued by /api/query_item; callers with
+    OFFICER_TOKEN may also send bare ciphertexts. Entries without a valid tag
+    get an error result. Plaintexts that are JSON are returned parsed under
+    "decrypted_data".
+    """
+    data, request_media_type = read_crypto_request()
+    ciphertexts = data.get('ciphertexts')
+    if not isinstance(ciphertexts, list) or not ciphertexts:
+        return jsonify({"error": "ciphertexts must be a non-empty list."}), 400
+    if len(ciphertexts) > MAX_DECRYPT_BATCH:
+        return jsonify({"error": f"At most {MAX_DECRYPT_BATCH} ciphertexts per batch."}), 413
+    try:
+        entries = [(parse_ciphertext(c["ciphertext"], request_media_type), c.get("tag")) if isinstance(c, dict)
+                   else (parse_ciphertext(c, request_media_type), None) for c in ciphertexts]
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid ciphertext: {str(e)}"}), 400
+    
+    authorized = officer_authorized()
+    allowed = [authorized or OFFICER_KEY.is_issued(ciphertext, tag) for ciphertext, tag in entries]
+    decrypted = iter(OFFICER_DECRYPTOR.decrypt_batch(ciphertext for (ciphertext, _), ok in zip(entries, allowed) if ok))
+    results = [next(decrypted) if ok else {"error": "Not a ciphertext issued by this server."} for ok in allowed]
+    for result in results:
+        try:
+            result["decrypted_data"] = json.loads(result["plaintext"])
+        except (KeyError, ValueError):
+            pass
+    return crypto_response({
+        "success": all("error" not in result for result in results),
+        "count": len(results),
+        "results": results
+    })
+
 if __name__ == '__main__':
     # Ensure templates directory and index.html exist before starting
     if not os.path.isdir(template_dir):
@@ -700,4 +1623,7 @@ if __name__ == '__main__':
     
     print(f"Flask app '__name__' is: {__name__}")
     print(f"Template folder is set to: {app.template_folder}")
+    # KEY_POOL's processes are spawned, and a spawned process re-imports the __main__ script by its
+    # path, which would re-run the startup above in each of them; without a path it imports nothing
+    del sys.modules['__main__'].__file__
     app.run(debug=True, host='0.0.0.0', port=5001) # debug=True is fine for development
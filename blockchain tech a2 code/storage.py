@@ -0,0 +1,646 @@
+# storage.py
+# Storage backends for inventory data and the signed-record ledger
+
+import os
+import hashlib
+import json
+import operator
+import random
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: the exclusive lock then only serializes threads of one process
+    fcntl = None
+
+INVENTORY_IDS = ["A", "B", "C", "D"]
+
+
+def read_inventory_file(file_path):
+    """
+    Parses an inventory text file (one "id,units,price,location" line per item).
+    Returns a list of item dicts with string fields, in file order.
+    """
+    inventory_items = []
+    with open(file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line:  # Skip empty lines
+                parts = line.split(',')
+                if len(parts) >= 4:
+                    item_id, units, price, location = parts[0], parts[1], parts[2], parts[3]
+                    inventory_items.append({
+                        "id": item_id,
+                        "units": units,
+                        "price": price,
+                        "location": location
+                    })
+    return inventory_items
+
+
+def write_inventory_file(file_path, items):
+    """Writes a list of item dicts back to an inventory text file."""
+    with open(file_path, 'w') as file:
+        for item in items:
+            file.write(f"{item['id']},{item['units']},{item['price']},{item['location']}\n")
+
+
+class InventoryStore:
+    """
+    Interface shared by all storage backends.
+
+    A store owns the authoritative copy of every node's inventory and of the
+    signed-record ledger. version() increases on every mutation so callers can
+    cheaply detect that their in-memory view is stale.
+    """
+    backend_name = "abstract"
+    # True if the ledger, blocks and keys survive a restart (inventories always do)
+    durable = False
+    # True if several processes can use the store at the same time
+    shared = False
+
+    def claim_initialization(self):
+        """
+        Returns True if the caller should seed this store from the text files.
+        Shared stores return True only for the first process of a run that
+        opens them (see SQLiteStore for what a run is).
+        """
+        raise NotImplementedError
+
+    def load_inventories(self):
+        """
+        Returns {inventory_id: tuple of item dicts} for every node. The rows
+        may be shared with the store and with earlier calls: callers must not
+        modify them, and stores never do (a write builds new dicts instead).
+        """
+        raise NotImplementedError
+
+    def get_item(self, inv_id, item_id):
+        """Returns one node's item with the given id, or None."""
+        raise NotImplementedError
+
+    def find_row(self, item_id, location):
+        """
+        Returns (inventory_id, item) for the first node holding an item with
+        this id and location, or None.
+        """
+        raise NotImplementedError
+
+    def replace_inventory(self, inv_id, items):
+        """Replaces the full item list of one node."""
+        raise NotImplementedError
+
+    def upsert_item(self, inv_id, item):
+        """Inserts an item into one node, or updates it in place if the id exists."""
+        raise NotImplementedError
+
+    def load_signed_records(self):
+        """Returns the ledger as a list of record dicts, oldest first."""
+        raise NotImplementedError
+
+    def append_signed_record(self, record):
+        """Appends one record dict to the ledger."""
+        raise NotImplementedError
+
+    def clear_signed_records(self):
+        """Removes every record from the ledger (and the blocks sealing it)."""
+        raise NotImplementedError
+
+    def load_blocks(self):
+        """Returns the sealed ledger blocks as a list of dicts, in chain order."""
+        raise NotImplementedError
+
+    def append_block(self, block):
+        """
+        Appends a block unless one with the same index already exists.
+        Returns True if the block was stored, False if another writer got there first.
+        """
+        raise NotImplementedError
+
+    def load_keys(self):
+        """Returns the persisted (rotated) key records, oldest first."""
+        raise NotImplementedError
+
+    def add_key(self, key_id, key_record):
+        """Persists a key record under key_id; returns False if it already exists."""
+        raise NotImplementedError
+
+    def restore_image(self, inventories, signed_records, blocks, keys):
+        """
+        Replaces the store's contents with a snapshot image's: inventories
+        ({inventory_id: [item dicts]}), ledger records, blocks and rotated keys
+        ({key_id: key_record}). Used in place of seeding from the text files;
+        backends override it with a bulk load.
+        """
+        for inv_id, items in inventories.items():
+            self.replace_inventory(inv_id, items)
+        self.clear_signed_records()
+        for record in signed_records:
+            self.append_signed_record(record)
+        for block in blocks:
+            self.append_block(block)
+        for key_id, key_record in keys.items():
+            self.add_key(key_id, key_record)
+
+    def exclusive_lock(self):
+        """
+        Returns the lock (acquire/release, or a context manager) that serializes
+        check-then-write sequences, such as /sign_record's duplicate check and
+        append, across every process sharing the store.
+        """
+        raise NotImplementedError
+
+    def save_job(self, job_id, body):
+        """Publishes a job's serialized state so any process sharing the store can answer polls for it."""
+        pass
+
+    def load_job(self, job_id):
+        """Returns a job's serialized state saved by save_job(), or None."""
+        return None
+
+    def version(self):
+        """Returns the current state version."""
+        raise NotImplementedError
+
+    def instance_id(self):
+        """
+        Returns a random id fixed for the lifetime of the underlying data, so
+        versions from different stores (or a re-created one) are never confused.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Releases any resources held by the store."""
+        pass
+
+
+class TextFileStore(InventoryStore):
+    """
+    The original single-process backend: one text file per node in the
+    database directory and an in-memory ledger.
+    """
+    backend_name = "file"
+
+    def __init__(self, database_dir, inventory_ids=None):
+        self.database_dir = database_dir
+        self.inventory_ids = list(inventory_ids or INVENTORY_IDS)
+        self._inventories = None
+        self._signed_records = []
+        self._blocks = []
+        self._keys = {}
+        self._version = 0
+        self._instance_id = random.getrandbits(63)
+        self._lock = threading.Lock()
+        self._exclusive_lock = threading.Lock()  # Every process owns its files, so a thread lock suffices
+
+    def _file_path(self, inv_id):
+        return os.path.join(self.database_dir, f"inventory_{inv_id}.txt")
+
+    def _ensure_loaded(self):
+        if self._inventories is not None:
+            return
+        self._inventories = {}
+        for inv_id in self.inventory_ids:
+            file_path = self._file_path(inv_id)
+            if os.path.exists(file_path):
+                self._inventories[inv_id] = tuple(read_inventory_file(file_path))
+
+    def claim_initialization(self):
+        # Every process owns its files, so it always (re)seeds itself
+        return True
+
+    def load_inventories(self):
+        with self._lock:
+            self._ensure_loaded()
+            return dict(self._inventories)
+
+    def get_item(self, inv_id, item_id):
+        with self._lock:
+            self._ensure_loaded()
+            for item in self._inventories.get(inv_id, ()):
+                if item["id"] == item_id:
+                    return dict(item)
+            return None
+
+    def find_row(self, item_id, location):
+        with self._lock:
+            self._ensure_loaded()
+            for inv_id in self.inventory_ids:
+                for item in self._inventories.get(inv_id, ()):
+                    if item["id"] == item_id and item["location"] == location:
+                        return inv_id, dict(item)
+            return None
+
+    def replace_inventory(self, inv_id, items):
+        with self._lock:
+            self._ensure_loaded()
+            self._inventories[inv_id] = tuple(dict(item) for item in items)
+            write_inventory_file(self._file_path(inv_id), self._inventories[inv_id])
+            self._version += 1
+
+    def upsert_item(self, inv_id, item):
+        with self._lock:
+            self._ensure_loaded()
+            inventory_items = self._inventories.get(inv_id, ())
+            for position, existing in enumerate(inventory_items):
+                if existing["id"] == item["id"]:
+                    updated = dict(existing)
+                    updated.update(item)
+                    inventory_items = inventory_items[:position] + (updated,) + inventory_items[position + 1:]
+                    break
+            else:
+                inventory_items += (dict(item),)
+            self._inventories[inv_id] = inventory_items
+            write_inventory_file(self._file_path(inv_id), inventory_items)
+            self._version += 1
+
+    def load_signed_records(self):
+        with self._lock:
+            return list(self._signed_records)
+
+    def append_signed_record(self, record):
+        with self._lock:
+            self._signed_records.append(record)
+            self._version += 1
+
+    def clear_signed_records(self):
+        with self._lock:
+            self._signed_records = []
+            self._blocks = []
+            self._version += 1
+
+    def load_blocks(self):
+        with self._lock:
+            return list(self._blocks)
+
+    def append_block(self, block):
+        with self._lock:
+            if block["index"] != len(self._blocks):
+                return False
+            self._blocks.append(block)
+            self._version += 1
+            return True
+
+    def load_keys(self):
+        with self._lock:
+            return list(self._keys.values())
+
+    def add_key(self, key_id, key_record):
+        with self._lock:
+            if key_id in self._keys:
+                return False
+            self._keys[key_id] = key_record
+            self._version += 1
+            return True
+
+    def restore_image(self, inventories, signed_records, blocks, keys):
+        for inv_id, items in inventories.items():
+            self.replace_inventory(inv_id, items)
+        with self._lock:
+            self._signed_records = list(signed_records)
+            self._blocks = list(blocks)
+            self._keys.update(keys)
+            self._version += 1
+
+    def exclusive_lock(self):
+        return self._exclusive_lock
+
+    def version(self):
+        return self._version
+
+    def instance_id(self):
+        return self._instance_id
+
+
+class SQLiteStore(InventoryStore):
+    """
+    Shared backend for multi-process deployments (e.g. several gunicorn workers).
+
+    The database runs in WAL mode so readers never block the single writer.
+    Each worker thread gets its own connection (re-opened after a fork), and
+    all statements are constant SQL strings so sqlite3's statement cache
+    re-uses their prepared form. A counter in the meta table is bumped inside
+    every write transaction and serves as the shared state version.
+
+    Seeding is claimed once per run. With a `run_id` (INVENTORY_RUN_ID,
+    e.g. set once per deployment and inherited by all its workers) the
+    first process of every new run re-seeds the database and clears the
+    ledger, like the file backend does on every start. Without one the
+    claim is permanent: restarts keep the data and ledger until the
+    database file is deleted.
+    """
+    backend_name = "sqlite"
+    durable = True
+    shared = True
+    JOB_HISTORY = 10000  # Sign jobs kept for polling
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS inventory ("
+        " inv_id TEXT NOT NULL, item_id TEXT NOT NULL, position INTEGER NOT NULL,"
+        " units TEXT NOT NULL, price TEXT NOT NULL, location TEXT NOT NULL,"
+        " PRIMARY KEY (inv_id, item_id))",
+        "CREATE TABLE IF NOT EXISTS signed_records ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS blocks (block_index INTEGER PRIMARY KEY, body TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS node_keys ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT, key_id TEXT NOT NULL UNIQUE, body TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS sign_jobs ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL UNIQUE, body TEXT NOT NULL)",
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)",
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', abs(random()))",
+    )
+
+    SQL_VERSION = "SELECT value FROM meta WHERE key = 'version'"
+    SQL_INSTANCE = "SELECT value FROM meta WHERE key = 'instance'"
+    SQL_BUMP_VERSION = "UPDATE meta SET value = value + 1 WHERE key = 'version'"
+    SQL_CLAIM_SEED = "INSERT OR IGNORE INTO meta (key, value) VALUES ('seeded', ?)"
+    SQL_CLAIM_RUN = (
+        "INSERT INTO meta (key, value) VALUES ('seeded', ?)"
+        " ON CONFLICT (key) DO UPDATE SET value = excluded.value WHERE value != excluded.value"
+    )
+    SQL_SELECT_INVENTORY = "SELECT inv_id, item_id, units, price, location FROM inventory ORDER BY inv_id, position"
+    SQL_SELECT_ITEM = "SELECT item_id, units, price, location FROM inventory WHERE inv_id = ? AND item_id = ?"
+    SQL_FIND_ROW = (
+        "SELECT inv_id, item_id, units, price, location FROM inventory"
+        " WHERE item_id = ? AND location = ? ORDER BY inv_id LIMIT 1"
+    )
+    SQL_DELETE_INVENTORY = "DELETE FROM inventory WHERE inv_id = ?"
+    SQL_INSERT_ITEM = (
+        "INSERT INTO inventory (inv_id, item_id, position, units, price, location) VALUES (?, ?, ?, ?, ?, ?)"
+    )
+    SQL_UPSERT_ITEM = (
+        "INSERT INTO inventory (inv_id, item_id, position, units, price, location)"
+        " VALUES (?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM inventory WHERE inv_id = ?), ?, ?, ?)"
+        " ON CONFLICT (inv_id, item_id) DO UPDATE SET"
+        " units = excluded.units, price = excluded.price, location = excluded.location"
+    )
+    SQL_SELECT_RECORDS = "SELECT body FROM signed_records ORDER BY seq"
+    SQL_INSERT_RECORD = "INSERT INTO signed_records (body) VALUES (?)"
+    SQL_DELETE_RECORDS = "DELETE FROM signed_records"
+    SQL_SELECT_BLOCKS = "SELECT body FROM blocks ORDER BY block_index"
+    SQL_INSERT_BLOCK = "INSERT OR IGNORE INTO blocks (block_index, body) VALUES (?, ?)"
+    SQL_DELETE_BLOCKS = "DELETE FROM blocks"
+    SQL_SAVE_JOB = (
+        "INSERT INTO sign_jobs (job_id, body) VALUES (?, ?)"
+        " ON CONFLICT (job_id) DO UPDATE SET body = excluded.body"
+    )
+    SQL_LOAD_JOB = "SELECT body FROM sign_jobs WHERE job_id = ?"
+    SQL_TRIM_JOBS = "DELETE FROM sign_jobs WHERE seq <= (SELECT MAX(seq) FROM sign_jobs) - ?"
+    SQL_SELECT_KEYS = "SELECT body FROM node_keys ORDER BY seq"
+    SQL_INSERT_KEY = "INSERT OR IGNORE INTO node_keys (key_id, body) VALUES (?, ?)"
+
+    def __init__(self, db_path, inventory_ids=None, timeout=30.0, run_id=None):
+        self.db_path = db_path
+        self.inventory_ids = list(inventory_ids or INVENTORY_IDS)
+        self.timeout = timeout
+        self.run_id = run_id
+        # Stored in the 'seeded' row: 1 for a permanent claim, otherwise a 63-bit hash of the run id
+        self._run_token = 1 if run_id is None else \
+            int.from_bytes(hashlib.sha256(str(run_id).encode('utf-8')).digest()[:8], 'big') >> 1 | 2
+        self._local = threading.local()
+        self._loaded = {}  # The rows returned by the last load_inventories()
+        self._exclusive_lock = _InterProcessLock(f"{db_path}.lock")
+        conn = self._connection()
+        with self._write(conn):
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connection(self):
+        """Returns this thread's connection, opening a new one after a fork."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.timeout,
+                isolation_level=None,  # Transactions are managed explicitly
+                cached_statements=128,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, conn):
+        """Context manager for an IMMEDIATE write transaction."""
+        return _ImmediateTransaction(conn)
+
+    def claim_initialization(self):
+        conn = self._connection()
+        with self._write(conn):
+            claim = self.SQL_CLAIM_SEED if self.run_id is None else self.SQL_CLAIM_RUN
+            claimed = conn.execute(claim, (self._run_token,)).rowcount == 1
+        return claimed
+
+    def load_inventories(self):
+        # A row equal to the one at the same position in the previous load keeps that dict, and a node whose rows
+        # all match keeps its tuple, so the snapshot diff skips them by identity instead of comparing them
+        previous = self._loaded
+        inventories = {inv_id: [] for inv_id in self.inventory_ids}
+        for inv_id, item_id, units, price, location in self._connection().execute(self.SQL_SELECT_INVENTORY):
+            items = inventories.setdefault(inv_id, [])
+            old_items = previous.get(inv_id, ())
+            item = old_items[len(items)] if len(items) < len(old_items) else None
+            if item is None or (item["id"], item["units"], item["price"], item["location"]) != \
+                    (item_id, units, price, location):
+                item = {"id": item_id, "units": units, "price": price, "location": location}
+            items.append(item)
+        loaded = {}
+        for inv_id, items in inventories.items():
+            old_items = previous.get(inv_id)
+            unchanged = (old_items is not None and len(old_items) == len(items)
+                         and all(map(operator.is_, old_items, items)))
+            loaded[inv_id] = old_items if unchanged else tuple(items)
+        self._loaded = loaded  # Shared by every thread; a racing load at worst builds some dicts again
+        return dict(loaded)
+
+    def get_item(self, inv_id, item_id):
+        row = self._connection().execute(self.SQL_SELECT_ITEM, (inv_id, item_id)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "units": row[1], "price": row[2], "location": row[3]}
+
+    def find_row(self, item_id, location):
+        row = self._connection().execute(self.SQL_FIND_ROW, (item_id, location)).fetchone()
+        if row is None:
+            return None
+        return row[0], {"id": row[1], "units": row[2], "price": row[3], "location": row[4]}
+
+    def replace_inventory(self, inv_id, items):
+        conn = self._connection()
+        with self._write(conn):
+            conn.execute(self.SQL_DELETE_INVENTORY, (inv_id,))
+            conn.executemany(self.SQL_INSERT_ITEM, [
+                (inv_id, item["id"], position, item["units"], item["price"], item["location"])
+                for position, item in enumerate(items)
+            ])
+            conn.execute(self.SQL_BUMP_VERSION)
+
+    def upsert_item(self, inv_id, item):
+        conn = self._connection()
+        with self._write(conn):
+            conn.execute(self.SQL_UPSERT_ITEM, (
+                inv_id, item["id"], inv_id, item["units"], item["price"], item["location"]
+            ))
+            conn.execute(self.SQL_BUMP_VERSION)
+
+    def load_signed_records(self):
+        return [json.loads(body) for (body,) in self._connection().execute(self.SQL_SELECT_RECORDS)]
+
+    def append_signed_record(self, record):
+        conn = self._connection()
+        with self._write(conn):
+            conn.execute(self.SQL_INSERT_RECORD, (json.dumps(dict(record)),))
+            conn.execute(self.SQL_BUMP_VERSION)
+
+    def clear_signed_records(self):
+        conn = self._connection()
+        with self._write(conn):
+            conn.execute(self.SQL_DELETE_RECORDS)
+            conn.execute(self.SQL_DELETE_BLOCKS)
+            conn.execute(self.SQL_BUMP_VERSION)
+
+    def load_blocks(self):
+        return [json.loads(body) for (body,) in self._connection().execute(self.SQL_SELECT_BLOCKS)]
+
+    def append_block(self, block):
+        conn = self._connection()
+        with self._write(conn):
+            stored = conn.execute(self.SQL_INSERT_BLOCK, (block["index"], json.dumps(block))).rowcount == 1
+            if stored:
+                conn.execute(self.SQL_BUMP_VERSION)
+        return stored
+
+    def load_keys(self):
+        return [json.loads(body) for (body,) in self._connection().execute(self.SQL_SELECT_KEYS)]
+
+    def add_key(self, key_id, key_record):
+        conn = self._connection()
+        with self._write(conn):
+            stored = conn.execute(self.SQL_INSERT_KEY, (key_id, json.dumps(key_record))).rowcount == 1
+            if stored:
+                conn.execute(self.SQL_BUMP_VERSION)
+        return stored
+
+    def restore_image(self, inventories, signed_records, blocks, keys):
+        conn = self._connection()
+        with self._write(conn):
+            for inv_id, items in inventories.items():
+                conn.execute(self.SQL_DELETE_INVENTORY, (inv_id,))
+                conn.executemany(self.SQL_INSERT_ITEM, [
+                    (inv_id, item["id"], position, item["units"], item["price"], item["location"])
+                    for position, item in enumerate(items)
+                ])
+            conn.execute(self.SQL_DELETE_RECORDS)
+            conn.execute(self.SQL_DELETE_BLOCKS)
+            conn.executemany(self.SQL_INSERT_RECORD, [(json.dumps(dict(record)),) for record in signed_records])
+            conn.executemany(self.SQL_INSERT_BLOCK, [(block["index"], json.dumps(block)) for block in blocks])
+            conn.executemany(self.SQL_INSERT_KEY, [(key_id, json.dumps(record)) for key_id, record in keys.items()])
+            conn.execute(self.SQL_BUMP_VERSION)
+
+    def exclusive_lock(self):
+        return self._exclusive_lock
+
+    def save_job(self, job_id, body):
+        conn = self._connection()
+        with self._write(conn):
+            conn.execute(self.SQL_SAVE_JOB, (job_id, body))
+            conn.execute(self.SQL_TRIM_JOBS, (self.JOB_HISTORY,))
+
+    def load_job(self, job_id):
+        row = self._connection().execute(self.SQL_LOAD_JOB, (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def version(self):
+        return self._connection().execute(self.SQL_VERSION).fetchone()[0]
+
+    def instance_id(self):
+        return self._connection().execute(self.SQL_INSTANCE).fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _InterProcessLock:
+    """
+    Held by one thread of one process at a time: a thread lock within the
+    process plus flock() on a lock file across processes. The file is
+    re-opened after a fork, as a child shares its parent's open file (and
+    with it the flock).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if fcntl is None:
+            return True
+        try:
+            if self._file is None or self._pid != os.getpid():
+                if self._file is not None:
+                    self._file.close()
+                self._file = open(self.path, "a+b")
+                self._pid = os.getpid()
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return True
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class _ImmediateTransaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK, so concurrent writers queue on the lock up front."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def create_store(backend, database_dir, inventory_ids=None):
+    """
+    Builds the storage backend named by `backend` ("file" or "sqlite").
+    The SQLite database lives next to the inventory files unless
+    INVENTORY_SQLITE_PATH points somewhere else.
+    """
+    backend = (backend or "file").lower()
+    if backend == "file":
+        return TextFileStore(database_dir, inventory_ids)
+    if backend == "sqlite":
+        db_path = os.environ.get("INVENTORY_SQLITE_PATH", os.path.join(database_dir, "inventory.sqlite3"))
+        return SQLiteStore(db_path, inventory_ids, run_id=os.environ.get("INVENTORY_RUN_ID"))
+    raise ValueError(f"Unknown storage backend: {backend}")
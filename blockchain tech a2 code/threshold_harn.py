@@ -0,0 +1,375 @@
+# threshold_harn.py
+# t-of-n Harn multisignature collection from concurrent node signers
+
+import math
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import harn_multisig
+import tracing
+
+
+class ThresholdNotReached(Exception):
+    """Raised when fewer than `threshold` signers produced a valid partial signature."""
+
+    def __init__(self, message, failed):
+        super().__init__(message)
+        self.failed = failed
+
+
+class NodeSigner:
+    """
+    One inventory's Harn signer: its identity, the secret key the PKG issued
+    for it, and its open signing sessions (session id -> random r_i).
+
+    A fresh r_i is drawn for every session and forgotten once used or
+    discarded. `delay` (seconds) and `available` let a benchmark or an
+    operator simulate a slow or unreachable node.
+    """
+
+    MAX_OPEN_SESSIONS = 10000
+
+    def __init__(self, node_id, identity, private_key, e, n, delay=0.0):
+        self.node_id = node_id
+        self.identity = identity
+        self.private_key = private_key
+        self.e = e
+        self.n = n
+        self.delay = delay
+        self.available = True
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _respond(self):
+        if self.delay:
+            time.sleep(self.delay)
+        if not self.available:
+            raise ConnectionError(f"signer {self.node_id} is unavailable")
+
+    def commit(self, session_id):
+        """Round 1: opens a session and returns the commitment t_i."""
+        self._respond()
+        while True:
+            random_val = secrets.randbelow(self.n - 2) + 2
+            if math.gcd(random_val, self.n) == 1:
+                break
+        with self._lock:
+            self._sessions[session_id] = random_val
+            while len(self._sessions) > self.MAX_OPEN_SESSIONS:
+                self._sessions.popitem(last=False)
+        return harn_multisig.commitment(random_val, self.e, self.n)
+
+    def sign(self, session_id, hash_val):
+        """Round 2: the partial signature s_i for the session's H(t, m). A session signs once."""
+        self._respond()
+        with self._lock:
+            random_val = self._sessions.pop(session_id, None)
+        if random_val is None:
+            raise KeyError(f"no open session {session_id} on signer {self.node_id}")
+        return harn_multisig.modular_partial_signature(self.private_key, random_val, hash_val, self.n)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class ThresholdHarn:
+    """
+    Collects a t-of-n Harn multisignature from `signers` (NodeSigners).
+
+    Both rounds are sent to the signers concurrently. Every signer has its
+    own executor of `max_in_flight` threads, so a slow signer can only tie up
+    its own threads, never the calls to the healthy ones. The commitment
+    round finishes as soon as `threshold` signers have answered. Those
+    signers form the signing set, and only they are asked for partials.
+    Every partial is checked on its own, so a signer that times out or
+    returns a bad partial is dropped and a new session is started with the
+    remaining signers, up to `max_attempts` times. A query therefore waits
+    for the t fastest healthy nodes rather than for all n.
+
+    A call's `timeout` runs from the moment it starts on the signer's
+    thread. A signer whose call is still queued when the others are done is
+    passed over without being blamed, and a signer that still has a
+    timed-out call running is skipped until that call returns.
+    """
+
+    def __init__(self, signers, threshold, e, n, timeout=2.0, max_attempts=3, max_in_flight=4):
+        if not 1 <= threshold <= len(signers):
+            raise ValueError(f"threshold must be between 1 and {len(signers)}")
+        self.signers = {signer.node_id: signer for signer in signers}
+        self.threshold = threshold
+        self.e = e
+        self.n = n
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.executors = {node_id: ThreadPoolExecutor(max_workers=max_in_flight,
+                                                      thread_name_prefix=f"harn-signer-{node_id}")
+                          for node_id in self.signers}
+        self._late = {}  # node_id -> the signer's most recent call that outlived its timeout
+        self._lock = threading.Lock()
+        self._stats = {"signatures": 0, "failures": 0, "attempts": 0,
+                       "node_failures": {node_id: 0 for node_id in self.signers},
+                       "node_skips": {node_id: 0 for node_id in self.signers}}
+
+    def _busy(self, node_id):
+        """True while the signer is still running a call that already timed out."""
+        late = self._late.get(node_id)
+        return late is not None and not late.done()
+
+    def _collect(self, calls, wanted):
+        """
+        Runs {node_id: fn} on the signers' executors until `wanted` results are
+        in or every call has finished or expired. A call expires `timeout`
+        after it started; one that never got a thread expires `timeout` after
+        submission and is cancelled (skipped). Returns ({node_id: result}, {node_id:
+        failure reason}, {node_id: future still running}, [node_ids never run]).
+        """
+        started = {}
+
+        def run(node_id, fn):
+            started[node_id] = time.monotonic()
+            return fn()
+
+        submitted = time.monotonic()
+        futures = {self.executors[node_id].submit(run, node_id, fn): node_id for node_id, fn in calls.items()}
+        results, failed, late, skipped = {}, {}, {}, []
+        pending = set(futures)
+        while pending and len(results) < wanted:
+            now = time.monotonic()
+            next_deadline = min(started.get(futures[future], submitted) + self.timeout for future in pending)
+            done, pending = wait(pending, timeout=max(next_deadline - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                node_id = futures[future]
+                try:
+                    results[node_id] = future.result()
+                except Exception as e:
+                    failed[node_id] = f"{type(e).__name__}: {e}"
+            now = time.monotonic()
+            for future in list(pending):
+                node_id = futures[future]
+                if node_id in started:
+                    if now >= started[node_id] + self.timeout:
+                        pending.discard(future)
+                        failed[node_id] = "timed out"
+                        late[node_id] = future
+                elif now >= submitted + self.timeout and future.cancel():
+                    pending.discard(future)
+                    skipped.append(node_id)
+        # Calls no longer needed: queued ones are dropped, running ones left to finish
+        for future in pending:
+            if not future.cancel():
+                late[futures[future]] = future
+        with self._lock:
+            for node_id, future in late.items():
+                if failed.get(node_id) == "timed out":
+                    self._late[node_id] = future
+        return results, failed, late, skipped
+
+    def _record_failures(self, failed, skipped=()):
+        with self._lock:
+            for node_id in failed:
+                self._stats["node_failures"][node_id] += 1
+            for node_id in skipped:
+                self._stats["node_skips"][node_id] += 1
+
+    def sign(self, message):
+        """
+        Returns {"signers", "commitment", "hash_value", "partial_signatures",
+        "aggregated_signature", "attempts"} for `message`, or raises
+        ThresholdNotReached.
+        """
+        excluded = {}
+        for node_id in self.signers:
+            if self._busy(node_id):
+                excluded[node_id] = "busy with a timed-out call"
+        self._record_failures((), excluded)
+        for attempt in range(1, self.max_attempts + 1):
+            with self._lock:
+                self._stats["attempts"] += 1
+            candidates = [node_id for node_id in self.signers if node_id not in excluded]
+            if len(candidates) < self.threshold:
+                break
+            session_id = uuid.uuid4().hex
+
+            with tracing.span("harn.commitments", attempt=attempt) as commit_span:
+                commitments, failed, late, skipped = self._collect(
+                    {node_id: (lambda s=self.signers[node_id], sid=session_id: s.commit(sid))
+                     for node_id in candidates},
+                    self.threshold)
+                commit_span.set(responded=sorted(commitments), failed=sorted(failed), skipped=sorted(skipped))
+            # Sessions opened by signers that answered too late, or were not needed, are discarded
+            for node_id, future in late.items():
+                future.add_done_callback(lambda _, s=self.signers[node_id], sid=session_id: s.discard(sid))
+            chosen = sorted(commitments)[:self.threshold] if len(commitments) >= self.threshold else []
+            for node_id in set(commitments) - set(chosen):
+                self.signers[node_id].discard(session_id)
+            excluded.update(failed)
+            excluded.update((node_id, "not started in time") for node_id in skipped)
+            self._record_failures(failed, skipped)
+            if not chosen:
+                # Signers still running a slow commit were passed over; they are not to blame yet
+                for node_id in candidates:
+                    if node_id not in commitments and node_id not in excluded:
+                        excluded[node_id] = "no answer"
+                continue
+
+            with tracing.span("harn.hash_message"):
+                aggregated_commitment = harn_multisig.aggregate_commitments(
+                    (commitments[node_id] for node_id in chosen), self.n)
+                hash_val = harn_multisig.signing_hash(aggregated_commitment, message)
+
+            with tracing.span("harn.partial_signatures", signers=chosen) as partial_span:
+                partials, failed, late, skipped = self._collect(
+                    {node_id: (lambda s=self.signers[node_id], sid=session_id: s.sign(sid, hash_val))
+                     for node_id in chosen},
+                    len(chosen))
+                for node_id, partial in list(partials.items()):
+                    signer = self.signers[node_id]
+                    if not harn_multisig.verify_partial_signature(signer.identity, commitments[node_id], partial,
+                                                                  hash_val, self.e, self.n):
+                        del partials[node_id]
+                        failed[node_id] = "invalid partial signature"
+                partial_span.set(failed=sorted(failed), skipped=sorted(skipped))
+            if failed or skipped:
+                print(f"Threshold Harn: attempt {attempt} lost signers {failed or skipped}; retrying without them")
+                for node_id in skipped:
+                    self.signers[node_id].discard(session_id)
+                excluded.update(failed)
+                excluded.update((node_id, "not started in time") for node_id in skipped)
+                self._record_failures(failed, skipped)
+                continue
+
+            with tracing.span("harn.aggregate_signatures"):
+                aggregated_signature = harn_multisig.aggregate_modular_signatures(
+                    (partials[node_id] for node_id in chosen), self.n)
+            with self._lock:
+                self._stats["signatures"] += 1
+            return {
+                "signers": chosen,
+                "commitment": aggregated_commitment,
+                "hash_value": hash_val,
+                "partial_signatures": {node_id: partials[node_id] for node_id in chosen},
+                "aggregated_signature": aggregated_signature,
+                "attempts": attempt,
+            }
+
+        with self._lock:
+            self._stats["failures"] += 1
+        raise ThresholdNotReached(
+            f"Only {len(self.signers) - len(excluded)} of {len(self.signers)} signers available; "
+            f"{self.threshold} partial signatures are required.", excluded)
+
+    def verify(self, signers, aggregated_commitment, message, aggregated_signature):
+        """
+        Checks a multisignature produced by sign(): at least `threshold`
+        distinct known signers, and the Harn equation over exactly that subset.
+        """
+        signers = set(signers)
+        if len(signers) < self.threshold or not signers <= set(self.signers):
+            return False
+        identities = [self.signers[node_id].identity for node_id in sorted(signers)]
+        return harn_multisig.verify_modular_multisignature(identities, aggregated_commitment, message,
+                                                           aggregated_signature, self.e, self.n)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, node_failures=dict(self._stats["node_failures"]),
+                         node_skips=dict(self._stats["node_skips"]))
+        stats.update(threshold=self.threshold, signers=sorted(self.signers), timeout=self.timeout,
+                     delays={node_id: signer.delay for node_id, signer in self.signers.items() if signer.delay},
+                     unavailable=sorted(node_id for node_id, signer in self.signers.items() if not signer.available),
+                     busy=sorted(node_id for node_id in self.signers if self._busy(node_id)))
+        return stats
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_signers(identities, d, e, n, delays=None):
+    """NodeSigners for {node_id: identity}, with secret keys issued by the PKG key (d, e, n)."""
+    delays = delays or {}
+    return [NodeSigner(node_id, identity, harn_multisig.issue_private_key(identity, d, n), e, n,
+                       delay=delays.get(node_id, 0.0))
+            for node_id, identity in identities.items()]
+
+
+def parse_delays(spec):
+    """Parses "D:2.5,C:0.1" into {"D": 2.5, "C": 0.1}."""
+    delays = {}
+    for part in filter(None, (part.strip() for part in (spec or "").split(","))):
+        node_id, _, seconds = part.partition(":")
+        delays[node_id.strip()] = float(seconds)
+    return delays
+
+
+if __name__ == "__main__":
+    # Benchmark: query signing latency with a slow node, all-of-n sequential vs t-of-n concurrent
+    import pkg_keys
+
+    params = pkg_keys.calculate_params()["pkg"]
+    e, d, n = params["e"], params["d"], params["n"]
+    message = harn_multisig.query_message("001", "32")
+    rounds = 20
+
+    def sequential(signers):
+        # Every node in turn, both rounds, as a non-threshold scheme must
+        session_id = uuid.uuid4().hex
+        commitments = [signer.commit(session_id) for signer in signers]
+        aggregated = harn_multisig.aggregate_commitments(commitments, n)
+        hash_val = harn_multisig.signing_hash(aggregated, message)
+        partials = [signer.sign(session_id, hash_val) for signer in signers]
+        return aggregated, harn_multisig.aggregate_modular_signatures(partials, n)
+
+    for label, delays in (("all nodes healthy", {}), ("node D slow (300 ms)", {"D": 0.3}),
+                          ("nodes C, D slow (300 ms)", {"C": 0.3, "D": 0.3})):
+        signers = create_signers(pkg_keys.IDENTITIES, d, e, n, delays)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            aggregated, signature = sequential(signers)
+        sequential_ms = (time.perf_counter() - start) / rounds * 1000
+        assert harn_multisig.verify_modular_multisignature(list(pkg_keys.IDENTITIES.values()), aggregated,
+                                                           message, signature, e, n)
+
+        harn = ThresholdHarn(signers, threshold=3, e=e, n=n, timeout=1.0)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = harn.sign(message)
+        threshold_ms = (time.perf_counter() - start) / rounds * 1000
+        assert harn.verify(result["signers"], result["commitment"], message, result["aggregated_signature"])
+        print(f"{label}: 4-of-4 sequential {sequential_ms:.1f} ms, 3-of-4 concurrent {threshold_ms:.1f} ms "
+              f"(signed by {','.join(result['signers'])})")
+        harn.close()
+
+    # A node slower than the timeout must not stall later queries: its calls only occupy its own threads
+    harn = ThresholdHarn(create_signers(pkg_keys.IDENTITIES, d, e, n, {"D": 2.5}), threshold=3, e=e, n=n, timeout=2.0)
+    start = time.perf_counter()
+    results = [harn.sign(message) for _ in range(40)]
+    assert all(harn.verify(r["signers"], r["commitment"], message, r["aggregated_signature"]) for r in results)
+    assert not any(harn.stats()["node_failures"].values())
+    print(f"Node D slower than the timeout (2.5 s): 40 queries in a row in {time.perf_counter() - start:.2f} s, "
+          f"no signer blamed")
+    harn.close()
+
+    signers = create_signers(pkg_keys.IDENTITIES, d, e, n)
+    signers[3].available = False
+    harn = ThresholdHarn(signers, threshold=3, e=e, n=n, timeout=1.0)
+    result = harn.sign(message)
+    try:
+        sequential(signers)
+        sequential_outcome = "succeeds"
+    except ConnectionError as e:
+        sequential_outcome = f"fails ({e})"
+    print(f"Node D down: 3-of-4 signed by {','.join(result['signers'])}, "
+          f"verifies {harn.verify(result['signers'], result['commitment'], message, result['aggregated_signature'])}; "
+          f"4-of-4 sequential {sequential_outcome}")
+    signers[2].available = False
+    try:
+        harn.sign(message)
+    except ThresholdNotReached as e:
+        print(f"Nodes C, D down: {e}")
+    harn.close()
@@ -0,0 +1,299 @@
+# tracing.py
+# Request tracing: nested spans with trace ids, tail-based sampling, rotating JSONL export
+
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+# The span the calling code is running inside, if any (per thread / per context)
+_current_span = contextvars.ContextVar("tracing_current_span", default=None)
+
+
+class _NullSpan:
+    """Stand-in when no trace is active or tracing is off: every call is a no-op."""
+    trace_id = None
+    span_id = None
+
+    def set(self, **attrs):
+        pass
+
+    def mark_error(self, reason):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "error")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self.error = None
+
+
+class Span:
+    """
+    One timed step of a trace. Use as a context manager; an exception leaving
+    the block marks the span (and so the trace) as failed.
+    """
+    __slots__ = ("tracer", "trace", "name", "span_id", "parent_id", "attrs",
+                 "wall_start", "start", "duration", "thread_id", "_token")
+
+    def __init__(self, tracer, trace, name, parent_id, attrs):
+        self.tracer = tracer
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.wall_start = None
+        self.start = None
+        self.duration = None
+        self.thread_id = None
+        self._token = None
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    def set(self, **attrs):
+        """Adds attributes (shown as args in the trace viewer)."""
+        self.attrs.update(attrs)
+
+    def mark_error(self, reason):
+        """Flags the span as failed without raising; failed traces are always kept."""
+        self.attrs["error"] = reason
+        if self.trace.error is None:
+            self.trace.error = reason
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self._token = _current_span.set(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.mark_error(f"{exc_type.__name__}: {exc}")
+        self.trace.spans.append(self)
+        if self.parent_id is None:
+            self.tracer._finish(self)
+        return False
+
+    def to_event(self, pid):
+        """The span as a Chrome trace-event 'complete' event (microsecond timestamps)."""
+        args = dict(self.attrs, trace_id=self.trace.trace_id, span_id=self.span_id)
+        if self.parent_id is not None:
+            args["parent_id"] = self.parent_id
+        return {"name": self.name, "cat": "request", "ph": "X", "ts": int(self.wall_start * 1e6),
+                "dur": max(int(self.duration * 1e6), 1), "pid": pid, "tid": self.thread_id, "args": args}
+
+
+def current_span():
+    """The active span, or NULL_SPAN."""
+    return _current_span.get() or NULL_SPAN
+
+
+def span(name, **attrs):
+    """
+    A child span of the active span. Outside a trace this returns NULL_SPAN,
+    so library code can be instrumented at almost no cost to untraced calls.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NULL_SPAN
+    return Span(parent.tracer, parent.trace, name, parent.span_id, attrs)
+
+
+class TraceFileWriter:
+    """
+    Appends trace events to a JSON-lines file on a background thread and
+    rotates it at `max_bytes` (path -> path.1 -> ... -> path.<backups>).
+    Traces arriving while `max_queued` are waiting are dropped and counted.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=3, max_queued=1000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, events):
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5):
+        """Waits until every submitted trace has been written."""
+        done = threading.Event()
+        self._queue.put(done, timeout=timeout)
+        done.wait(timeout)
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _run(self):
+        while True:
+            events = self._queue.get()
+            if isinstance(events, threading.Event):
+                events.set()
+                continue
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(event, separators=(",", ":"), default=str) + "\n"
+                                    for event in events))
+            except OSError as e:
+                print(f"Tracing: could not write {self.path}: {e}")
+
+
+class Tracer:
+    """
+    Starts traces and decides, once the root span ends, whether to keep them.
+
+    Tail-based sampling: every span of a trace is buffered in memory until
+    the trace finishes. The trace is then kept if the root took at least
+    `slow_ms`, if any span failed, or otherwise with probability
+    `sample_rate`; kept traces go to `writer`, the rest are discarded.
+    The newest `recent` kept traces are summarized by stats().
+    """
+
+    def __init__(self, writer=None, slow_ms=500.0, sample_rate=0.01, recent=50):
+        self.writer = writer
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.pid = os.getpid()
+        self._recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+        self._stats = {"traces": 0, "kept_slow": 0, "kept_error": 0, "kept_sampled": 0, "discarded": 0}
+
+    def trace(self, name, **attrs):
+        """A span that starts a new trace, or a child span if one is already active."""
+        parent = _current_span.get()
+        if parent is not None:
+            return Span(self, parent.trace, name, parent.span_id, attrs)
+        return Span(self, _Trace(), name, None, attrs)
+
+    def _finish(self, root):
+        duration_ms = root.duration * 1000
+        if root.trace.error is not None:
+            reason = "error"
+        elif duration_ms >= self.slow_ms:
+            reason = "slow"
+        elif random.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            reason = None
+        with self._lock:
+            self._stats["traces"] += 1
+            if reason is None:
+                self._stats["discarded"] += 1
+                return
+            self._stats[f"kept_{reason}"] += 1
+            self._recent.append({"trace_id": root.trace_id, "name": root.name, "reason": reason,
+                                 "duration_ms": round(duration_ms, 2), "spans": len(root.trace.spans),
+                                 "started": root.wall_start, "error": root.trace.error})
+        if self.writer is not None:
+            self.writer.submit([s.to_event(self.pid) for s in root.trace.spans])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["recent"] = list(reversed(self._recent))
+        stats.update(slow_ms=self.slow_ms, sample_rate=self.sample_rate)
+        if self.writer is not None:
+            stats.update(file=self.writer.path, dropped=self.writer.dropped)
+        return stats
+
+
+class DisabledTracer:
+    """Tracer with tracing switched off."""
+
+    def trace(self, name, **attrs):
+        return NULL_SPAN
+
+    def stats(self):
+        return {"enabled": False}
+
+
+def read_events(paths, trace_id=None):
+    """Trace events from JSONL files (oldest file first), optionally only one trace's."""
+    events = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                event = json.loads(line)
+                if trace_id is None or event["args"].get("trace_id") == trace_id:
+                    events.append(event)
+    return events
+
+
+if __name__ == "__main__":
+    # Usage: python tracing.py view <traces.jsonl> [trace_id] > trace.json
+    #        python tracing.py benchmark
+    # `view` wraps the JSONL events (rotated files included) in the Chrome trace format,
+    # which chrome://tracing and https://ui.perfetto.dev open directly
+    import sys
+
+    if len(sys.argv) > 2 and sys.argv[1] == "view":
+        base = sys.argv[2]
+        rotated = sorted((p for p in (f"{base}.{i}" for i in range(1, 100)) if os.path.exists(p)),
+                         key=lambda p: -int(p.rsplit(".", 1)[1]))
+        events = read_events(rotated + [base], sys.argv[3] if len(sys.argv) > 3 else None)
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, sys.stdout)
+    else:
+        import tempfile
+
+        count = 100000
+        start = time.perf_counter()
+        for _ in range(count):
+            with span("untraced"):
+                pass
+        untraced_us = (time.perf_counter() - start) / count * 1e6
+
+        path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+        tracer = Tracer(TraceFileWriter(path), slow_ms=1000, sample_rate=0.0)
+        start = time.perf_counter()
+        for _ in range(count // 10):
+            with tracer.trace("request"):
+                for _ in range(9):
+                    with span("step"):
+                        pass
+        traced_us = (time.perf_counter() - start) / count * 1e6
+        with tracer.trace("slow request"):
+            with span("step"):
+                time.sleep(1.0)
+        tracer.writer.flush()
+        print(f"span() outside a trace: {untraced_us:.2f} us; span inside a discarded trace: {traced_us:.2f} us")
+        print(f"Kept {len(read_events([path]))} events of the slow trace in {path}: {tracer.stats()['recent'][0]}")
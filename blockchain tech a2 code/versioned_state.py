@@ -0,0 +1,285 @@
+# versioned_state.py
+# Copy-on-write, versioned snapshots of the application state
+
+import itertools
+import threading
+from collections import deque
+
+
+class StateSnapshot:
+    """
+    One immutable version of the inventories and the signed-record ledger.
+
+    inventories maps inventory id -> tuple of item dicts, signed_records is
+    a tuple of record dicts and blocks a tuple of sealed ledger blocks. Nothing reachable from a published snapshot is
+    ever modified: writers build a new snapshot instead, so a reader holding
+    a snapshot always sees one consistent version, however long it keeps it.
+    """
+    __slots__ = ("version", "inventories", "signed_records", "blocks", "_derived", "_derived_lock")
+
+    def __init__(self, version, inventories, signed_records, blocks=()):
+        self.version = version
+        self.inventories = inventories
+        self.signed_records = signed_records
+        self.blocks = blocks
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, name, build):
+        """
+        Returns a structure computed from this snapshot (an index, a cache...),
+        calling build(snapshot) at most once per snapshot. Because snapshots
+        never change, the result stays valid for as long as the snapshot lives.
+        """
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = build(self)
+                    self._derived[name] = value
+        return value
+
+    def inventories_as_lists(self):
+        """Returns a JSON-friendly {inventory_id: [items]} copy of the inventories."""
+        return {inv_id: list(items) for inv_id, items in self.inventories.items()}
+
+
+class PartitionedRows:
+    """
+    One inventory's rows held as several immutable parts (the shards of a
+    sharding.ShardedStore) instead of one tuple, so publishing a change to
+    one part does not copy the others. Iterating yields the rows part by
+    part; get(item_id) asks only the part that part_of(item_id) names,
+    through that part's own get(). diff_snapshots compares two of these part
+    by part and skips the parts that are the same object.
+    """
+    __slots__ = ("parts", "part_of", "_length")
+
+    def __init__(self, parts, part_of):
+        self.parts = tuple(parts)
+        self.part_of = part_of
+        self._length = sum(map(len, self.parts))
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.parts)
+
+    def get(self, item_id):
+        """Returns the row with this id (the first, if several), or None."""
+        return self.parts[self.part_of(item_id)].get(item_id)
+
+
+def diff_snapshots(previous, snapshot):
+    """
+    Lists the row-level changes between two snapshots, in a stable order:
+      {"kind": "upsert", "inventory": inv_id, "item": item}
+      {"kind": "remove", "inventory": inv_id, "item_id": item_id}
+      {"kind": "signed_record", "record": record}
+      {"kind": "block", "block": block}
+      {"kind": "ledger_reset"}
+    Inventories that share the same tuple are skipped without being compared.
+    """
+    changes = []
+    for inv_id, rows in snapshot.inventories.items():
+        old_rows = previous.inventories.get(inv_id, ())
+        if old_rows is not rows:
+            changes.extend(_row_changes(inv_id, old_rows, rows))
+    for inv_id, old_rows in previous.inventories.items():
+        if inv_id not in snapshot.inventories:
+            for item in old_rows:
+                changes.append({"kind": "remove", "inventory": inv_id, "item_id": item["id"]})
+
+    old_records, records = previous.signed_records, snapshot.signed_records
+    if records is not old_records:
+        if records[:len(old_records)] == old_records:
+            new_records = records[len(old_records):]
+        else:
+            changes.append({"kind": "ledger_reset"})
+            new_records = records
+        for record in new_records:
+            changes.append({"kind": "signed_record", "record": record})
+
+    old_blocks, blocks = previous.blocks, snapshot.blocks
+    if blocks is not old_blocks:
+        new_blocks = blocks[len(old_blocks):] if blocks[:len(old_blocks)] == old_blocks else blocks
+        for block in new_blocks:
+            changes.append({"kind": "block", "block": block})
+    return changes
+
+
+def _row_changes(inv_id, old_rows, rows):
+    """
+    Upserts and removals between two versions of one inventory. Stores
+    replace a changed row with a new dict and append new rows at the end, so
+    the rows are first walked position by position, skipping rows that are
+    the same object; only when the ids stop lining up (a removal or a
+    reordering) are the rows matched by id instead.
+    """
+    if isinstance(old_rows, PartitionedRows) and isinstance(rows, PartitionedRows) and \
+            len(old_rows.parts) == len(rows.parts):
+        return [change for old_part, part in zip(old_rows.parts, rows.parts) if old_part is not part
+                for change in _row_changes(inv_id, old_part, part)]
+    changes = []
+    if len(rows) >= len(old_rows):
+        for old, item in zip(old_rows, rows):
+            if old is item:
+                continue
+            if old["id"] != item["id"]:
+                break
+            if old != item:
+                changes.append({"kind": "upsert", "inventory": inv_id, "item": item})
+        else:
+            changes.extend({"kind": "upsert", "inventory": inv_id, "item": item}
+                           for item in itertools.islice(rows, len(old_rows), None))
+            return changes
+        changes = []
+
+    old_by_id = {item["id"]: item for item in old_rows}
+    new_ids = set()
+    for item in rows:
+        new_ids.add(item["id"])
+        old = old_by_id.get(item["id"])
+        if old is not item and old != item:
+            changes.append({"kind": "upsert", "inventory": inv_id, "item": item})
+    for item in old_rows:
+        if item["id"] not in new_ids:
+            changes.append({"kind": "remove", "inventory": inv_id, "item_id": item["id"]})
+    return changes
+
+
+class VersionedState:
+    """
+    Holds the current StateSnapshot.
+
+    Readers call current() and get the latest published snapshot without
+    taking any lock (a single attribute read is atomic). Writers serialize on
+    a lock only among themselves, build the next snapshot off to the side and
+    publish it with one reference assignment.
+
+    Listeners registered with add_listener() are called after each publish
+    with (snapshot, changes), where changes comes from diff_snapshots(). They
+    run after the writer lock is released, so a slow listener does not hold
+    up the next publish, but one at a time and in publish order.
+    """
+
+    def __init__(self):
+        self._current = StateSnapshot(None, {}, ())
+        self._write_lock = threading.Lock()
+        self._listeners = []
+        self._pending = deque()  # (snapshot, changes) published but not yet passed to the listeners
+        self._notify_lock = threading.Lock()
+
+    def current(self):
+        """Returns the latest published snapshot."""
+        return self._current
+
+    def add_listener(self, listener):
+        """Registers listener(snapshot, changes) to be told about every new version."""
+        with self._write_lock, self._notify_lock:
+            self._listeners.append(listener)
+
+    def publish(self, version, inventories, signed_records, blocks=()):
+        """
+        Publishes a new snapshot of `inventories` ({inventory_id: item dicts}),
+        `signed_records` and `blocks`. Nothing is copied row by row: stores
+        hand out tuples of rows they never modify, so an unchanged inventory
+        is the previous snapshot's tuple and an unchanged row the previous
+        row's dict, and only the changed rows are new. PartitionedRows are
+        kept as they are too. Other sequences are turned into tuples of the
+        same dicts, which must not be modified after.
+
+        Versions never go back: a publish with a lower version than the
+        current snapshot's (a writer that read the store before another one
+        published) is ignored, and the current snapshot is returned.
+        Re-publishing the current version is allowed.
+        """
+        with self._write_lock:
+            previous = self._current
+            if version is not None and previous.version is not None and version < previous.version:
+                return previous
+            frozen = {inv_id: items if isinstance(items, (tuple, PartitionedRows)) else tuple(items)
+                      for inv_id, items in inventories.items()}
+            records = tuple(signed_records)
+            if records == previous.signed_records:
+                records = previous.signed_records
+            blocks = tuple(blocks)
+            if blocks == previous.blocks:
+                blocks = previous.blocks
+            snapshot = StateSnapshot(version, frozen, records, blocks)
+            self._current = snapshot
+            if self._listeners:
+                self._pending.append((snapshot, diff_snapshots(previous, snapshot)))
+        self._notify()
+        return snapshot
+
+    def _notify(self):
+        """
+        Passes queued versions to the listeners, oldest first. Whichever
+        publisher gets the lock drains the queue, so when publish() returns
+        the listeners have seen its version.
+        """
+        with self._notify_lock:
+            while self._pending:
+                snapshot, changes = self._pending.popleft()
+                for listener in self._listeners:
+                    try:
+                        listener(snapshot, changes)
+                    except Exception as e:
+                        print(f"Error in state listener {listener!r}: {e}")
+
+
+if __name__ == "__main__":
+    # Stress test: writers keep republishing while readers check that every
+    # snapshot they grab is internally consistent (no torn reads) and that
+    # versions never go back, even though the writers race each other.
+    import itertools
+    import time
+
+    state = VersionedState()
+    inventory_ids = ["A", "B", "C", "D"]
+    state.publish(0, {inv_id: [] for inv_id in inventory_ids}, [])
+    stop = threading.Event()
+    errors = []
+    reads = [0]
+    versions = itertools.count(1)
+    published = []
+    state.add_listener(lambda snapshot, changes: published.append(snapshot.version))
+
+    def writer():
+        while not stop.is_set():
+            version = next(versions)  # Taken before building, so writers often publish out of order
+            items = [{"id": f"{i:03d}", "units": str(version), "price": "1", "location": "A"}
+                     for i in range(version % 50)]
+            state.publish(version, {inv_id: items for inv_id in inventory_ids},
+                          [{"version": version}] * (version % 50))
+
+    def reader():
+        last_version = -1
+        while not stop.is_set():
+            snapshot = state.current()
+            if snapshot.version < last_version:
+                errors.append(f"version went back from {last_version} to {snapshot.version}")
+            last_version = snapshot.version
+            counts = {len(items) for items in snapshot.inventories.values()}
+            unit_values = {item["units"] for items in snapshot.inventories.values() for item in items}
+            if len(counts) != 1 or counts.pop() != len(snapshot.signed_records):
+                errors.append(f"torn read at version {snapshot.version}")
+            if unit_values and unit_values != {str(snapshot.version)}:
+                errors.append(f"mixed versions in snapshot {snapshot.version}: {unit_values}")
+            reads[0] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(3)] + [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(2)
+    stop.set()
+    for t in threads:
+        t.join()
+    print(f"Readers completed {reads[0]} snapshot reads; final version {state.current().version}")
+    print(f"Listeners saw {len(published)} of {next(versions) - 1} publishes; stale ones were dropped")
+    print("No torn reads detected." if not errors else f"{len(errors)} inconsistent reads, e.g. {errors[0]}")
+    assert not errors
+    assert published == sorted(published), "listeners saw versions out of order"